@@ -4,3 +4,6 @@ from .notifications import router as notifications_router
 from .products import router as products_router
 from .categories import router as categories_router
 from .shipping import router as shipping_router
+from .metrics import router as metrics_router
+from .branches import router as branches_router
+from .admin import router as admin_router
@@ -0,0 +1,35 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile
+from sqlalchemy.orm import Session
+
+from app.core.deps import get_current_superuser
+from app.crud.catalog_import import import_catalog, format_for, CatalogImportError
+from app.crud.coupons import create_coupon, get_coupon
+from app.db import get_db
+from app.models import User
+from app.schemas.catalog_import import CatalogFormat, CatalogImportReport
+from app.schemas.coupon import CouponCreate, CouponResponse
+
+router = APIRouter()
+
+
+@router.post("/catalog/import", response_model=CatalogImportReport)
+def import_catalog_file(file: UploadFile, format: Optional[CatalogFormat] = None, db: Session = Depends(get_db),
+                        user: User = Depends(get_current_superuser)):
+    # the upload is spooled to disk by the form parser and streamed from there into COPY
+    try:
+        return import_catalog(db, file.file, format or format_for(file.filename))
+    except CatalogImportError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail={"line": e.line, "error": e.message})
+
+
+@router.post("/coupons", response_model=CouponResponse, status_code=status.HTTP_201_CREATED)
+def add_coupon(coupon: CouponCreate, db: Session = Depends(get_db), user: User = Depends(get_current_superuser)):
+    return create_coupon(db, coupon)
+
+
+@router.get("/coupons/{coupon_id}", response_model=CouponResponse)
+def read_coupon(coupon_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_superuser)):
+    return get_coupon(db, coupon_id)
@@ -1,7 +1,8 @@
 from fastapi import Depends, APIRouter, BackgroundTasks, HTTPException, Request
 from starlette import status
 from sqlalchemy.orm import Session
-from app.db.session import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.session import get_db, get_async_db
 from app.schemas.user import UserCreate, UserLogin, UserChangePassword, UserPasswordReset, UserUpdate, UserProfile
 from app.schemas.token import Token, RefreshToken
 from app.crud.user import create_user, login_user, get_refresh_token, logout_user, verify_user, change_user_password, \
@@ -15,12 +16,12 @@ router = APIRouter()
 
 
 @router.post('/register', response_model=Token, status_code=status.HTTP_201_CREATED)
-async def register(user: UserCreate, background_task: BackgroundTasks, db: Session = Depends(get_db)):
+async def register(user: UserCreate, background_task: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
     return await create_user(db, user, background_task)
 
 
 @router.post('/login', response_model=Token)
-async def login(credentials: UserLogin, background_task: BackgroundTasks, db: Session = Depends(get_db)):
+async def login(credentials: UserLogin, background_task: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
     return await login_user(db, credentials, background_task)
 
 
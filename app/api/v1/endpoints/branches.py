@@ -0,0 +1,29 @@
+from typing import List
+
+from fastapi import APIRouter, Depends, Query, Request, Response
+from sqlalchemy.orm import Session
+
+from app.core.utils import not_modified, not_modified_response, validator_headers
+from app.crud.branches import nearest_branches
+from app.crud.menus import get_branch_menu, sold_out_products, render_branch_menu
+from app.db import get_read_db
+from app.schemas.branch import NearestBranchResponse, BranchMenuResponse
+
+router = APIRouter()
+
+
+@router.get("/nearest", response_model=List[NearestBranchResponse])
+def get_nearest_branches(latitude: float = Query(ge=-90, le=90), longitude: float = Query(ge=-180, le=180),
+                         limit: int = Query(5, ge=1, le=50),
+                         covering: bool = Query(False, description="Only branches delivering to the point"),
+                         db: Session = Depends(get_read_db)):
+    return nearest_branches(db, latitude, longitude, limit, covering)
+
+
+@router.get("/{branch_id}/menu", response_model=BranchMenuResponse)
+def get_menu(branch_id: int, request: Request, db: Session = Depends(get_read_db)):
+    menu = get_branch_menu(db, branch_id)
+    body, etag = render_branch_menu(menu, sold_out_products(db, menu))
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    return Response(content=body, media_type="application/json", headers=validator_headers(etag))
@@ -1,27 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from typing import List
 from app.models import Category, SubCategory
-from app.db import get_db
-from app.schemas import CategoryResponse, SubCategoryResponse
+from app.db import get_read_db
+from app.crud.categories import get_category_tree
+from app.schemas import CategoryResponse, SubCategoryResponse, CategoryTreeResponse
+from app.core.utils import not_modified, not_modified_response, validator_headers
 
 router = APIRouter()
 
 
-@router.get("/list", response_model=List[CategoryResponse])
-def list_categories(db: Session = Depends(get_db)):
-    return db.query(Category).all()
+@router.get("/list", response_model=List[CategoryTreeResponse])
+def list_categories(request: Request, db: Session = Depends(get_read_db)):
+    tree = get_category_tree(db)
+    if not_modified(request, tree.etag, tree.last_modified):
+        return not_modified_response(tree.etag, tree.last_modified)
+    return Response(content=tree.body, media_type="application/json",
+                    headers=validator_headers(tree.etag, tree.last_modified))
 
 
 @router.get("/get/{category_id}", response_model=CategoryResponse)
-def get_category(category_id: int, db: Session = Depends(get_db)):
-    category = db.query(Category).filter(and_(Category.id == category_id)).first()
+def get_category(category_id: int, db: Session = Depends(get_read_db)):
+    category = db.query(Category).options(selectinload(Category.subcategories)).filter(
+        and_(Category.id == category_id)).first()
     if not category:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
     return category
 
 
 @router.get("/get/{category_id}/subcategories", response_model=List[SubCategoryResponse])
-def list_subcategories(category_id: int, db: Session = Depends(get_db)):
+def list_subcategories(category_id: int, db: Session = Depends(get_read_db)):
     return db.query(SubCategory).filter(and_(SubCategory.category_id == category_id)).all()
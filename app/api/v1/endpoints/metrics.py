@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends
+
+from app.core.deps import get_current_superuser
+
+from app.db.session import get_pool_stats
+from app.db.routing import get_replica_pool_stats
+from app.crud.products import product_cache
+from app.crud.branches import branch_index_cache
+from app.crud.popularity import popularity_cache
+from app.crud.categories import category_tree_cache
+from app.crud.menus import menu_cache
+from app.crud.order.pricing import price_cache
+from app.crud.coupons import coupon_index_cache
+
+# pool and cache internals, for operators only
+router = APIRouter(dependencies=[Depends(get_current_superuser)])
+
+
+@router.get("/db-pool")
+def db_pool_metrics():
+    return {**get_pool_stats(), **get_replica_pool_stats()}
+
+
+@router.get("/cache")
+def cache_metrics():
+    return {cache.name: cache.stats() for cache in (product_cache, branch_index_cache, popularity_cache,
+                                                        category_tree_cache, menu_cache, price_cache,
+                                                        coupon_index_cache)}
@@ -1,24 +1,26 @@
-from typing import List
-
 from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
 from sqlalchemy.orm import Session
 
 from app.core.deps import get_current_user
 from app.crud.notification import active_connections, update_notification_status
 from app.db import get_db
-from app.models import User
+from app.core.utils import paginate
+from app.models import User, Notification
 from app.schemas.notification import NotificationResponse, NotificationFilter
+from app.schemas.pagination import Page, PageParams
 
 router = APIRouter()
 
 
-@router.get("/list", response_model=List[NotificationResponse])
-def list_user_notifications(filter: NotificationFilter = Depends(), user: User = Depends(get_current_user)):
+@router.get("/list", response_model=Page[NotificationResponse])
+def list_user_notifications(filter: NotificationFilter = Depends(), page: PageParams = Depends(),
+                            db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    notifications = db.query(Notification).filter(Notification.user_id == user.id)
     if filter.status == "unread":
-        return [n for n in user.notifications if not n.is_read]
+        notifications = notifications.filter(Notification.is_read == False)
     elif filter.status == "read":
-        return [n for n in user.notifications if n.is_read]
-    return user.notifications
+        notifications = notifications.filter(Notification.is_read == True)
+    return paginate(notifications, Notification.id, page, descending=True)
 
 
 @router.put("/mark_as_read/{notification_id}")
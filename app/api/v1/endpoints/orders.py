@@ -1,45 +1,71 @@
-from typing import List
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Response
 
 from app.core.deps import get_current_user
-from app.db import get_db
+from app.db import get_db, get_async_db
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
 from app.models import User
-from app.schemas.order import OrderCreate, OrderResponse, OrderStatusEnum, OrderUpdateStatus
-from app.crud.order import create_order as order_creation, get_user_orders, get_order_by_id, order_cancellation, \
-    updating_order_status
+from app.schemas.order import OrderCreate, OrderResponse, OrderStatusEnum, OrderUpdateStatus, QuoteRequest, \
+    QuoteResponse
+from app.schemas.pagination import Page, PageParams
+from app.crud.order import create_order as order_creation, get_user_orders, get_order_detail, order_cancellation, \
+    updating_order_status, claim_idempotency_key, request_fingerprint, quote_cart
 from app.core import logger
+from app.core.utils import json_response
 
 router = APIRouter()
 
 
 @router.post("/create", response_model=OrderResponse)
-async def create_order(request: OrderCreate, db: Session = Depends(get_db),
-                       user: User = Depends(get_current_user)):
+async def create_order(request: OrderCreate, db: AsyncSession = Depends(get_async_db),
+                       user: User = Depends(get_current_user),
+                       idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255,
+                                                               description="Retries with the same key get the "
+                                                                           "response of the first attempt")):
     try:
-        new_order = await order_creation(db, request, user)
-        db.commit()
-        return new_order
+        if idempotency_key is None:
+            new_order = await order_creation(db, request, user)
+            await db.commit()
+            return new_order
+        claim = await claim_idempotency_key(db, user.id, idempotency_key, request_fingerprint(request))
+        if claim.response is not None:
+            # replays never reach the catalog, the stored body is sent as it is
+            await db.rollback()
+            return Response(content=claim.response, media_type="application/json",
+                            headers={"Idempotent-Replayed": "true"})
+        new_order = await order_creation(db, request, user, claim.id)
+        return json_response(OrderResponse, new_order)
     except HTTPException as e:
         logger.error(e.detail)
-        db.rollback()
+        await db.rollback()
         raise e
+    except PoolTimeoutError:
+        # handled by the app wide 503 handler
+        raise
     except Exception as e:
         logger.error(str(e))
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
-@router.get("/list", response_model=List[OrderResponse])
-def list_orders(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    return get_user_orders(db, user.id)
+@router.post("/quote", response_model=QuoteResponse)
+async def quote_order(request: QuoteRequest, db: AsyncSession = Depends(get_async_db)):
+    # nothing is written, the session only ever reads the price table on a cache miss
+    return json_response(QuoteResponse, await quote_cart(db, request))
+
+
+@router.get("/list", response_model=Page[OrderResponse])
+def list_orders(page: PageParams = Depends(), db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    return get_user_orders(db, user.id, page)
 
 
 @router.get("/get/{order_id}", response_model=OrderResponse)
 def get_order(order_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    return get_order_by_id(db, order_id, user)
+    return Response(content=get_order_detail(db, order_id, user), media_type="application/json")
 
 
 @router.put("/cancel/{order_id}")
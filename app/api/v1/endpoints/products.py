@@ -1,45 +1,104 @@
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.core.deps import get_current_user
 from app.models import User
-from app.schemas.product import ProductsListResponse, ProductResponse
+from app.core.utils import is_conditional, not_modified, not_modified_response, validator_headers, json_response
+from app.schemas.product import ProductsListResponse, ProductResponse, ProductFilter, ProductFilterResponse
+from app.schemas.pagination import Page, PageParams, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from app.schemas.review import ReviewCreate, ReviewResponse, ReviewUpdate
-from app.crud.products import list_all_products, get_product_by_id, filter_products_by_branch, \
-    filter_products_by_category, filter_product_by_subcategory, create_product_review, update_product_review
-from app.db import get_db
+from app.schemas.catalog_import import CatalogFormat
+from app.crud.products import list_all_products, get_product_detail, filter_products_by_branch, \
+    filter_products_by_category, filter_product_by_subcategory, create_product_review, update_product_review, \
+    search_products, filter_products, list_product_reviews, product_list_etag, product_detail_validators, \
+    product_cache, export_products
+from app.crud.popularity import get_popular_products, POPULAR_TOP_K
+from app.db import get_db, get_read_db, open_read_session
 
 router = APIRouter()
 
 
-@router.get("/list", response_model=List[ProductsListResponse])
-def list_products(db: Session = Depends(get_db)):
-    return list_all_products(db)
+@router.get("/list", response_model=Page[ProductsListResponse])
+def list_products(request: Request, page: PageParams = Depends(), db: Session = Depends(get_read_db)):
+    etag = product_list_etag(db, page)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    return json_response(Page[ProductsListResponse], list_all_products(db, page), headers=validator_headers(etag))
 
 
-@router.get("/get/{product_id}", response_model=ProductResponse)
-def get_product(product_id: int, db: Session = Depends(get_db)):
-    return get_product_by_id(db, product_id)
+@router.get("/filter", response_model=ProductFilterResponse)
+def filter_listed_products(filters: ProductFilter = Depends(), page: PageParams = Depends(),
+                           db: Session = Depends(get_read_db)):
+    return json_response(ProductFilterResponse, filter_products(db, filters, page))
+
+
+@router.get("/search", response_model=List[ProductsListResponse])
+def search(q: str = Query(min_length=1, max_length=200), branch_id: Optional[int] = None,
+           category_id: Optional[int] = None, subcategory_id: Optional[int] = None,
+           limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), db: Session = Depends(get_read_db)):
+    products = search_products(db, q, limit, branch_id, category_id, subcategory_id)
+    return json_response(List[ProductsListResponse], products)
+
+
+EXPORT_MEDIA_TYPES = {CatalogFormat.NDJSON: "application/x-ndjson", CatalogFormat.CSV: "text/csv"}
+
 
+@router.get("/export", response_class=StreamingResponse)
+def export(request: Request, format: CatalogFormat = CatalogFormat.NDJSON):
+    # the session has to outlive the dependencies, which are closed before the body is streamed
+    return StreamingResponse(export_products(open_read_session(request), format),
+                             media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="products.{format.value}"'})
 
-@router.get("/branch/", response_model=List[ProductsListResponse])
+
+@router.get("/popular", response_model=List[ProductsListResponse])
+def popular_products(branch_id: Optional[int] = None, category_id: Optional[int] = None,
+                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=POPULAR_TOP_K), db: Session = Depends(get_read_db)):
+    # best sellers from the in-memory rankings, the database is only read when they are rebuilt
+    return json_response(List[ProductsListResponse], get_popular_products(db, limit, branch_id, category_id))
+
+
+@router.get("/get/{product_id}", response_model=ProductResponse)
+def get_product(product_id: int, request: Request, db: Session = Depends(get_read_db)):
+    if is_conditional(request) and product_id not in product_cache:
+        # answer revalidations from the row version alone instead of loading the whole product
+        validators = product_detail_validators(db, product_id)
+        if validators and not_modified(request, *validators):
+            return not_modified_response(*validators)
+
+    document = get_product_detail(db, product_id)
+    if not_modified(request, document.etag, document.last_modified):
+        return not_modified_response(document.etag, document.last_modified)
+    # the cached body is the serialized ProductResponse, sent without another validation
+    return Response(content=document.body, media_type="application/json",
+                    headers=validator_headers(document.etag, document.last_modified))
+
+
+@router.get("/branch/", response_model=Page[ProductsListResponse])
 def get_products_by_branch(branch_id: Optional[int] = None, branch_name: Optional[str] = None,
-                           db: Session = Depends(get_db)):
-    return filter_products_by_branch(db, branch_id, branch_name)
+                           page: PageParams = Depends(), db: Session = Depends(get_read_db)):
+    return json_response(Page[ProductsListResponse], filter_products_by_branch(db, page, branch_id, branch_name))
 
 
-@router.get("/category/", response_model=List[ProductsListResponse])
+@router.get("/category/", response_model=Page[ProductsListResponse])
 def get_products_by_category(category_id: Optional[int] = None, category_name: Optional[str] = None,
-                             db: Session = Depends(get_db)):
-    return filter_products_by_category(db, category_id, category_name)
+                             page: PageParams = Depends(), db: Session = Depends(get_read_db)):
+    return json_response(Page[ProductsListResponse], filter_products_by_category(db, page, category_id, category_name))
 
 
-@router.get("/subcategory/", response_model=List[ProductsListResponse])
+@router.get("/subcategory/", response_model=Page[ProductsListResponse])
 def get_products_by_category(subcategory_id: Optional[int] = None, subcategory_name: Optional[str] = None,
-                             db: Session = Depends(get_db)):
-    return filter_product_by_subcategory(db, subcategory_id, subcategory_name)
+                             page: PageParams = Depends(), db: Session = Depends(get_read_db)):
+    products = filter_product_by_subcategory(db, page, subcategory_id, subcategory_name)
+    return json_response(Page[ProductsListResponse], products)
+
+
+@router.get("/{product_id}/reviews", response_model=Page[ReviewResponse])
+def get_product_reviews(product_id: int, page: PageParams = Depends(), db: Session = Depends(get_read_db)):
+    return list_product_reviews(db, product_id, page)
 
 
 @router.post("/create-review", response_model=ReviewResponse, status_code=status.HTTP_201_CREATED)
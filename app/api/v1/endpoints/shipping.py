@@ -1,19 +1,22 @@
 from fastapi import HTTPException, APIRouter, Depends
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
-from typing import List
 
 from app.schemas.shipping import ShippingOrderResponse
+from app.schemas.pagination import Page, PageParams
 from app.core.deps import get_current_user
 from app.db import get_db
+from app.core.utils import paginate
 from app.models import User, ShippingOrder
 
 router = APIRouter()
 
 
-@router.get("/list", response_model=List[ShippingOrderResponse])
-def list_shipping_orders(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    return db.query(ShippingOrder).filter(and_(ShippingOrder.user_id == user.id)).all()
+@router.get("/list", response_model=Page[ShippingOrderResponse])
+def list_shipping_orders(page: PageParams = Depends(), db: Session = Depends(get_db),
+                         user: User = Depends(get_current_user)):
+    return paginate(db.query(ShippingOrder).filter(and_(ShippingOrder.user_id == user.id)), ShippingOrder.id, page,
+                    descending=True)
 
 
 @router.get("/get/{shipping_order_id}", response_model=ShippingOrderResponse)
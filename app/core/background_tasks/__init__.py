@@ -1,2 +1,5 @@
 from .auth_tasks import update_last_login, update_user_refresh_token
 from .email_tasks import send_email
+from .rating_tasks import backfill_product_ratings
+from .sales_tasks import flush_product_sales, flush_product_sales_periodically, SALES_FLUSH_INTERVAL
+from .idempotency_tasks import purge_idempotency_keys, purge_idempotency_keys_periodically, IDEMPOTENCY_PURGE_INTERVAL
@@ -0,0 +1,45 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.db.session import get_background_task_db
+from app.models import IdempotencyKey
+from app.core import logger
+from app.crud.order.idempotency import IDEMPOTENCY_KEY_TTL
+
+# seconds between two purges of the expired idempotency keys, 0 disables the purge loop
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", 3600))
+
+
+def purge_idempotency_keys() -> int:
+    """
+    Delete the idempotency keys older than IDEMPOTENCY_KEY_TTL. Returns the number of keys deleted.
+    """
+    db: Session = get_background_task_db()
+    try:
+        result = db.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.created_at < datetime.now() - timedelta(seconds=IDEMPOTENCY_KEY_TTL)))
+        db.commit()
+        if result.rowcount:
+            logger.info(f"{result.rowcount} expired idempotency keys purged")
+        return result.rowcount
+    except Exception as e:
+        db.rollback()
+        logger.error(e)
+        raise
+    finally:
+        db.close()
+
+
+async def purge_idempotency_keys_periodically(interval: float = IDEMPOTENCY_PURGE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(purge_idempotency_keys)
+        except Exception:
+            # logged by purge_idempotency_keys, expired keys are only claimed again meanwhile
+            pass
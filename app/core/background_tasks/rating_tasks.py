@@ -0,0 +1,57 @@
+from sqlalchemy import select, update, func, cast, Integer
+from sqlalchemy.dialects.postgresql import array, ARRAY
+from sqlalchemy.orm import Session
+
+from app.db.session import get_background_task_db
+from app.models import Product
+from app.models.product import ProductReview
+from app.core import logger
+
+
+def backfill_product_ratings(batch_size: int = 10_000) -> int:
+    """
+    Recompute rating_count, rating_sum and rating_histogram of every product from its reviews.
+
+    Runs one UPDATE ... FROM (aggregate) per `batch_size` products, each in its own transaction, so the
+    product rows are never locked for long. The batch is locked before the reviews are counted: a review
+    committed earlier is counted, one still in flight applies its increment after the batch commits.
+    Returns the number of products updated.
+    """
+    db: Session = get_background_task_db()
+    updated, last_id = 0, 0
+    try:
+        while True:
+            ids = db.execute(select(Product.id).where(Product.id > last_id).order_by(Product.id)
+                             .limit(batch_size).with_for_update()).scalars().all()
+            if not ids:
+                break
+            stats = (
+                select(
+                    Product.id.label("product_id"),
+                    func.count(ProductReview.id).label("count"),
+                    func.coalesce(func.sum(ProductReview.rating), 0).label("sum"),
+                    cast(array([func.count(ProductReview.id).filter(ProductReview.rating == rating)
+                                for rating in range(1, 6)]), ARRAY(Integer)).label("histogram"),
+                )
+                .outerjoin(ProductReview, ProductReview.product_id == Product.id)
+                .where(Product.id.between(ids[0], ids[-1]))
+                .group_by(Product.id)
+                .subquery()
+            )
+            result = db.execute(
+                update(Product)
+                .where(Product.id == stats.c.product_id)
+                .values(rating_count=stats.c.count, rating_sum=stats.c.sum, rating_histogram=stats.c.histogram)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            updated += result.rowcount
+            last_id = ids[-1]
+        logger.info(f"Rating aggregates backfilled for {updated} products")
+        return updated
+    except Exception as e:
+        db.rollback()
+        logger.error(e)
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,73 @@
+import asyncio
+import os
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.db.session import get_background_task_db
+from app.models import Product
+from app.models.product import ProductSalesDelta
+from app.core import logger
+from app.crud.products import mark_products_changed
+from app.crud.popularity import merge_popular_sales
+
+# seconds between two flushes of the pending sales, 0 disables the flush loop
+SALES_FLUSH_INTERVAL = float(os.getenv("SALES_FLUSH_INTERVAL", 5))
+
+
+def flush_product_sales(batch_size: int = 10_000) -> list:
+    """
+    Add the pending sales deltas to Product.total_sales and delete them.
+
+    Every batch is one statement: the oldest `batch_size` deltas are deleted, summed per product and added
+    to the products, locked in id order like the stock reservations to avoid deadlocks with them. Deltas
+    locked by another flusher are skipped, so several workers can flush at the same time.
+    Returns the ids of the products updated.
+    """
+    db: Session = get_background_task_db()
+    updated = set()
+    try:
+        while True:
+            claimable = (select(ProductSalesDelta.id).order_by(ProductSalesDelta.id).limit(batch_size)
+                         .with_for_update(skip_locked=True))
+            claimed = (delete(ProductSalesDelta).where(ProductSalesDelta.id.in_(claimable.scalar_subquery()))
+                       .returning(ProductSalesDelta.product_id, ProductSalesDelta.quantity).cte("claimed"))
+            totals = (select(claimed.c.product_id, func.sum(claimed.c.quantity).label("quantity"))
+                      .group_by(claimed.c.product_id).cte("totals"))
+            locked = (select(Product.id).where(Product.id.in_(select(totals.c.product_id)))
+                      .order_by(Product.id).with_for_update().cte("locked"))
+            product_ids = db.execute(
+                update(Product)
+                .where(Product.id == totals.c.product_id, Product.id == locked.c.id)
+                .values(total_sales=func.coalesce(Product.total_sales, 0) + totals.c.quantity)
+                .returning(Product.id)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+            if not product_ids:
+                db.rollback()
+                break
+            # total_sales is part of the cached product details
+            mark_products_changed(db, product_ids)
+            db.commit()
+            updated.update(product_ids)
+        if updated:
+            merge_popular_sales(db, sorted(updated))
+            logger.info(f"Sales flushed for {len(updated)} products")
+        return sorted(updated)
+    except Exception as e:
+        db.rollback()
+        logger.error(e)
+        raise
+    finally:
+        db.close()
+
+
+async def flush_product_sales_periodically(interval: float = SALES_FLUSH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(flush_product_sales)
+        except Exception:
+            # logged by flush_product_sales, the deltas stay pending until the next round
+            pass
@@ -1 +1,3 @@
 from .tokens import store_access_token, get_access_token, check_refresh_token, add_refresh_token_to_blacklist
+from .memory import TTLCache
+from .documents import CachedDocument
@@ -0,0 +1,13 @@
+from datetime import datetime
+
+
+class CachedDocument:
+    """
+    A pre-serialized JSON response body and the validators (ETag, Last-Modified) it is served with.
+    """
+    __slots__ = ("body", "etag", "last_modified")
+
+    def __init__(self, body: bytes, etag: str, last_modified: datetime):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
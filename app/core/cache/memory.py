@@ -0,0 +1,138 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries also expire `ttl` seconds after they were stored.
+
+    `get_or_load` lets a single caller run the loader on a miss while concurrent callers asking
+    for the same key wait for its result, so an expired hot key doesn't send a burst of identical
+    queries to the database. A value loaded while its key was invalidated is returned to the caller
+    but not stored, since it may predate the write that caused the invalidation.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._loading: Dict[Hashable, threading.Lock] = {}
+        self._invalidations = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key: Hashable):
+        # caller holds self._lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= self.timer():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def __contains__(self, key: Hashable) -> bool:
+        # doesn't count as a lookup
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def _store(self, key: Hashable, value: Any):
+        # caller holds self._lock
+        self._entries[key] = (self.timer() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def generation(self) -> int:
+        """
+        Changes on every invalidation, read it before loading a value that is stored with `set`.
+        """
+        with self._lock:
+            return self._invalidations
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        # with the generation read before the load, a value that may predate an invalidation is dropped
+        with self._lock:
+            if generation is None or generation == self._invalidations:
+                self._store(key, value)
+
+    def replace(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        """
+        Swap the value of a live entry for one derived from it, the entry keeps its expiry. Nothing is stored
+        when the key expired or was invalidated meanwhile.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.timer() and (generation is None or
+                                                                    generation == self._invalidations):
+                self._entries[key] = (entry[0], value)
+
+    def invalidate(self, *keys: Hashable):
+        with self._lock:
+            self._invalidations += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += 1
+            self._entries.clear()
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # another caller may have loaded the key while this one was waiting
+            with self._lock:
+                entry = self._lookup(key)
+                invalidations = self._invalidations
+            if entry is not None:
+                return entry[1]
+            try:
+                value = loader()
+                with self._lock:
+                    if invalidations == self._invalidations:
+                        self._store(key, value)
+                return value
+            finally:
+                with self._lock:
+                    if self._loading.get(key) is load_lock:
+                        del self._loading[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
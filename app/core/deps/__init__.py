@@ -1 +1 @@
-from .auth import get_current_user
\ No newline at end of file
+from .auth import get_current_user, get_current_superuser
@@ -60,3 +60,12 @@ def get_current_user(token: str = Depends(oauth2_scheme),
 
     # Return the user object
     return user
+
+
+def get_current_superuser(user=Depends(get_current_user)):
+    """
+    The current user, who must be a superuser (admin endpoints).
+    """
+    if not user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return user
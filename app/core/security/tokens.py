@@ -4,13 +4,13 @@ from typing import Optional, Tuple, Dict, Any
 from jose import JWTError, jwt, ExpiredSignatureError
 from dotenv import load_dotenv
 from fastapi import HTTPException, status, BackgroundTasks
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.background_tasks.auth_tasks import update_user_refresh_token
 from app.core.cache.tokens import store_access_token, get_access_token
 from app.core import logger
-from app.helpers.users import get_user_by_id
-from sqlalchemy.exc import SQLAlchemyError
+from app.helpers.users import get_user_by_id_async
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 
 load_dotenv()
 
@@ -56,10 +56,10 @@ def verify_token(token: str, token_type: str) -> Dict[str, Any] | None:
         )
 
 
-async def get_or_create_default_tokens(db: Session, user_id: int, background_task: BackgroundTasks,
+async def get_or_create_default_tokens(db: AsyncSession, user_id: int, background_task: BackgroundTasks,
                                        register: bool = False) -> Tuple[str, str]:
     # get user from the db by id
-    user = get_user_by_id(db, user_id)
+    user = await get_user_by_id_async(db, user_id)
 
     # check if the user exists
     if not user:
@@ -110,8 +110,10 @@ async def get_or_create_default_tokens(db: Session, user_id: int, background_tas
 
         return access_token, refresh_token
 
+    except PoolTimeoutError:
+        raise
     except SQLAlchemyError as db_error:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Database error occurred")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred while creating tokens : {e}")
@@ -1,2 +1,7 @@
-from .products import update_product_daily_stock, check_product_stocks, update_product_stocks
-from .db_utils import get_or_create
+from .products import reserve_product_stocks, check_stock_type, InsufficientStockError, available_stock, in_stock
+from .db_utils import get_or_create, json_object, json_array, json_timestamp
+from .pagination import paginate, keyset, encode_cursor, decode_cursor
+from .conditional import make_etag, is_conditional, not_modified, not_modified_response, validator_headers
+from .responses import type_adapter, to_json, json_response
+from .geo import GeoIndex, haversine
+from .money import to_minor, from_minor, percent_of
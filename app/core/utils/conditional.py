@@ -0,0 +1,56 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from fastapi import Request, Response, status
+
+
+def make_etag(*parts) -> str:
+    """
+    Strong ETag from the values that version a representation (ids, row versions, ...).
+    """
+    return '"' + hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest() + '"'
+
+
+def _as_utc(value: datetime) -> datetime:
+    # naive datetimes are the server's local time, like the datetime.now defaults of the models
+    return value.astimezone(timezone.utc)
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    # no-cache: clients keep the body but revalidate on every use, which is what the 304s are for
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_as_utc(last_modified), usegmt=True)
+    return headers
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """
+    Whether the client's copy is still current. If-None-Match wins over If-Modified-Since when both are sent.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in candidates or etag in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have a one second resolution
+    return _as_utc(last_modified).replace(microsecond=0) <= since
+
+
+def not_modified_response(etag: str, last_modified: Optional[datetime] = None) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers(etag, last_modified))
@@ -1,13 +1,47 @@
-from sqlalchemy.orm import Session
+import os
+from itertools import chain
+
+from sqlalchemy import select, func, literal_column, case, JSON
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import ColumnElement
+
+# Detail documents (orders, products) rendered to JSON by Postgres in one query instead of loaded as ORM objects
+# and serialized by pydantic, see benchmarks/detail_rendering.py
+DB_JSON_RENDERING = os.getenv("DB_JSON_RENDERING", "false").strip().lower() in ("1", "true", "yes", "on")
+
+
+def json_object(**fields: ColumnElement) -> ColumnElement:
+    """
+    json_build_object of `fields`, keyed by the argument names. Keys are inlined, they only ever come from code.
+    """
+    return func.json_build_object(*chain.from_iterable((literal_column(f"'{key}'"), value)
+                                                       for key, value in fields.items()), type_=JSON)
+
+
+def json_array(element: ColumnElement, *order_by: ColumnElement) -> ColumnElement:
+    # json_agg of no rows is NULL, the schemas render an empty list
+    return func.coalesce(func.json_agg(aggregate_order_by(element, *order_by), type_=JSON),
+                         literal_column("'[]'::json"), type_=JSON)
+
+
+def json_timestamp(column: ColumnElement) -> ColumnElement:
+    """
+    A timestamp rendered like datetime.isoformat(): json_build_object drops the trailing zeros of the
+    microseconds, isoformat() always writes six digits and leaves the fraction out only when it is zero.
+    """
+    return case((func.date_trunc("second", column) == column,
+                 func.to_char(column, literal_column("'YYYY-MM-DD\"T\"HH24:MI:SS'"))),
+                else_=func.to_char(column, literal_column("'YYYY-MM-DD\"T\"HH24:MI:SS.US'")))
 
 
-def get_or_create(session: Session, model, defaults=None, **kwargs):
+async def get_or_create(session: AsyncSession, model, defaults=None, **kwargs):
     """
     Get an instance of the model or create it if it doesn't exist.
 
     Args:
-        session (Session): The SQLAlchemy session.
+        session (AsyncSession): The SQLAlchemy async session.
         model (Base): The SQLAlchemy model.
         defaults (dict, optional): A dictionary of default values to set on the instance. Defaults to None.
         **kwargs: The fields to filter by.
@@ -16,7 +50,7 @@ def get_or_create(session: Session, model, defaults=None, **kwargs):
         tuple: A tuple of (instance, created), where created is a boolean indicating whether the instance was created.
     """
     defaults = defaults or {}
-    instance = session.query(model).filter_by(**kwargs).first()
+    instance = (await session.execute(select(model).filter_by(**kwargs))).scalars().first()
     if instance:
         return instance, False
 
@@ -25,11 +59,11 @@ def get_or_create(session: Session, model, defaults=None, **kwargs):
 
     try:
         session.add(instance)
-        session.commit()
+        await session.commit()
         return instance, True
     except IntegrityError:
-        session.rollback()
-        instance = session.query(model).filter_by(**kwargs).first()
+        await session.rollback()
+        instance = (await session.execute(select(model).filter_by(**kwargs))).scalars().first()
         return instance, False
 
 # Example usage
@@ -38,7 +72,7 @@ def get_or_create(session: Session, model, defaults=None, **kwargs):
 # from your_project.models import User
 # from your_project.database import session
 
-# user, created = get_or_create(session, User, email='user@example.com', defaults={'name': 'John Doe'})
+# user, created = await get_or_create(session, User, email='user@example.com', defaults={'name': 'John Doe'})
 # if created:
 #     print("User created:", user)
 # else:
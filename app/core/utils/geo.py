@@ -0,0 +1,129 @@
+import heapq
+import math
+from typing import Generic, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+EARTH_RADIUS_M = 6_371_008.8
+
+T = TypeVar("T")
+
+
+def haversine(latitude: float, longitude: float, other_latitude: float, other_longitude: float) -> float:
+    """
+    Great-circle distance in meters between two points given in degrees.
+    """
+    phi, other_phi = math.radians(latitude), math.radians(other_latitude)
+    d_phi = other_phi - phi
+    d_lambda = math.radians(other_longitude - longitude)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi) * math.cos(other_phi) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def to_unit_vector(latitude: float, longitude: float) -> Tuple[float, float, float]:
+    phi, lam = math.radians(latitude), math.radians(longitude)
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+
+def chord_squared(distance: float) -> float:
+    # squared straight-line distance on the unit sphere between points `distance` meters apart
+    return (2 * math.sin(min(distance / EARTH_RADIUS_M, math.pi) / 2)) ** 2
+
+
+def chord_to_distance(squared: float) -> float:
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(squared) / 2))
+
+
+class _Node:
+    __slots__ = ("item", "vector", "axis", "left", "right")
+
+    def __init__(self, item, vector, axis, left, right):
+        self.item = item
+        self.vector = vector
+        self.axis = axis
+        self.left = left
+        self.right = right
+
+
+class GeoIndex(Generic[T]):
+    """
+    Static k-d tree of items placed on the earth, for nearest neighbour and radius queries.
+
+    Points are stored as 3D unit vectors: the straight-line distance between two of them grows with
+    their great-circle distance, so the tree prunes with plain coordinate differences, with no special
+    cases for the poles or the antimeridian. A lookup visits O(log n) nodes instead of computing the
+    distance to every item. Build a new index when the items change.
+    """
+
+    def __init__(self, points: Iterable[Tuple[T, float, float]]):
+        """
+        `points` are (item, latitude, longitude) tuples.
+        """
+        located = [(item, to_unit_vector(latitude, longitude)) for item, latitude, longitude in points]
+        self.size = len(located)
+        self._root = self._build(located, 0)
+
+    def _build(self, located: List[tuple], depth: int) -> Optional[_Node]:
+        if not located:
+            return None
+        axis = depth % 3
+        located.sort(key=lambda entry: entry[1][axis])
+        median = len(located) // 2
+        item, vector = located[median]
+        return _Node(item, vector, axis, self._build(located[:median], depth + 1),
+                     self._build(located[median + 1:], depth + 1))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def nearest(self, latitude: float, longitude: float, limit: int = 1,
+                max_distance: Optional[float] = None) -> List[Tuple[T, float]]:
+        """
+        Up to `limit` (item, distance in meters) pairs closest to the point, nearest first, only the
+        items within `max_distance` meters when it is given.
+        """
+        if limit <= 0 or self._root is None:
+            return []
+        target = to_unit_vector(latitude, longitude)
+        bound = chord_squared(max_distance) if max_distance is not None else math.inf
+        # max-heap of the best candidates so far as (-squared chord, tie breaker, item)
+        best: List[tuple] = []
+        # nodes to visit with the squared distance of the splitting plane that leads to them
+        stack: List[Tuple[_Node, float]] = [(self._root, 0.0)]
+        while stack:
+            node, plane = stack.pop()
+            # the bound may have shrunk since the node was queued
+            if plane > bound:
+                continue
+            vector = node.vector
+            squared = (vector[0] - target[0]) ** 2 + (vector[1] - target[1]) ** 2 + (vector[2] - target[2]) ** 2
+            if squared <= bound:
+                if len(best) < limit:
+                    heapq.heappush(best, (-squared, id(node), node.item))
+                elif squared < -best[0][0]:
+                    heapq.heapreplace(best, (-squared, id(node), node.item))
+                if len(best) == limit:
+                    bound = -best[0][0]
+
+            difference = target[node.axis] - vector[node.axis]
+            near, far = (node.left, node.right) if difference < 0 else (node.right, node.left)
+            # the far side is only worth visiting if the splitting plane is within the bound
+            if far is not None:
+                stack.append((far, max(plane, difference * difference)))
+            if near is not None:
+                stack.append((near, plane))
+        return [(item, chord_to_distance(-negated)) for negated, _, item in sorted(best, reverse=True)]
+
+    def within(self, latitude: float, longitude: float, distance: float) -> List[Tuple[T, float]]:
+        """
+        Every item at most `distance` meters away, nearest first.
+        """
+        return self.nearest(latitude, longitude, self.size, distance)
+
+
+def nearest_by_scan(points: Sequence[Tuple[T, float, float]], latitude: float, longitude: float,
+                    limit: int = 1) -> List[Tuple[T, float]]:
+    """
+    Reference implementation of GeoIndex.nearest computing the distance to every point.
+    """
+    distances = [(item, haversine(latitude, longitude, item_latitude, item_longitude))
+                 for item, item_latitude, item_longitude in points]
+    return sorted(distances, key=lambda entry: entry[1])[:limit]
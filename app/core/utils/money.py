@@ -0,0 +1,18 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional
+
+# amounts are computed in integers of 1/100 of the currency, like the Numeric(10, 2) columns they end up in
+MINOR_UNITS = 100
+
+
+def to_minor(amount: Optional[float]) -> int:
+    # str() keeps the decimal the float was written with, 0.1 is 10 and not 10.000000000000000555
+    return int((Decimal(str(amount or 0)) * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(amount: int) -> Decimal:
+    return Decimal(amount).scaleb(-2)
+
+
+def percent_of(amount: int, percent: float) -> int:
+    return int((Decimal(amount) * Decimal(str(percent)) / 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
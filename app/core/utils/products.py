@@ -1,47 +1,94 @@
-from sqlalchemy.orm import Session
+from typing import Dict
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import Product
-from datetime import datetime, timedelta
-from sqlalchemy import update, and_
-
-
-def update_product_daily_stock(db: Session, product: Product):
-    product.stock = product.stock_daily
-    product.last_daily_stock_update = datetime.now().date()
-    db.commit()
-
-
-def update_product_stocks(db: Session, product: Product, quantity):
-    if product.stock_type.upper() == 'FIXED':
-        stmt = update(Product).where(and_(Product.id == product.id)).values(stock=Product.stock - quantity)
-    elif product.stock_type.upper() == 'DAILY':
-        stmt = update(Product).where(and_(Product.id == product.id)).values(
-            available_daily_stock=Product.stock - quantity)
-    elif product.stock_type.upper() == 'UNLIMITED':
-        # No need to update stock for unlimited products
-        return
-    else:
-        raise ValueError(f"Unknown stock type: {product.stock_type}")
+from datetime import datetime
+from sqlalchemy import update, select, case, and_, or_, func, values, column, Integer
+
+LIMITED_STOCK_TYPES = ('fixed', 'daily')
+
+
+class InsufficientStockError(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f"Insufficient stocks for products {sorted(product_ids)}")
 
-    db.execute(stmt)
-    db.commit()
-    db.refresh(product)
-
-
-def check_product_stocks(db: Session, product: Product, quantity: int):
-    if product.stock_type.upper() == 'UNLIMITED':
-        return True
-    elif product.stock_type.upper() == 'DAILY':
-        now = datetime.now().date()
-        if now >= (product.last_daily_stock_update + timedelta(days=1)):
-            update_product_daily_stock(db, product)
-        if product.stock < quantity:
-            return False
-    elif product.stock_type.upper() == 'FIXED':
-        if product.stock < quantity:
-            return False
-    else:
-        raise ValueError(f"Unknown stock type: {product.stock_type}")
 
-    update_product_stocks(db, product, quantity)
+def check_stock_type(product: Product) -> bool:
+    """
+    Return True when the product stock has to be reserved, False for unlimited products.
+    """
+    stock_type = product.stock_type.lower()
+    if stock_type == 'unlimited':
+        return False
+    if stock_type not in LIMITED_STOCK_TYPES:
+        raise ValueError(f"Unknown stock type: {product.stock_type}")
     return True
+
+
+def needs_daily_refill(today):
+    return and_(func.lower(Product.stock_type) == 'daily', Product.last_daily_stock_update < today)
+
+
+def available_stock(today):
+    """
+    SQL expression of the stock a product really has today, daily stocks are full again on a new day.
+    """
+    return case((needs_daily_refill(today), Product.stock_daily), else_=Product.stock)
+
+
+def in_stock(today):
+    return or_(func.lower(Product.stock_type) == 'unlimited', available_stock(today) > 0)
+
+
+async def reserve_product_stocks(db: AsyncSession, quantities: Dict[int, int]) -> Dict[int, int]:
+    """
+    Decrement the stock of every product in `quantities` ({product_id: quantity}) in a single statement.
+
+    Each row is only updated when it still has enough stock, so concurrent orders can never oversell,
+    and daily stocks are refilled in the same statement when the last refill happened before today.
+    Nothing is committed: if any product is short the whole order transaction has to be rolled back,
+    which is why InsufficientStockError is raised instead of returning partial results.
+
+    Returns the remaining stock per product id.
+    """
+    if not quantities:
+        return {}
+
+    today = datetime.now().date()
+    wanted = values(column("id", Integer), column("quantity", Integer), name="wanted").data(
+        sorted(quantities.items()))
+
+    # lock the rows in id order first so two orders sharing products can't deadlock each other
+    locked = (
+        select(Product.id)
+        .where(Product.id.in_(list(quantities)))
+        .order_by(Product.id)
+        .with_for_update()
+        .cte("locked")
+        .prefix_with("MATERIALIZED")
+    )
+
+    needs_refill = needs_daily_refill(today)
+    available = available_stock(today)
+
+    stmt = (
+        update(Product)
+        .where(Product.id == wanted.c.id)
+        .where(Product.id.in_(select(locked.c.id)))
+        .where(func.lower(Product.stock_type).in_(LIMITED_STOCK_TYPES))
+        .where(available >= wanted.c.quantity)
+        .values(
+            stock=available - wanted.c.quantity,
+            last_daily_stock_update=case((needs_refill, today), else_=Product.last_daily_stock_update),
+        )
+        .returning(Product.id, Product.stock)
+        .execution_options(synchronize_session=False)
+    )
+    reserved = {product_id: stock for product_id, stock in (await db.execute(stmt)).all()}
+
+    missing = set(quantities) - set(reserved)
+    if missing:
+        raise InsufficientStockError(missing)
+    return reserved
@@ -0,0 +1,30 @@
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from fastapi import Response, status
+from pydantic import TypeAdapter
+
+
+@lru_cache(maxsize=None)
+def type_adapter(schema: Any) -> TypeAdapter:
+    # building the validator and serializer of a schema is expensive, do it once per schema
+    return TypeAdapter(schema)
+
+
+def to_json(schema: Any, content: Any) -> bytes:
+    """
+    `content` (ORM objects, dicts, ...) validated into `schema` once and serialized by pydantic-core
+    straight to JSON bytes, without the dict round trip through jsonable_encoder of a response_model.
+    """
+    adapter = type_adapter(schema)
+    return adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+
+
+def json_response(schema: Any, content: Any, status_code: int = status.HTTP_200_OK,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Response rendered with to_json. The route keeps its response_model for the OpenAPI schema, FastAPI
+    sends a returned Response as is.
+    """
+    return Response(content=to_json(schema, content), status_code=status_code, media_type="application/json",
+                    headers=headers)
@@ -0,0 +1,85 @@
+from typing import Iterable, List, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from app.core.cache import TTLCache
+from app.models import Branch, Category, SubCategory, Product, ProductVariation, VariationOption, Addon
+
+# Caches keyed by branch id whose values are derived from the branch's catalog (menus, price tables),
+# dropped together whenever that catalog changes
+branch_catalog_caches: List[TTLCache] = []
+
+CHANGED_BRANCH_CATALOGS_KEY = "changed_catalog_branch_ids"
+# marks a change every branch may show (categories, variations, ...)
+ALL_BRANCHES = "*"
+
+
+def track_branch_catalog(cache: TTLCache) -> TTLCache:
+    branch_catalog_caches.append(cache)
+    return cache
+
+
+def mark_branch_catalogs_changed(db: Session, branch_ids: Optional[Iterable[int]] = None):
+    """
+    Drop what is cached for the catalogs of `branch_ids`, of every branch when None, once the session commits.
+    ORM writes to the catalog are tracked automatically, bulk statements have to call this.
+    """
+    changed = db.info.setdefault(CHANGED_BRANCH_CATALOGS_KEY, set())
+    if branch_ids is None:
+        changed.add(ALL_BRANCHES)
+    else:
+        changed.update(branch_ids)
+
+
+@event.listens_for(Product, "after_insert")
+@event.listens_for(Product, "after_update")
+@event.listens_for(Product, "after_delete")
+def _product_written(mapper, connection, target):
+    # a product moved to another branch leaves the catalog of the old one too
+    moved_from = inspect(target).attrs.branch_id.history.deleted
+    mark_branch_catalogs_changed(object_session(target), [target.branch_id, *moved_from])
+
+
+@event.listens_for(Branch, "after_update")
+@event.listens_for(Branch, "after_delete")
+def _branch_written(mapper, connection, target):
+    mark_branch_catalogs_changed(object_session(target), [target.id])
+
+
+@event.listens_for(Category, "after_insert")
+@event.listens_for(Category, "after_update")
+@event.listens_for(Category, "after_delete")
+@event.listens_for(SubCategory, "after_insert")
+@event.listens_for(SubCategory, "after_update")
+@event.listens_for(SubCategory, "after_delete")
+@event.listens_for(ProductVariation, "after_insert")
+@event.listens_for(ProductVariation, "after_update")
+@event.listens_for(ProductVariation, "after_delete")
+@event.listens_for(VariationOption, "after_insert")
+@event.listens_for(VariationOption, "after_update")
+@event.listens_for(VariationOption, "after_delete")
+@event.listens_for(Addon, "after_insert")
+@event.listens_for(Addon, "after_update")
+@event.listens_for(Addon, "after_delete")
+def _catalog_written(mapper, connection, target):
+    # shared rows, or rows whose branch isn't at hand: every branch may show them
+    mark_branch_catalogs_changed(object_session(target))
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_changed_branch_catalogs(session: Session):
+    # dropped only after the commit, like the other caches, so a concurrent rebuild can't keep the old rows
+    branch_ids = session.info.pop(CHANGED_BRANCH_CATALOGS_KEY, None)
+    if not branch_ids:
+        return
+    for cache in branch_catalog_caches:
+        if ALL_BRANCHES in branch_ids:
+            cache.clear()
+        else:
+            cache.invalidate(*branch_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_branch_catalogs(session: Session):
+    session.info.pop(CHANGED_BRANCH_CATALOGS_KEY, None)
@@ -0,0 +1,130 @@
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from app.core.cache import TTLCache
+from app.core.utils import GeoIndex, haversine
+from app.models import Branch
+
+# Branches written through this process rebuild the index on the next lookup, the TTL bounds how long
+# the other workers keep serving theirs
+BRANCH_INDEX_TTL = float(os.getenv("BRANCH_INDEX_TTL", 300))
+BRANCH_INDEX_KEY = "branches"
+branch_index_cache = TTLCache("branch_index", 1, BRANCH_INDEX_TTL)
+
+BRANCHES_CHANGED_KEY = "branches_changed"
+
+BRANCH_LOCATIONS = select(Branch.id, Branch.name, Branch.address, Branch.latitude, Branch.longitude,
+                          Branch.coverage_radius)
+
+
+class BranchLocation:
+    __slots__ = ("id", "name", "address", "latitude", "longitude", "coverage_radius")
+
+    def __init__(self, id: int, name: str, address: Optional[str], latitude: Optional[float],
+                 longitude: Optional[float], coverage_radius: Optional[int]):
+        self.id = id
+        self.name = name
+        self.address = address
+        self.latitude = latitude
+        self.longitude = longitude
+        self.coverage_radius = coverage_radius
+
+    @property
+    def located(self) -> bool:
+        return self.latitude is not None and self.longitude is not None
+
+    def covers(self, latitude: float, longitude: float) -> bool:
+        # a branch without a location or a radius doesn't deliver anywhere
+        if not self.located or self.coverage_radius is None:
+            return False
+        return haversine(self.latitude, self.longitude, latitude, longitude) <= self.coverage_radius
+
+
+class BranchIndex:
+    """
+    Every branch by id, plus a spatial index of the ones with a location.
+    """
+
+    def __init__(self, branches: Iterable[BranchLocation]):
+        self.branches: Dict[int, BranchLocation] = {branch.id: branch for branch in branches}
+        located = [branch for branch in self.branches.values() if branch.located]
+        self.geo: GeoIndex[BranchLocation] = GeoIndex((branch, branch.latitude, branch.longitude)
+                                                      for branch in located)
+        self.max_coverage_radius = max((branch.coverage_radius for branch in located
+                                        if branch.coverage_radius is not None), default=0)
+
+    def get(self, branch_id: int) -> Optional[BranchLocation]:
+        return self.branches.get(branch_id)
+
+    def nearest(self, latitude: float, longitude: float, limit: int) -> List[Tuple[BranchLocation, float]]:
+        return self.geo.nearest(latitude, longitude, limit)
+
+    def covering(self, latitude: float, longitude: float) -> List[Tuple[BranchLocation, float]]:
+        # no branch further than the largest radius can cover the point
+        return [(branch, distance) for branch, distance in self.geo.within(latitude, longitude,
+                                                                             self.max_coverage_radius)
+                if branch.coverage_radius is not None and distance <= branch.coverage_radius]
+
+
+def build_branch_index(rows) -> BranchIndex:
+    return BranchIndex(BranchLocation(*row) for row in rows)
+
+
+def get_branch_index(db: Session) -> BranchIndex:
+    return branch_index_cache.get_or_load(BRANCH_INDEX_KEY, lambda: build_branch_index(db.execute(BRANCH_LOCATIONS)))
+
+
+async def get_branch_index_async(db: AsyncSession) -> BranchIndex:
+    index = branch_index_cache.get(BRANCH_INDEX_KEY)
+    if index is None:
+        # no stampede guard, waiting on a thread lock would block the event loop and the load is one
+        # scan of a small table
+        generation = branch_index_cache.generation
+        index = build_branch_index((await db.execute(BRANCH_LOCATIONS)).all())
+        branch_index_cache.set(BRANCH_INDEX_KEY, index, generation)
+    return index
+
+
+def nearest_branches(db: Session, latitude: float, longitude: float, limit: int,
+                     covering: bool = False) -> List[dict]:
+    index = get_branch_index(db)
+    if covering:
+        matches = index.covering(latitude, longitude)[:limit]
+    else:
+        matches = index.nearest(latitude, longitude, limit)
+    return [
+        {
+            "id": branch.id,
+            "name": branch.name,
+            "address": branch.address,
+            "latitude": branch.latitude,
+            "longitude": branch.longitude,
+            "coverage_radius": branch.coverage_radius,
+            "distance": round(distance, 1),
+            "covers": branch.coverage_radius is not None and distance <= branch.coverage_radius,
+        }
+        for branch, distance in matches
+    ]
+
+
+@event.listens_for(Branch, "after_insert")
+@event.listens_for(Branch, "after_update")
+@event.listens_for(Branch, "after_delete")
+def _branch_written(mapper, connection, target):
+    object_session(target).info[BRANCHES_CHANGED_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _rebuild_branch_index(session: Session):
+    # dropped only after the commit, like the product cache, so a concurrent rebuild can't keep the old rows
+    if session.info.pop(BRANCHES_CHANGED_KEY, False):
+        branch_index_cache.clear()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_branch_changes(session: Session):
+    session.info.pop(BRANCHES_CHANGED_KEY, None)
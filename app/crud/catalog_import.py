@@ -0,0 +1,374 @@
+import csv
+import io
+import time
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+import orjson
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core import logger
+from app.crud.products import mark_products_changed
+from app.crud.categories import mark_categories_changed
+from app.crud.branch_catalogs import mark_branch_catalogs_changed
+from app.schemas.catalog_import import CatalogFormat, ImportProduct, CatalogImportReport
+
+
+class CatalogImportError(Exception):
+    def __init__(self, message: str, line: Optional[int] = None):
+        super().__init__(message if line is None else f"line {line}: {message}")
+        self.message = message
+        self.line = line
+
+
+def format_for(filename: Optional[str]) -> CatalogFormat:
+    return CatalogFormat.CSV if filename and filename.lower().endswith(".csv") else CatalogFormat.NDJSON
+
+
+def read_records(stream: BinaryIO, format: CatalogFormat) -> Iterator[Tuple[int, dict]]:
+    """
+    (line number, raw record) pairs of an NDJSON or CSV catalog, read lazily from `stream`.
+    CSV files have a header row naming the ImportProduct fields, the nested ones hold JSON.
+    """
+    if format == CatalogFormat.NDJSON:
+        for line, raw in enumerate(stream, 1):
+            if not raw.strip():
+                continue
+            try:
+                yield line, orjson.loads(raw)
+            except orjson.JSONDecodeError as e:
+                raise CatalogImportError(f"invalid JSON ({e})", line)
+    else:
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+        for row in reader:
+            # empty cells fall back to the defaults
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ("", None)}
+
+
+def staged_rows(records: Iterator[Tuple[int, dict]]) -> Iterator[str]:
+    """
+    The records validated as ImportProduct, as CSV lines of (line number, JSON document) for COPY.
+    """
+    names: Set[Tuple[int, str]] = set()
+    for line, record in records:
+        try:
+            product = ImportProduct.model_validate(record)
+        except ValidationError as e:
+            error = e.errors()[0]
+            raise CatalogImportError(f"{'.'.join(map(str, error['loc']))}: {error['msg']}", line)
+        if (product.branch_id, product.name) in names:
+            raise CatalogImportError(f"duplicate product {product.name!r} in branch {product.branch_id}", line)
+        names.add((product.branch_id, product.name))
+        document = orjson.dumps(product.model_dump(mode="json")).decode()
+        # a CSV quoted field, quotes are doubled
+        yield f'{line},"{document.replace(chr(34), chr(34) * 2)}"\n'
+
+
+class _CopyReader:
+    """
+    File-like view of an iterator of strings, read by COPY ... FROM STDIN.
+
+    An exception raised by the iterator ends the input and is kept in `error`, re-raised once COPY returns,
+    instead of surfacing as an opaque driver error.
+    """
+
+    def __init__(self, rows: Iterator[str]):
+        self._rows = rows
+        self._buffer = ""
+        self.error: Optional[Exception] = None
+
+    def read(self, size: int = -1) -> str:
+        chunks, length = [self._buffer], len(self._buffer)
+        while self.error is None and (size < 0 or length < size):
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            except Exception as e:
+                self.error = e
+                break
+            chunks.append(row)
+            length += len(row)
+        data = "".join(chunks)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+# Every level goes through the same steps: the staged rows are typed into a temp table, matched to the existing
+# rows by their natural key, given ids from the table's sequence when new, then changed rows are updated, new ones
+# inserted and linked, and the rows the import no longer lists are unlinked from their product or variation.
+# Removed children are only unlinked, past orders still reference them.
+
+STAGE = "CREATE TEMP TABLE catalog_import (line integer, doc jsonb) ON COMMIT DROP"
+
+COPY = "COPY catalog_import (line, doc) FROM STDIN WITH (FORMAT csv)"
+
+STAGE_PRODUCTS = """
+    CREATE TEMP TABLE catalog_import_products ON COMMIT DROP AS
+    SELECT NULL::integer AS id, false AS is_new, r.*
+    FROM catalog_import i,
+         jsonb_to_record(i.doc) AS r(name text, price float8, description text, image text, tags jsonb, stock int,
+                                     stock_type text, stock_daily int, discount_type text, discount_value float8,
+                                     is_active bool, is_visible bool, branch_id int, category_id int,
+                                     subcategory_id int, addons jsonb, variations jsonb)
+    ORDER BY i.line
+"""
+
+MATCH_PRODUCTS = """
+    UPDATE catalog_import_products s SET id = p.id FROM products p WHERE p.name = s.name AND p.branch_id = s.branch_id
+"""
+
+# the changed rows are locked in id order first, like the stock reservations, so the two never deadlock
+UPDATE_PRODUCTS = """
+    WITH locked AS (
+        SELECT p.id FROM products p JOIN catalog_import_products s ON s.id = p.id
+        WHERE NOT s.is_new
+          AND (p.price, p.description, p.image, p.tags::jsonb, p.stock, p.stock_type, p.stock_daily,
+               p.discount_type, p.discount_value, p.is_active, p.is_visible, p.category_id, p.subcategory_id)
+              IS DISTINCT FROM
+              (s.price, s.description, s.image, s.tags, coalesce(s.stock, p.stock), s.stock_type, s.stock_daily,
+               s.discount_type, s.discount_value, s.is_active, s.is_visible, s.category_id, s.subcategory_id)
+        ORDER BY p.id
+        FOR UPDATE OF p
+    )
+    UPDATE products p SET
+        price = s.price, description = s.description, image = s.image, tags = s.tags::json,
+        stock = coalesce(s.stock, p.stock), stock_type = s.stock_type, stock_daily = s.stock_daily,
+        discount_type = s.discount_type, discount_value = s.discount_value, is_active = s.is_active,
+        is_visible = s.is_visible, category_id = s.category_id, subcategory_id = s.subcategory_id,
+        updated_at = LOCALTIMESTAMP
+    FROM catalog_import_products s, locked
+    WHERE p.id = locked.id AND s.id = p.id
+    RETURNING p.id AS product_id
+"""
+
+INSERT_PRODUCTS = """
+    INSERT INTO products (id, name, price, description, image, tags, stock, stock_type, stock_daily, discount_type,
+                          discount_value, is_active, is_visible, branch_id, category_id, subcategory_id,
+                          created_at, updated_at, last_daily_stock_update, total_sales)
+    SELECT id, name, price, description, image, tags::json, coalesce(stock, 0), stock_type, stock_daily,
+           discount_type, discount_value, is_active, is_visible, branch_id, category_id, subcategory_id,
+           LOCALTIMESTAMP, LOCALTIMESTAMP, CURRENT_DATE, 0
+    FROM catalog_import_products WHERE is_new ORDER BY id
+    RETURNING id AS product_id
+"""
+
+STAGE_ADDONS = """
+    CREATE TEMP TABLE catalog_import_addons ON COMMIT DROP AS
+    SELECT NULL::integer AS id, false AS is_new, s.id AS product_id, a.*
+    FROM catalog_import_products s, jsonb_to_recordset(s.addons) AS a(title text, price float8, tax float8)
+    WHERE jsonb_typeof(s.addons) = 'array'
+"""
+
+MATCH_ADDONS = """
+    UPDATE catalog_import_addons s SET id = a.id
+    FROM product_addons_association pa JOIN addons a ON a.id = pa.addon_id
+    WHERE pa.product_id = s.product_id AND a.title = s.title
+"""
+
+UPDATE_ADDONS = """
+    UPDATE addons a SET price = s.price, tax = s.tax
+    FROM catalog_import_addons s
+    WHERE a.id = s.id AND NOT s.is_new AND (a.price, a.tax) IS DISTINCT FROM (s.price, s.tax)
+    RETURNING s.product_id
+"""
+
+INSERT_ADDONS = """
+    WITH inserted AS (
+        INSERT INTO addons (id, title, price, tax, product_id)
+        SELECT id, title, price, tax, product_id FROM catalog_import_addons WHERE is_new
+        RETURNING id, product_id
+    )
+    INSERT INTO product_addons_association (product_id, addon_id)
+    SELECT product_id, id FROM inserted
+    RETURNING product_id
+"""
+
+REMOVE_ADDONS = """
+    DELETE FROM product_addons_association pa
+    USING catalog_import_products p
+    WHERE pa.product_id = p.id AND jsonb_typeof(p.addons) = 'array'
+      AND NOT EXISTS (SELECT 1 FROM catalog_import_addons s WHERE s.product_id = pa.product_id AND s.id = pa.addon_id)
+    RETURNING pa.product_id
+"""
+
+STAGE_VARIATIONS = """
+    CREATE TEMP TABLE catalog_import_variations ON COMMIT DROP AS
+    SELECT NULL::integer AS id, false AS is_new, s.id AS product_id, v.*
+    FROM catalog_import_products s,
+         jsonb_to_recordset(s.variations) AS v(title text, type text, min_selections int, max_selections int,
+                                               required bool, options jsonb)
+    WHERE jsonb_typeof(s.variations) = 'array'
+"""
+
+MATCH_VARIATIONS = """
+    UPDATE catalog_import_variations s SET id = v.id
+    FROM product_variations v
+    WHERE v.product_id = s.product_id AND v.title = s.title
+"""
+
+UPDATE_VARIATIONS = """
+    UPDATE product_variations v SET type = s.type, min_selections = s.min_selections,
+                                    max_selections = s.max_selections, required = s.required
+    FROM catalog_import_variations s
+    WHERE v.id = s.id AND NOT s.is_new
+      AND (v.type, v.min_selections, v.max_selections, v.required)
+          IS DISTINCT FROM (s.type, s.min_selections, s.max_selections, s.required)
+    RETURNING s.product_id
+"""
+
+INSERT_VARIATIONS = """
+    INSERT INTO product_variations (id, title, type, min_selections, max_selections, required, product_id)
+    SELECT id, title, type, min_selections, max_selections, required, product_id
+    FROM catalog_import_variations WHERE is_new
+    RETURNING product_id
+"""
+
+REMOVE_VARIATIONS = """
+    UPDATE product_variations v SET product_id = NULL
+    FROM catalog_import_products p
+    WHERE v.product_id = p.id AND jsonb_typeof(p.variations) = 'array'
+      AND NOT EXISTS (SELECT 1 FROM catalog_import_variations s WHERE s.id = v.id)
+    RETURNING p.id AS product_id
+"""
+
+STAGE_OPTIONS = """
+    CREATE TEMP TABLE catalog_import_options ON COMMIT DROP AS
+    SELECT NULL::integer AS id, false AS is_new, s.product_id, s.id AS variation_id, o.*
+    FROM catalog_import_variations s, jsonb_to_recordset(s.options) AS o(name text, price float8)
+    WHERE jsonb_typeof(s.options) = 'array'
+"""
+
+MATCH_OPTIONS = """
+    UPDATE catalog_import_options s SET id = o.id
+    FROM product_variation_option_association vo JOIN variation_options o ON o.id = vo.variation_option_id
+    WHERE vo.product_variation_id = s.variation_id AND o.name = s.name
+"""
+
+UPDATE_OPTIONS = """
+    UPDATE variation_options o SET price = s.price
+    FROM catalog_import_options s
+    WHERE o.id = s.id AND NOT s.is_new AND o.price IS DISTINCT FROM s.price
+    RETURNING s.product_id
+"""
+
+INSERT_OPTIONS = """
+    WITH inserted AS (
+        INSERT INTO variation_options (id, name, price)
+        SELECT id, name, price FROM catalog_import_options WHERE is_new
+        RETURNING id
+    ), linked AS (
+        INSERT INTO product_variation_option_association (product_variation_id, variation_option_id)
+        SELECT s.variation_id, s.id FROM catalog_import_options s JOIN inserted ON inserted.id = s.id
+        RETURNING variation_option_id
+    )
+    SELECT s.product_id FROM catalog_import_options s JOIN linked ON linked.variation_option_id = s.id
+"""
+
+REMOVE_OPTIONS = """
+    DELETE FROM product_variation_option_association vo
+    USING catalog_import_variations v
+    WHERE vo.product_variation_id = v.id AND jsonb_typeof(v.options) = 'array'
+      AND NOT EXISTS (SELECT 1 FROM catalog_import_options s
+                      WHERE s.variation_id = vo.product_variation_id AND s.id = vo.variation_option_id)
+    RETURNING v.product_id
+"""
+
+# products whose children changed get a new version, like any other edit of the product document
+TOUCH_PRODUCTS = """
+    WITH locked AS (SELECT id FROM products WHERE id = ANY(:ids) ORDER BY id FOR UPDATE)
+    UPDATE products p SET updated_at = LOCALTIMESTAMP FROM locked WHERE p.id = locked.id
+"""
+
+# (level, staging table, table of the sequence, stage, match, update, insert, remove)
+LEVELS = (
+    ("products", "catalog_import_products", "products", STAGE_PRODUCTS, MATCH_PRODUCTS, UPDATE_PRODUCTS,
+     INSERT_PRODUCTS, None),
+    ("addons", "catalog_import_addons", "addons", STAGE_ADDONS, MATCH_ADDONS, UPDATE_ADDONS, INSERT_ADDONS,
+     REMOVE_ADDONS),
+    ("variations", "catalog_import_variations", "product_variations", STAGE_VARIATIONS, MATCH_VARIATIONS,
+     UPDATE_VARIATIONS, INSERT_VARIATIONS, REMOVE_VARIATIONS),
+    ("options", "catalog_import_options", "variation_options", STAGE_OPTIONS, MATCH_OPTIONS, UPDATE_OPTIONS,
+     INSERT_OPTIONS, REMOVE_OPTIONS),
+)
+
+
+def _product_ids(db: Session, statement: str) -> List[int]:
+    return list(db.execute(text(statement)).scalars().all())
+
+
+def import_catalog(db: Session, stream: BinaryIO, format: CatalogFormat) -> CatalogImportReport:
+    """
+    Insert or update the products of an NDJSON / CSV catalog (see ImportProduct) with their addons,
+    variations and options, in one transaction.
+
+    The records are validated while they stream into a temp table through COPY, then every level is written
+    with a handful of set based statements whatever the size of the catalog. Unchanged rows aren't written
+    at all, so a nightly sync only rewrites (and drops from the caches) what actually changed. Imports are
+    serialized by an advisory lock. Raises CatalogImportError on invalid input, nothing is written then.
+    """
+    rows: Dict[str, int] = {}
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    try:
+        # a large catalog can outlive the statement timeout of the API connections
+        db.execute(text("SET LOCAL statement_timeout = 0"))
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext('catalog_import'))"))
+        db.execute(text(STAGE))
+        reader = _CopyReader(staged_rows(read_records(stream, format)))
+        cursor = db.connection().connection.cursor()
+        cursor.copy_expert(COPY, reader)
+        if reader.error is not None:
+            raise reader.error
+        rows["records"] = cursor.rowcount
+        timings["copy"] = round(time.perf_counter() - started, 3)
+
+        changed: Set[int] = set()
+        touched: Set[int] = set()
+        for level, staging, sequence_table, stage, match, update, insert, remove in LEVELS:
+            level_started = time.perf_counter()
+            db.execute(text(stage))
+            # temp tables are never auto analyzed, the joins below need the row counts
+            db.execute(text(f"ANALYZE {staging}"))
+            db.execute(text(match))
+            db.execute(text(f"UPDATE {staging} SET id = nextval(pg_get_serial_sequence('{sequence_table}', 'id')), "
+                            f"is_new = true WHERE id IS NULL"))
+            updated, inserted = _product_ids(db, update), _product_ids(db, insert)
+            rows[f"{level}_updated"], rows[f"{level}_inserted"] = len(updated), len(inserted)
+            if remove is not None:
+                removed = _product_ids(db, remove)
+                rows[f"{level}_removed"] = len(removed)
+                touched.update(removed)
+            if level == "products":
+                changed.update(updated, inserted)
+            else:
+                touched.update(updated, inserted)
+            timings[level] = round(time.perf_counter() - level_started, 3)
+
+        touched -= changed
+        if touched:
+            db.execute(text(TOUCH_PRODUCTS), {"ids": sorted(touched)})
+        mark_products_changed(db, changed | touched)
+        if changed:
+            # new products and edited categories or visibility change the product counts of the tree
+            mark_categories_changed(db)
+        if changed or touched:
+            mark_branch_catalogs_changed(db)
+        rows["products_unchanged"] = rows["records"] - rows["products_updated"] - rows["products_inserted"] \
+            - len(touched)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        # unknown branch, category or subcategory ids
+        raise CatalogImportError(str(e.orig).splitlines()[0])
+    except Exception:
+        db.rollback()
+        raise
+    timings["total"] = round(time.perf_counter() - started, 3)
+    logger.info(f"Catalog imported: {rows} in {timings['total']}s")
+    return CatalogImportReport(rows=rows, timings=timings)
@@ -0,0 +1,128 @@
+import os
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import select, event, func, tuple_
+from sqlalchemy.orm import Session, object_session
+
+from app.core.cache import TTLCache, CachedDocument
+from app.core.utils import make_etag, to_json
+from app.crud.products import LISTED
+from app.db import read_from_primary
+from app.models import Category, SubCategory, Product
+from app.schemas.category import CategoryTreeResponse
+
+# Category edits made through this process rebuild the tree on the next request. The TTL bounds how long the
+# product counts lag behind the catalog, and how long the other workers keep serving their tree
+CATEGORY_TREE_TTL = float(os.getenv("CATEGORY_TREE_TTL", 300))
+CATEGORY_TREE_KEY = "categories"
+category_tree_cache = TTLCache("category_tree", 1, CATEGORY_TREE_TTL)
+
+CATEGORIES_CHANGED_KEY = "categories_changed"
+
+ACTIVE_CATEGORIES = (
+    select(Category.id, Category.name, Category.priority, Category.banner_image, Category.image)
+    .where(Category.is_active)
+    .order_by(Category.priority.asc().nulls_last(), Category.id)
+)
+
+ACTIVE_SUBCATEGORIES = (
+    select(SubCategory.id, SubCategory.name, SubCategory.category_id)
+    .where(SubCategory.is_active)
+    .order_by(SubCategory.id)
+)
+
+
+def listed_product_counts(db: Session) -> Dict[str, Dict[int, int]]:
+    """
+    Number of listed products per category and per subcategory, both counted by one GROUPING SETS query.
+    """
+    stmt = (
+        select(Product.category_id, Product.subcategory_id, func.grouping(Product.category_id).label("grouping"),
+               func.count())
+        .where(LISTED)
+        .group_by(func.grouping_sets(tuple_(Product.category_id), tuple_(Product.subcategory_id)))
+    )
+    counts: Dict[str, Dict[int, int]] = {"categories": {}, "subcategories": {}}
+    for category_id, subcategory_id, grouping, count in db.execute(stmt):
+        if grouping == 0:
+            counts["categories"][category_id] = count
+        else:
+            counts["subcategories"][subcategory_id] = count
+    return counts
+
+
+def build_category_tree(db: Session) -> List[dict]:
+    """
+    Active categories by priority (unprioritized ones last), each with its active subcategories and the
+    number of listed products of both. Three queries whatever the size of the tree.
+    """
+    counts = listed_product_counts(db)
+    categories = {
+        row.id: {
+            "id": row.id,
+            "name": row.name,
+            "priority": row.priority,
+            "banner_image": row.banner_image,
+            "image": row.image,
+            "product_count": counts["categories"].get(row.id, 0),
+            "subcategories": [],
+        }
+        for row in db.execute(ACTIVE_CATEGORIES)
+    }
+    for row in db.execute(ACTIVE_SUBCATEGORIES):
+        # subcategories of an inactive category are hidden with it
+        category = categories.get(row.category_id)
+        if category is not None:
+            category["subcategories"].append({
+                "id": row.id,
+                "name": row.name,
+                "product_count": counts["subcategories"].get(row.id, 0),
+            })
+    return list(categories.values())
+
+
+def get_category_tree(db: Session) -> CachedDocument:
+    """
+    The category tree as CategoryTreeResponse JSON, built once and served from memory until a category
+    changes or the TTL expires.
+    """
+    def load() -> CachedDocument:
+        # from the primary, a lagging replica would cache the tree a category change just invalidated
+        with read_from_primary(db):
+            body = to_json(List[CategoryTreeResponse], build_category_tree(db))
+        # the counts have no timestamp of their own, so the tree is as new as its build; the ETag only
+        # changes with the content, a rebuild of the same tree still revalidates
+        return CachedDocument(body, make_etag("categories", body), datetime.now())
+
+    return category_tree_cache.get_or_load(CATEGORY_TREE_KEY, load)
+
+
+def mark_categories_changed(db: Session):
+    """
+    Rebuild the category tree once the session commits. Category writes through the ORM are tracked
+    automatically, bulk statements that change it or its product counts have to call this.
+    """
+    db.info[CATEGORIES_CHANGED_KEY] = True
+
+
+@event.listens_for(Category, "after_insert")
+@event.listens_for(Category, "after_update")
+@event.listens_for(Category, "after_delete")
+@event.listens_for(SubCategory, "after_insert")
+@event.listens_for(SubCategory, "after_update")
+@event.listens_for(SubCategory, "after_delete")
+def _category_written(mapper, connection, target):
+    mark_categories_changed(object_session(target))
+
+
+@event.listens_for(Session, "after_commit")
+def _rebuild_category_tree(session: Session):
+    # dropped only after the commit, like the other caches, so a concurrent rebuild can't keep the old rows
+    if session.info.pop(CATEGORIES_CHANGED_KEY, False):
+        category_tree_cache.clear()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_category_changes(session: Session):
+    session.info.pop(CATEGORIES_CHANGED_KEY, None)
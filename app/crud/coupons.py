@@ -0,0 +1,231 @@
+import os
+import random
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, update, event, func, and_, or_, JSON
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from app.core.cache import TTLCache
+from app.core.utils import to_minor, percent_of, json_timestamp
+from app.models import Coupon, CouponRedemptionShard
+from app.schemas.coupon import CouponCreate, CouponType
+
+# Coupons written through this process are seen by the next quote, the TTL bounds how long the other workers
+# keep quoting with a coupon that was changed or disabled. Orders always read the coupons
+COUPON_INDEX_TTL = float(os.getenv("COUPON_INDEX_TTL", 60))
+COUPON_INDEX_KEY = "coupons"
+coupon_index_cache = TTLCache("coupon_index", 1, COUPON_INDEX_TTL)
+
+COUPONS_CHANGED_KEY = "coupons_changed"
+
+# rows the redemptions of a capped coupon are spread over, as many orders can redeem it at the same time
+COUPON_REDEMPTION_SHARDS = int(os.getenv("COUPON_REDEMPTION_SHARDS", 16))
+
+UNIQUE_VIOLATION = "23505"
+
+# in the order of CouponRule's arguments
+COUPON_RULE_COLUMNS = (Coupon.id, Coupon.code, Coupon.type, Coupon.value, Coupon.branch_id, Coupon.category_id,
+                       Coupon.min_spend, Coupon.max_redemptions, Coupon.starts_at, Coupon.ends_at)
+ACTIVE = and_(Coupon.is_active, or_(Coupon.ends_at.is_(None), Coupon.ends_at > func.now()))
+ACTIVE_COUPONS = select(*COUPON_RULE_COLUMNS).where(ACTIVE)
+
+
+def normalize_code(code: str) -> str:
+    return code.strip().upper()
+
+
+class CouponRule:
+    """
+    An active coupon, amounts in minor units. Never modified once indexed, so eligibility is checked without
+    any lock or query.
+    """
+    __slots__ = ("id", "code", "type", "value", "branch_id", "category_id", "min_spend", "max_redemptions",
+                 "starts_at", "ends_at")
+
+    def __init__(self, id: int, code: str, type: str, value: float, branch_id: Optional[int],
+                 category_id: Optional[int], min_spend: Optional[float], max_redemptions: Optional[int],
+                 starts_at: Optional[datetime], ends_at: Optional[datetime]):
+        self.id = id
+        self.code = code
+        self.type = CouponType(type)
+        # percent for percent coupons, minor units for fixed ones
+        self.value = value if self.type == CouponType.PERCENT else to_minor(value)
+        self.branch_id = branch_id
+        self.category_id = category_id
+        self.min_spend = to_minor(min_spend)
+        self.max_redemptions = max_redemptions
+        self.starts_at = starts_at
+        self.ends_at = ends_at
+
+    def valid_at(self, now: datetime) -> bool:
+        return (self.starts_at is None or self.starts_at <= now) and (self.ends_at is None or now < self.ends_at)
+
+    def valid_in(self, branch_id: int) -> bool:
+        return self.branch_id is None or self.branch_id == branch_id
+
+    def covers(self, category_id: Optional[int]) -> bool:
+        return self.category_id is None or self.category_id == category_id
+
+    def discounts(self, amounts: List[int]) -> List[int]:
+        """
+        Discount of each amount: a percent coupon takes its share of every one, a fixed coupon is taken once
+        from the amounts in order until it is used up.
+        """
+        if self.type == CouponType.PERCENT:
+            return [percent_of(amount, self.value) for amount in amounts]
+        remaining, discounts = self.value, []
+        for amount in amounts:
+            discount = min(amount, remaining)
+            discounts.append(discount)
+            remaining -= discount
+        return discounts
+
+
+class CouponIndex:
+    def __init__(self, rules: Iterable[CouponRule]):
+        self.rules: Dict[str, CouponRule] = {rule.code: rule for rule in rules}
+
+    def get(self, code: str) -> Optional[CouponRule]:
+        return self.rules.get(normalize_code(code))
+
+
+def active_coupons_json(codes: Optional[Iterable[str]] = None):
+    """
+    The active coupons (only `codes` when given) as one JSON array of CouponRule arguments, for a query that
+    reads them along with something else. Read back by coupon_index_from_json.
+    """
+    columns = [json_timestamp(column) if column in (Coupon.starts_at, Coupon.ends_at) else column
+               for column in COUPON_RULE_COLUMNS]
+    query = select(func.json_agg(func.json_build_array(*columns), type_=JSON)).where(ACTIVE)
+    if codes is not None:
+        query = query.where(Coupon.code.in_([normalize_code(code) for code in codes]))
+    return query.scalar_subquery()
+
+
+def coupon_index_from_json(rows: Optional[List[list]]) -> CouponIndex:
+    def timestamp(value: Optional[str]) -> Optional[datetime]:
+        return None if value is None else datetime.fromisoformat(value)
+
+    return CouponIndex(CouponRule(*values, timestamp(starts_at), timestamp(ends_at))
+                       for *values, starts_at, ends_at in rows or ())
+
+
+async def load_coupon_index(db: AsyncSession) -> CouponIndex:
+    generation = coupon_index_cache.generation
+    index = CouponIndex(CouponRule(*row) for row in (await db.execute(ACTIVE_COUPONS)).all())
+    coupon_index_cache.set(COUPON_INDEX_KEY, index, generation)
+    return index
+
+
+async def get_coupon_index(db: AsyncSession) -> CouponIndex:
+    index = coupon_index_cache.get(COUPON_INDEX_KEY)
+    if index is None:
+        # no stampede guard, waiting on a thread lock would block the event loop and the load is one query
+        index = await load_coupon_index(db)
+    return index
+
+
+def shard_capacities(max_redemptions: int, shards: int = COUPON_REDEMPTION_SHARDS) -> List[int]:
+    # every shard takes at least one redemption, the first ones one more when the cap doesn't split evenly
+    shards = min(shards, max_redemptions)
+    share, extra = divmod(max_redemptions, shards)
+    return [share + (shard < extra) for shard in range(shards)]
+
+
+def _redemption(coupon_id: int, skip_locked: bool):
+    # the skip locked pass starts at a random shard so concurrent orders spread over the rows, then goes round
+    # the others. The blocking pass goes in shard order: a row it waited for keeps its lock even when it turns
+    # out to be full, and two orders scanning from different starts would each hold a row the other waits for
+    start = random.randrange(COUPON_REDEMPTION_SHARDS) if skip_locked else 0
+    target = (
+        select(CouponRedemptionShard.coupon_id, CouponRedemptionShard.shard)
+        .where(CouponRedemptionShard.coupon_id == coupon_id,
+               CouponRedemptionShard.redeemed < CouponRedemptionShard.capacity)
+        .order_by(CouponRedemptionShard.shard < start, CouponRedemptionShard.shard)
+        .limit(1)
+        .with_for_update(skip_locked=skip_locked)
+        .cte("target")
+    )
+    return (
+        update(CouponRedemptionShard)
+        .where(CouponRedemptionShard.coupon_id == target.c.coupon_id, CouponRedemptionShard.shard == target.c.shard,
+               CouponRedemptionShard.redeemed < CouponRedemptionShard.capacity)
+        .values(redeemed=CouponRedemptionShard.redeemed + 1)
+        .returning(CouponRedemptionShard.shard)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def redeem_coupon(db: AsyncSession, rule: CouponRule):
+    """
+    Count a redemption of a capped coupon in the order transaction, uncapped coupons aren't counted.
+
+    A conditional update of one shard that still has room: shards locked by orders in flight are skipped
+    first, and only when every shard left is locked does the order wait for one of them, whose room is checked
+    again once it is released. Raises 400 when the cap is reached.
+    """
+    if rule.max_redemptions is None:
+        return
+    for skip_locked in (True, False):
+        if (await db.execute(_redemption(rule.id, skip_locked))).first() is not None:
+            return
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Coupon {rule.code} has reached its usage limit")
+
+
+def coupon_redemptions(db: Session, coupon_id: int) -> int:
+    return db.execute(select(func.coalesce(func.sum(CouponRedemptionShard.redeemed), 0))
+                      .where(CouponRedemptionShard.coupon_id == coupon_id)).scalar_one()
+
+
+def coupon_document(coupon: Coupon, redeemed: int) -> dict:
+    return {**{column.key: getattr(coupon, column.key) for column in Coupon.__table__.columns}, "redeemed": redeemed}
+
+
+def create_coupon(db: Session, coupon: CouponCreate) -> dict:
+    values = coupon.model_dump()
+    values.update(code=normalize_code(coupon.code), type=coupon.type.value)
+    db_coupon = Coupon(**values)
+    if coupon.max_redemptions is not None:
+        db_coupon.shards = [CouponRedemptionShard(shard=shard, capacity=capacity, redeemed=0)
+                            for shard, capacity in enumerate(shard_capacities(coupon.max_redemptions))]
+    db.add(db_coupon)
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if getattr(e.orig, "pgcode", None) == UNIQUE_VIOLATION:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Coupon code already exists")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown branch or category")
+    db.refresh(db_coupon)
+    return coupon_document(db_coupon, 0)
+
+
+def get_coupon(db: Session, coupon_id: int) -> dict:
+    db_coupon = db.get(Coupon, coupon_id)
+    if db_coupon is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Coupon not found")
+    return coupon_document(db_coupon, coupon_redemptions(db, coupon_id))
+
+
+@event.listens_for(Coupon, "after_insert")
+@event.listens_for(Coupon, "after_update")
+@event.listens_for(Coupon, "after_delete")
+def _coupon_written(mapper, connection, target):
+    object_session(target).info[COUPONS_CHANGED_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _reload_coupons(session: Session):
+    # dropped only after the commit, like the other caches, so a concurrent reload can't keep the old rows
+    if session.info.pop(COUPONS_CHANGED_KEY, False):
+        coupon_index_cache.clear()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_coupon_changes(session: Session):
+    session.info.pop(COUPONS_CHANGED_KEY, None)
@@ -0,0 +1,215 @@
+import os
+from array import array
+from bisect import bisect_left
+from datetime import datetime, date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException, status
+from sqlalchemy import select, not_
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.core.utils import in_stock, make_etag
+from app.crud.branch_catalogs import track_branch_catalog
+from app.crud.categories import ACTIVE_CATEGORIES, ACTIVE_SUBCATEGORIES
+from app.crud.products import LISTED
+from app.db import read_from_primary
+from app.models import Branch, Product, ProductVariation, VariationOption, Addon
+from app.models.product import product_addons_association, product_variation_option_association
+
+BRANCH_MENU_CACHE_SIZE = int(os.getenv("BRANCH_MENU_CACHE_SIZE", 512))
+# Catalog edits made through this process swap the menus on the next request, the TTL bounds how long the
+# other workers keep serving theirs
+BRANCH_MENU_TTL = float(os.getenv("BRANCH_MENU_TTL", 300))
+
+# branch id -> BranchMenu
+menu_cache = track_branch_catalog(TTLCache("branch_menu", BRANCH_MENU_CACHE_SIZE, BRANCH_MENU_TTL))
+
+
+class MenuRecord:
+    """
+    Immutable menu node: fixed slots, children kept in tuples, turned into JSON objects by the menu serializer.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for slot, value in zip(self.__slots__, values):
+            object.__setattr__(self, slot, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+class MenuOption(MenuRecord):
+    __slots__ = ("id", "name", "price")
+
+
+class MenuVariation(MenuRecord):
+    __slots__ = ("id", "title", "type", "min_selections", "max_selections", "required", "options")
+
+
+class MenuAddon(MenuRecord):
+    __slots__ = ("id", "title", "price", "tax")
+
+
+class MenuProduct(MenuRecord):
+    __slots__ = ("id", "name", "price", "description", "image", "tags", "discount_type", "discount_value",
+                 "variations", "addons")
+
+
+class MenuSubCategory(MenuRecord):
+    __slots__ = ("id", "name", "products")
+
+
+class MenuCategory(MenuRecord):
+    __slots__ = ("id", "name", "priority", "banner_image", "image", "subcategories", "products")
+
+
+def _record_fields(record: MenuRecord) -> dict:
+    return {slot: getattr(record, slot) for slot in record.__slots__}
+
+
+class BranchMenu:
+    """
+    Snapshot of a branch menu: the categories serialized once, and the sorted ids of the products they list
+    so the request time stock overlay can be matched against them. Never modified, a catalog change swaps
+    in a new snapshot while requests already holding the old one finish with it.
+    """
+    __slots__ = ("branch_id", "categories", "product_ids", "etag", "built_at")
+
+    def __init__(self, branch_id: int, categories: bytes, product_ids: Iterable[int], built_at: datetime):
+        self.branch_id = branch_id
+        self.categories = categories
+        self.product_ids = array("l", sorted(product_ids))
+        self.etag = make_etag("menu", branch_id, categories)
+        self.built_at = built_at
+
+    def lists(self, product_id: int) -> bool:
+        position = bisect_left(self.product_ids, product_id)
+        return position < len(self.product_ids) and self.product_ids[position] == product_id
+
+
+def _menu_products(db: Session, branch_id: int) -> List[Tuple[Optional[int], Optional[int], MenuProduct]]:
+    """
+    The listed products of a branch with their category and subcategory ids, one query per table.
+    """
+    branch_products = select(Product.id).where(Product.branch_id == branch_id, LISTED)
+
+    options: Dict[int, List[MenuOption]] = {}
+    for variation_id, option_id, name, price in db.execute(
+        select(product_variation_option_association.c.product_variation_id, VariationOption.id,
+               VariationOption.name, VariationOption.price)
+        .join(VariationOption, VariationOption.id == product_variation_option_association.c.variation_option_id)
+        .join(ProductVariation, ProductVariation.id == product_variation_option_association.c.product_variation_id)
+        .where(ProductVariation.product_id.in_(branch_products))
+        .order_by(VariationOption.id)
+    ):
+        options.setdefault(variation_id, []).append(MenuOption(option_id, name, price))
+
+    variations: Dict[int, List[MenuVariation]] = {}
+    for row in db.execute(
+        select(ProductVariation.id, ProductVariation.title, ProductVariation.type, ProductVariation.min_selections,
+               ProductVariation.max_selections, ProductVariation.required, ProductVariation.product_id)
+        .where(ProductVariation.product_id.in_(branch_products))
+        .order_by(ProductVariation.id)
+    ):
+        variations.setdefault(row.product_id, []).append(
+            MenuVariation(row.id, row.title, row.type, row.min_selections, row.max_selections, row.required,
+                          tuple(options.get(row.id, ()))))
+
+    addons: Dict[int, List[MenuAddon]] = {}
+    for product_id, addon_id, title, price, tax in db.execute(
+        select(product_addons_association.c.product_id, Addon.id, Addon.title, Addon.price, Addon.tax)
+        .join(Addon, Addon.id == product_addons_association.c.addon_id)
+        .where(product_addons_association.c.product_id.in_(branch_products))
+        .order_by(Addon.id)
+    ):
+        addons.setdefault(product_id, []).append(MenuAddon(addon_id, title, price, tax))
+
+    products = []
+    for row in db.execute(
+        select(Product.id, Product.name, Product.price, Product.description, Product.image, Product.tags,
+               Product.discount_type, Product.discount_value, Product.category_id, Product.subcategory_id)
+        .where(Product.branch_id == branch_id, LISTED)
+        .order_by(Product.id)
+    ):
+        tags = orjson.loads(row.tags) if isinstance(row.tags, (str, bytes)) else row.tags
+        products.append((row.category_id, row.subcategory_id, MenuProduct(
+            row.id, row.name, row.price, row.description, row.image, tuple(tags or ()), row.discount_type,
+            row.discount_value, tuple(variations.get(row.id, ())), tuple(addons.get(row.id, ())))))
+    return products
+
+
+def build_branch_menu(db: Session, branch_id: int) -> BranchMenu:
+    """
+    The menu of a branch: active categories by priority, their active subcategories and the listed products
+    of the branch with their variations, options and addons. Built with a fixed number of queries whatever
+    the size of the menu; categories and subcategories without products are left out.
+    """
+    if db.execute(select(Branch.id).where(Branch.id == branch_id)).first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Branch not found")
+    built_at = datetime.now()
+
+    by_category: Dict[int, List[MenuProduct]] = {}
+    by_subcategory: Dict[int, List[MenuProduct]] = {}
+    for category_id, subcategory_id, product in _menu_products(db, branch_id):
+        if subcategory_id is None:
+            by_category.setdefault(category_id, []).append(product)
+        else:
+            by_subcategory.setdefault(subcategory_id, []).append(product)
+
+    subcategories: Dict[int, List[MenuSubCategory]] = {}
+    for row in db.execute(ACTIVE_SUBCATEGORIES):
+        if row.id in by_subcategory:
+            subcategories.setdefault(row.category_id, []).append(
+                MenuSubCategory(row.id, row.name, tuple(by_subcategory[row.id])))
+
+    categories: List[MenuCategory] = []
+    product_ids: List[int] = []
+    for row in db.execute(ACTIVE_CATEGORIES):
+        category = MenuCategory(row.id, row.name, row.priority, row.banner_image, row.image,
+                                tuple(subcategories.get(row.id, ())), tuple(by_category.get(row.id, ())))
+        if category.subcategories or category.products:
+            categories.append(category)
+            product_ids.extend(product.id for product in category.products)
+            product_ids.extend(product.id for subcategory in category.subcategories
+                               for product in subcategory.products)
+
+    return BranchMenu(branch_id, orjson.dumps(categories, default=_record_fields), product_ids, built_at)
+
+
+def get_branch_menu(db: Session, branch_id: int) -> BranchMenu:
+    def load() -> BranchMenu:
+        # from the primary, a lagging replica would cache the menu a catalog change just invalidated
+        with read_from_primary(db):
+            return build_branch_menu(db, branch_id)
+
+    return menu_cache.get_or_load(branch_id, load)
+
+
+def sold_out_products(db: Session, menu: BranchMenu) -> List[int]:
+    """
+    Products of the menu that can't be ordered right now, read at request time from the partial index of
+    the branch's listed products, so stock changes never rebuild the snapshot.
+    """
+    ids = db.execute(
+        select(Product.id)
+        .where(Product.branch_id == menu.branch_id, LISTED, not_(in_stock(date.today())))
+        .order_by(Product.id)
+    ).scalars()
+    # products listed after the snapshot was built aren't on the menu yet
+    return [product_id for product_id in ids if menu.lists(product_id)]
+
+
+def render_branch_menu(menu: BranchMenu, sold_out: List[int]) -> Tuple[bytes, str]:
+    """
+    The BranchMenuResponse JSON: the cached categories spliced in as they are, and its ETag.
+    """
+    body = b"".join((
+        b'{"branch_id":', orjson.dumps(menu.branch_id),
+        b',"built_at":', orjson.dumps(menu.built_at),
+        b',"categories":', menu.categories,
+        b',"sold_out":', orjson.dumps(sold_out), b"}",
+    ))
+    return body, make_etag(menu.etag, sold_out)
@@ -3,7 +3,7 @@ from typing import Dict
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, WebSocket
 
-from app.db.session import SessionLocal
+from app.db.session import AsyncSessionLocal
 from app.models import Notification, User
 from app.db import get_background_task_db
 
@@ -12,23 +12,20 @@ active_connections: Dict[int, WebSocket] = {}
 
 
 async def create_notification(user_id: int, message: str):
-    db = SessionLocal()
-    try:
-        user = db.query(User).get(user_id)
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         notification = Notification(message=message, user_id=user_id)
         db.add(notification)
-        db.commit()
-        db.refresh(notification)
+        await db.commit()
+        await db.refresh(notification)
 
         # Send notification via WebSocket if user is connected
         if user_id in active_connections:
             await send_notification(user_id, notification)
 
         return notification
-    finally:
-        db.close()
 
 
 async def send_notification(user_id: int, notification: Notification):
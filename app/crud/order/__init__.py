@@ -1,3 +1,5 @@
 from .order_creation import create_order
-from .get_orders import get_order_by_id, get_user_orders, get_branch_orders
+from .get_orders import get_order_by_id, get_order_detail, get_user_orders, get_branch_orders
 from .order_status import order_cancellation, updating_order_status
+from .idempotency import claim_idempotency_key, request_fingerprint
+from .pricing import quote_cart, price_cart, price_order, get_price_table
@@ -1,27 +1,116 @@
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, select, cast, case, func, Text, BigInteger
+from sqlalchemy.orm import Session, selectinload
 from typing import Type
 
-from app.models import Order
+from app.models import Order, OrderItem, ProductVariation, ShippingAddress
+from app.models.order import order_item_addon_association, order_item_variation_association
+from app.models.product import product_variation_option_association
 from app.core import logger
 
 from fastapi import HTTPException
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 from app.models import User
+from app.schemas.pagination import PageParams
+from app.core.utils import paginate, json_object, json_array, json_timestamp, to_json
+from app.core.utils import db_utils
+from app.schemas.order import OrderResponse
+
+
+# Everything OrderResponse reads, one query per relationship for the whole page instead of lazy loads per order
+# and per item
+ORDER_DETAIL = (
+    selectinload(Order.shipping_address),
+    selectinload(Order.items).selectinload(OrderItem.addons),
+    selectinload(Order.items).selectinload(OrderItem.variations).selectinload(ProductVariation.options),
+)
 
 
 def get_order_by_id(db: Session, order_id: int, user: User) -> Order | None:
-    order = db.query(Order).get(order_id)
-    if order.user_id != user.id:
-        raise HTTPException(status_code=403, detail="You are not authorized to view this order")
+    order = db.query(Order).options(*ORDER_DETAIL).filter(and_(Order.id == order_id)).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    if order.user_id != user.id:
+        raise HTTPException(status_code=403, detail="You are not authorized to view this order")
     return order
 
 
-def get_user_orders(db: Session, user_id: int) -> list[Type[Order]]:
+def _decimal_text(value):
+    # a Decimal field renders as a string, and a float converted to Decimal keeps its ".0" when it is integral
+    return case((value == func.trunc(value), cast(cast(value, BigInteger), Text) + ".0"), else_=cast(value, Text))
+
+
+def order_document_query(order_id: int):
+    """
+    The OrderResponse JSON of an order built by Postgres, with the owner of the order.
+    """
+    options = (
+        select(json_array(json_object(id=product_variation_option_association.c.variation_option_id),
+                          product_variation_option_association.c.variation_option_id))
+        .where(product_variation_option_association.c.product_variation_id
+               == order_item_variation_association.c.variation_id)
+        .scalar_subquery()
+    )
+    variations = (
+        select(json_array(json_object(id=order_item_variation_association.c.variation_id, options=options),
+                          order_item_variation_association.c.variation_id))
+        .where(order_item_variation_association.c.order_item_id == OrderItem.id)
+        .scalar_subquery()
+    )
+    addons = (
+        select(json_array(json_object(id=order_item_addon_association.c.addon_id),
+                          order_item_addon_association.c.addon_id))
+        .where(order_item_addon_association.c.order_item_id == OrderItem.id)
+        .scalar_subquery()
+    )
+    items = (
+        select(json_array(json_object(id=OrderItem.id, product_id=OrderItem.product_id, quantity=OrderItem.quantity,
+                                      total_price=_decimal_text(OrderItem.total_price), addons=addons,
+                                      variations=variations), OrderItem.id))
+        .where(OrderItem.order_id == Order.id)
+        .scalar_subquery()
+    )
+    shipping_address = (
+        select(json_object(longitude=ShippingAddress.longitude, latitude=ShippingAddress.latitude,
+                           address=ShippingAddress.address))
+        .where(ShippingAddress.id == Order.shipping_address_id)
+        .scalar_subquery()
+    )
+    document = json_object(
+        id=Order.id, is_scheduled=Order.is_scheduled, scheduled_at=json_timestamp(Order.schedule_time),
+        branch_id=Order.branch_id, type=Order.type, shipping_address=shipping_address, items=items,
+        total_price=cast(Order.total_price, Text), status=Order.status,
+    )
+    # sent as text, the driver would otherwise decode the JSON only for it to be encoded again
+    return select(cast(document, Text), Order.user_id).where(Order.id == order_id)
+
+
+def render_order_document(db: Session, order_id: int, user: User) -> bytes:
+    row = db.execute(order_document_query(order_id)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if row.user_id != user.id:
+        raise HTTPException(status_code=403, detail="You are not authorized to view this order")
+    return row[0].encode()
+
+
+def get_order_detail(db: Session, order_id: int, user: User) -> bytes:
+    """
+    The serialized OrderResponse of an order, rendered by Postgres in one query with DB_JSON_RENDERING.
+    """
+    if db_utils.DB_JSON_RENDERING:
+        return render_order_document(db, order_id, user)
+    return to_json(OrderResponse, get_order_by_id(db, order_id, user))
+
+
+def get_user_orders(db: Session, user_id: int, page: PageParams) -> dict:
     try:
-        return db.query(Order).filter(and_(Order.user_id == user_id)).all()
+        # newest first
+        return paginate(db.query(Order).options(*ORDER_DETAIL).filter(and_(Order.user_id == user_id)), Order.id, page,
+                        descending=True)
+    except HTTPException as e:
+        raise e
+    except PoolTimeoutError:
+        raise
     except SQLAlchemyError as e:
         logger.error(str(e))
         raise HTTPException(status_code=500, detail=str(e))
@@ -33,6 +122,8 @@ def get_user_orders(db: Session, user_id: int) -> list[Type[Order]]:
 def get_branch_orders(db: Session, branch_id: int) -> list[Type[Order]]:
     try:
         return db.query(Order).filter(and_(Order.branch_id == branch_id)).all()
+    except PoolTimeoutError:
+        raise
     except SQLAlchemyError as e:
         logger.error(str(e))
         raise HTTPException(status_code=500, detail=str(e))
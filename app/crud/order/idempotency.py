@@ -0,0 +1,84 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+import orjson
+from fastapi import HTTPException, status
+from sqlalchemy import select, update, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import IdempotencyKey
+from app.schemas.order import OrderCreate
+
+# Seconds a key is remembered, a key sent again after that creates a new order
+IDEMPOTENCY_KEY_TTL = float(os.getenv("IDEMPOTENCY_KEY_TTL", 24 * 3600))
+# Seconds a duplicate waits for the attempt in flight before it gets a 409
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", 10))
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+class IdempotencyClaim:
+    """
+    The key row of an order creation, and the stored response when the order was already created.
+    """
+    __slots__ = ("id", "response")
+
+    def __init__(self, id: int, response: Optional[bytes] = None):
+        self.id = id
+        self.response = response
+
+
+def request_fingerprint(order: OrderCreate) -> str:
+    return hashlib.sha256(orjson.dumps(order.model_dump(mode="json"), option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+async def claim_idempotency_key(db: AsyncSession, user_id: int, key: str, fingerprint: str) -> IdempotencyClaim:
+    """
+    Insert the key of an order creation, it has to be the first statement of the order transaction.
+
+    While another attempt with the same key is in flight the insert waits on the unique index: once that
+    attempt commits the stored response is returned, if it rolled back this one claims the key and creates
+    the order. Raises 409 when the wait outlasts IDEMPOTENCY_WAIT_TIMEOUT, 422 when the key was sent with
+    another request. Expired keys are claimed again.
+    """
+    now = datetime.now()
+    stmt = pg_insert(IdempotencyKey).values(key=key, user_id=user_id, fingerprint=fingerprint, created_at=now)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_idempotency_keys_user_id_key",
+        set_={"fingerprint": stmt.excluded.fingerprint, "created_at": stmt.excluded.created_at,
+              "response": None, "order_id": None},
+        where=IdempotencyKey.created_at < now - timedelta(seconds=IDEMPOTENCY_KEY_TTL),
+    ).returning(IdempotencyKey.id)
+
+    # only the wait on the key is bounded, the stock row locks taken later keep the server default
+    await db.execute(text(f"SET LOCAL lock_timeout = {int(IDEMPOTENCY_WAIT_TIMEOUT * 1000)}"))
+    try:
+        key_id = (await db.execute(stmt)).scalar_one_or_none()
+    except DBAPIError as e:
+        if getattr(e.orig, "sqlstate", None) == LOCK_NOT_AVAILABLE:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="A request with this Idempotency-Key is still in progress",
+                                headers={"Retry-After": "1"})
+        raise
+    await db.execute(text("SET LOCAL lock_timeout = DEFAULT"))
+    if key_id is not None:
+        return IdempotencyClaim(key_id)
+
+    stored = (await db.execute(
+        select(IdempotencyKey.id, IdempotencyKey.fingerprint, IdempotencyKey.response)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+    )).one()
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Idempotency-Key was already used for another request")
+    return IdempotencyClaim(stored.id, stored.response)
+
+
+async def store_idempotent_response(db: AsyncSession, key_id: int, order_id: int, response: bytes):
+    # written in the order transaction, the key and the order are committed together or not at all
+    await db.execute(update(IdempotencyKey).where(IdempotencyKey.id == key_id)
+                     .values(order_id=order_id, response=response))
@@ -1,168 +1,207 @@
 import asyncio
-from typing import Optional
+from typing import Optional, Dict, List
 from fastapi import HTTPException, status
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, values, column, Integer, Table
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core import logger
-from app.models import User, Order, OrderItem, Branch, Product, VariationOption, ProductVariation, Addon, \
-    ShippingAddress, ShippingOrder, Payment
-from app.schemas.order import OrderCreate
-from app.core.utils import check_product_stocks, get_or_create
+from app.models import User, Order, OrderItem, ShippingAddress, ShippingOrder, Payment
+from app.models.order import order_item_addon_association, order_item_variation_association
+from app.models.product import ProductSalesDelta
+from app.models.shipping import SHIPPING_ADDRESS_UNIQUE_CONSTRAINT
+from app.schemas.order import OrderCreate, OrderResponse, OrderItemResponse, OrderStatusEnum, OrderType
+from app.core.utils import reserve_product_stocks, check_stock_type, InsufficientStockError, to_json, from_minor
 from decimal import Decimal
 from datetime import datetime
 from app.crud.notification import create_notification
+from app.crud.products import mark_products_changed
+from app.crud.branches import get_branch_index_async
+from app.crud.order.idempotency import store_idempotent_response
+from app.crud.order.pricing import PriceTable, PricedLine, price_order
+from app.crud.coupons import redeem_coupon
 from app.schemas.payment import PaymentRequestSchema
 
 
-def check_branch_exists(db: Session, branch_id: int):
-    if not db.query(Branch).filter(and_(Branch.id == branch_id)).first():
+async def check_order_branch(db: AsyncSession, order: OrderCreate):
+    # answered from the in-memory branch index, no query unless it has to be rebuilt
+    branch = (await get_branch_index_async(db)).get(order.branch_id)
+    if branch is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Branch not found")
+    address = order.shipping_address
+    if order.type == OrderType.SHIPPING and not branch.covers(address.latitude, address.longitude):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Shipping address is outside the branch coverage")
 
 
-def create_new_order(order: OrderCreate, user: User) -> Order:
-    return Order(
-        user_id=user.id,
-        type=order.type.value,
-        branch_id=order.branch_id,
-    )
-
-
-def process_addons(db: Session, db_product: Product, order_product,
-                   new_order_item: OrderItem) -> Decimal:
-    total_addon_price = Decimal('0.00')
-    for addon in order_product.addons:
-        db_addon = db.query(Addon).get(addon.id)
-        if not db_addon:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Addon {addon.id} not found")
-        if db_addon not in db_product.addons:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid addon")
-        total_addon_price += Decimal(str(db_addon.price)) + Decimal(str(db_addon.tax))
-        new_order_item.addons.append(db_addon)
-    return total_addon_price
-
-
-def process_variations(db: Session, db_product: Product, order_product, new_order_item: OrderItem):
-    variations = set()
-    total_variation_price = Decimal('0.00')
-    for variation in order_product.variations:
-        product_variation: ProductVariation = db.query(ProductVariation).get(variation.id)
-        if not product_variation:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Variation {variation.id} not found")
-        if product_variation not in db_product.variations:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid variation")
-        variations.add(product_variation)
-        new_order_item.variations.append(product_variation)
-        if len(variation.options) < product_variation.min_selections or len(
-                variation.options) > product_variation.max_selections:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid variation options number")
-        for option in variation.options:
-            variation_option = db.query(VariationOption).get(option.id)
-            if not variation_option:
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                    detail=f"Variation option {option.id} not found")
-            total_variation_price += Decimal(str(variation_option.price))
-    return total_variation_price, variations
-
-
-def check_required_variations(db_product: Product, variations: set):
-    for db_product_variation in db_product.variations:
-        if db_product_variation.required and db_product_variation not in variations:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                detail=f"Variation {db_product_variation.title} is required")
-
-
-def process_order_product(db: Session, order: OrderCreate, order_product,
-                          new_order: Order) -> Decimal:
-    db_product: Optional[Product] = db.query(Product).filter(
-        and_(Product.id == order_product.product_id),
-        and_(Product.branch_id == order.branch_id)
-    ).first()
-    if not db_product:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Product {order_product.product_id} not found")
-    if not check_product_stocks(db, db_product, order_product.quantity):
+async def reserve_order_stocks(db: AsyncSession, prices: PriceTable, order: OrderCreate):
+    quantities: Dict[int, int] = {}
+    for order_product in order.products:
+        product_id = order_product.product_id
+        if check_stock_type(prices.products[product_id]):
+            quantities[product_id] = quantities.get(product_id, 0) + order_product.quantity
+    try:
+        await reserve_product_stocks(db, quantities)
+    except InsufficientStockError as e:
+        logger.info(str(e))
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient stocks")
-
-    new_order_item = OrderItem(
-        quantity=order_product.quantity,
-        product_id=order_product.product_id,
-    )
-
-    total_order_item_price = Decimal(str(db_product.price)) * Decimal(str(order_product.quantity))
-    total_order_item_price += process_addons(db, db_product, order_product, new_order_item)
-    variation_price, variations = process_variations(db, db_product, order_product, new_order_item)
-    total_order_item_price += variation_price
-
-    check_required_variations(db_product, variations)
-
-    new_order_item.total_price = total_order_item_price
-    new_order.items.append(new_order_item)
-
-    return total_order_item_price
+    # the cached product details show the stock, drop them once the order commits
+    mark_products_changed(db, quantities)
 
 
-def create_or_get_shipping_address(db: Session, shipping_address_data: dict) -> ShippingAddress:
-    shipping_address, _ = get_or_create(db, ShippingAddress, **shipping_address_data)
-    return shipping_address
-
-
-def validate_and_set_schedule(order: OrderCreate, new_order: Order):
+def validate_schedule(order: OrderCreate):
     if order.is_scheduled:
         if order.scheduled_at is None:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Scheduled at is required")
         if order.scheduled_at < datetime.now():
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid scheduled at")
-        new_order.scheduled_at = order.scheduled_at
-        new_order.is_scheduled = True
 
 
-def create_shipping_order(db: Session, total_price: Decimal, order_id: int, user_id: int):
+async def insert_order(db: AsyncSession, order: OrderCreate, user: User, total_price: Decimal) -> int:
+    # upsert the shipping address and insert the order in one statement, the address row is
+    # locked by ON CONFLICT DO UPDATE so concurrent orders to the same address get the same id
+    address_stmt = pg_insert(ShippingAddress).values(**order.shipping_address.model_dump())
+    address = address_stmt.on_conflict_do_update(
+        constraint=SHIPPING_ADDRESS_UNIQUE_CONSTRAINT,
+        set_={"address": address_stmt.excluded.address}
+    ).returning(ShippingAddress.id).cte("address")
+
+    # column defaults aren't rendered for an INSERT that carries a DML CTE, so they are spelled out here
+    stmt = insert(Order.__table__).values(
+        user_id=user.id,
+        status=OrderStatusEnum.PENDING.value,
+        is_paid=False,
+        created_at=datetime.now(),
+        type=order.type.value,
+        branch_id=order.branch_id,
+        total_price=total_price,
+        is_scheduled=bool(order.is_scheduled),
+        schedule_time=order.scheduled_at if order.is_scheduled else None,
+        shipping_address_id=select(address.c.id).scalar_subquery(),
+    ).returning(Order.id)
+    return (await db.execute(stmt)).scalar_one()
+
+
+async def insert_order_items(db: AsyncSession, order_id: int, lines: List[PricedLine]) -> List[int]:
+    # a single multi-row INSERT, ids come back in the same order as the lines
+    stmt = insert(OrderItem.__table__).returning(OrderItem.id, sort_by_parameter_order=True)
+    result = await db.execute(stmt, [
+        {"order_id": order_id, "product_id": line.product_id, "quantity": line.quantity,
+         "total_price": from_minor(line.total_price)}
+        for line in lines
+    ])
+    return list(result.scalars().all())
+
+
+def shipping_order_values(total_price: Decimal, order_id: int, user_id: int) -> dict:
     # for testing purposes
-    shipping_order = ShippingOrder(
+    return dict(
         fee=total_price * Decimal(str(0.01)),
         status="pending",
+        created_at=datetime.now(),
         order_id=order_id,
         shipping_client="test",
         shipping_client_data={},
         user_id=user_id
     )
-    db.add(shipping_order)
 
 
-def create_payment(db: Session, amount: Decimal, order_id: int, user_id: int, payment_data: PaymentRequestSchema):
-    print(order_id)
-    payment = Payment(
+def payment_values(amount: Decimal, order_id: int, user_id: int, payment_data: PaymentRequestSchema) -> dict:
+    return dict(
         amount=amount,
         status="accepted",
         order_id=order_id,
         user_id=user_id,
         **payment_data.model_dump()
     )
-    db.add(payment)
 
 
-async def create_order(db: Session, order: OrderCreate, user: User) -> Order:
+def association_insert(table: Table, column_name: str, rows: List[tuple]):
+    rows_values = values(column("order_item_id", Integer), column(column_name, Integer), name=f"{table.name}_rows")
+    return insert(table).from_select(["order_item_id", column_name], select(rows_values.data(rows)))
+
+
+async def insert_order_details(db: AsyncSession, order: OrderCreate, user: User, order_id: int, total_price: Decimal,
+                               lines: List[PricedLine], item_ids: List[int]):
+    # addon / variation association rows, the sales, the shipping order and the payment go out as one statement
+    ctes = []
+    addon_rows = [(item_id, addon_id)
+                  for item_id, line in zip(item_ids, lines)
+                  for addon_id in dict.fromkeys(line.addon_ids)]
+    variation_rows = [(item_id, variation_id)
+                      for item_id, line in zip(item_ids, lines)
+                      for variation_id in dict.fromkeys(variation.id for variation, _ in line.variations)]
+    if addon_rows:
+        ctes.append(association_insert(order_item_addon_association, "addon_id", addon_rows).cte("item_addons"))
+    if variation_rows:
+        ctes.append(association_insert(order_item_variation_association, "variation_id", variation_rows)
+                    .cte("item_variations"))
+    # sales go to the pending deltas, the product rows are updated in batches by flush_product_sales
+    sales: Dict[int, int] = {}
+    for line in lines:
+        sales[line.product_id] = sales.get(line.product_id, 0) + line.quantity
+    ctes.append(insert(ProductSalesDelta.__table__)
+                .values([{"product_id": product_id, "quantity": quantity} for product_id, quantity in sales.items()])
+                .cte("sales"))
+    ctes.append(insert(ShippingOrder.__table__).values(shipping_order_values(total_price, order_id, user.id))
+                .cte("shipping_order"))
+
+    stmt = insert(Payment.__table__).values(payment_values(total_price, order_id, user.id, order.payment))
+    await db.execute(stmt.add_cte(*ctes))
+
+
+def build_order_response(order: OrderCreate, order_id: int, total_price: Decimal, lines: List[PricedLine],
+                         item_ids: List[int]) -> OrderResponse:
+    return OrderResponse(
+        id=order_id,
+        is_scheduled=bool(order.is_scheduled),
+        scheduled_at=order.scheduled_at if order.is_scheduled else None,
+        branch_id=order.branch_id,
+        type=order.type,
+        shipping_address=order.shipping_address,
+        items=[
+            OrderItemResponse(
+                id=item_id,
+                product_id=line.product_id,
+                quantity=line.quantity,
+                total_price=from_minor(line.total_price),
+                addons=[{"id": addon_id} for addon_id in line.addon_ids],
+                variations=[{"id": variation.id, "options": [{"id": option_id} for option_id in variation.options]}
+                            for variation, _ in line.variations],
+            )
+            for item_id, line in zip(item_ids, lines)
+        ],
+        total_price=total_price,
+        status=OrderStatusEnum.PENDING,
+    )
+
+
+async def create_order(db: AsyncSession, order: OrderCreate, user: User,
+                       idempotency_key_id: Optional[int] = None) -> OrderResponse:
     logger.info("Creating new order for user : #{user.id}")
-    check_branch_exists(db, order.branch_id)
-    new_order = create_new_order(order, user)
-    total_order_price = Decimal('0.00')
+    await check_order_branch(db, order)
 
     if len(order.products) == 0:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No products in order")
 
-    shipping_address = create_or_get_shipping_address(db, order.shipping_address.model_dump())
-    new_order.shipping_address_id = shipping_address.id
-
-    validate_and_set_schedule(order, new_order)
-
-    for order_product in order.products:
-        total_order_price += process_order_product(db, order, order_product, new_order)
-    new_order.total_price = total_order_price
-    db.add(new_order)
-    db.flush()
-    create_shipping_order(db, total_order_price, new_order.id, user.id)
-    create_payment(db, total_order_price, new_order.id, user.id, order.payment)
-    logger.info(f"Order {new_order.id} created")
-    db.commit()
-    await asyncio.create_task(create_notification(user.id, f"New order {new_order.id} created"))
-    return new_order
+    validate_schedule(order)
+
+    # priced by the same engine as the quotes, but from the current rows: what is charged never comes from a
+    # cache another worker's catalog change hasn't reached yet
+    prices, cart = await price_order(db, order.branch_id, order.products, cached=False)
+    total_order_price = from_minor(cart.total_price)
+    # stock and coupons are only reserved once the whole cart is valid, the rows stay locked until the order
+    # commits, a capped coupon on one of several counter shards
+    await reserve_order_stocks(db, prices, order)
+    for coupon in cart.coupons:
+        await redeem_coupon(db, coupon)
+
+    order_id = await insert_order(db, order, user, total_order_price)
+    item_ids = await insert_order_items(db, order_id, cart.lines)
+    await insert_order_details(db, order, user, order_id, total_order_price, cart.lines, item_ids)
+    response = build_order_response(order, order_id, total_order_price, cart.lines, item_ids)
+    if idempotency_key_id is not None:
+        await store_idempotent_response(db, idempotency_key_id, order_id, to_json(OrderResponse, response))
+    logger.info(f"Order {order_id} created")
+    await db.commit()
+    await asyncio.create_task(create_notification(user.id, f"New order {order_id} created"))
+    return response
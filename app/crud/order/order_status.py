@@ -1,30 +1,51 @@
 from fastapi import HTTPException, status
-from sqlalchemy import and_
+from sqlalchemy import and_, select, insert, func
 from sqlalchemy.orm import Session
-from app.models import User, Order
-from sqlalchemy.exc import SQLAlchemyError
+from app.models import User, Order, OrderItem
+from app.models.product import ProductSalesDelta
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 from app.core import logger
 
 
+CANCELLED = "cancelled"
+
+
+def record_sales_change(db: Session, order: Order, new_status: str):
+    """
+    Take the order's items out of the product sales when it gets cancelled, and back in if it is revived.
+    """
+    if (order.status == CANCELLED) == (new_status == CANCELLED):
+        return
+    sign = 1 if order.status == CANCELLED else -1
+    items = (select(OrderItem.product_id, sign * func.sum(OrderItem.quantity))
+             .where(OrderItem.order_id == order.id).group_by(OrderItem.product_id))
+    db.execute(insert(ProductSalesDelta).from_select(["product_id", "quantity"], items))
+
+
 def order_cancellation(db: Session, order_id: int, user: User):
-    order = db.query(Order).filter(and_(Order.id == order_id)).first()
+    # locked, two concurrent cancellations must not both take the sales back
+    order = db.query(Order).filter(and_(Order.id == order_id)).with_for_update().first()
     if not order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
     if order.user_id != user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not authorized to cancel this order")
-    if order.status == "cancelled":
+    if order.status == CANCELLED:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Order is already cancelled")
     try:
-        order.status = "cancelled"
+        record_sales_change(db, order, CANCELLED)
+        order.status = CANCELLED
         db.commit()
         return {"message": "Order cancelled successfully"}
+    except PoolTimeoutError:
+        raise
     except SQLAlchemyError as e:
         db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error occurred")
 
 
 def updating_order_status(db: Session, order_id: int, new_order_status: str, user: User):
-    order = db.query(Order).filter(and_(Order.id == order_id)).first()
+    # locked like in order_cancellation
+    order = db.query(Order).filter(and_(Order.id == order_id)).with_for_update().first()
     if not order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
     if order.user_id != user.id:
@@ -32,9 +53,12 @@ def updating_order_status(db: Session, order_id: int, new_order_status: str, use
     if order.status == new_order_status:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Order status is already updated")
     try:
+        record_sales_change(db, order, new_order_status)
         order.status = new_order_status
         db.commit()
         return {"message": f"Order status updated successfully to {new_order_status}"}
+    except PoolTimeoutError:
+        raise
     except SQLAlchemyError as e:
         logger.error(e)
         db.rollback()
@@ -0,0 +1,349 @@
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, func, null, JSON
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import TTLCache
+from app.core.utils import to_minor, from_minor, percent_of
+from app.crud.branch_catalogs import track_branch_catalog
+from app.crud.coupons import CouponIndex, CouponRule, get_coupon_index, normalize_code, active_coupons_json, \
+    coupon_index_from_json, coupon_index_cache, COUPON_INDEX_KEY
+from app.models import Branch, Product, ProductVariation, VariationOption, Addon
+from app.models.product import product_addons_association, product_variation_option_association
+from app.schemas.order import OrderItemSchema, QuoteRequest, QuoteResponse, QuoteLineResponse
+
+BRANCH_PRICES_CACHE_SIZE = int(os.getenv("BRANCH_PRICES_CACHE_SIZE", 512))
+# Catalog edits made through this process recompile the prices on the next quote, the TTL bounds how long
+# the other workers keep quoting with theirs. Orders are always priced from the rows
+BRANCH_PRICES_TTL = float(os.getenv("BRANCH_PRICES_TTL", 60))
+
+# branch id -> PriceTable
+price_cache = track_branch_catalog(TTLCache("branch_prices", BRANCH_PRICES_CACHE_SIZE, BRANCH_PRICES_TTL))
+
+PERCENT_DISCOUNTS = ("percent", "percentage")
+
+
+class VariationPrice:
+    __slots__ = ("id", "title", "min_selections", "max_selections", "required", "options")
+
+    def __init__(self, id: int, title: str, min_selections: Optional[int], max_selections: Optional[int],
+                 required: Optional[bool], options: Dict[int, int]):
+        self.id = id
+        self.title = title
+        self.min_selections = 1 if min_selections is None else min_selections
+        self.max_selections = 1 if max_selections is None else max_selections
+        self.required = bool(required)
+        self.options = options
+
+
+class ProductPrice:
+    """
+    A product with its discounted unit price, and the price of its addons (tax included) and options.
+    """
+    __slots__ = ("id", "price", "discount", "stock_type", "category_id", "addons", "taxes", "variations")
+
+    def __init__(self, id: int, price: float, discount_type: Optional[str], discount_value: Optional[float],
+                 stock_type: str, category_id: Optional[int], addons: List[list], variations: List[list]):
+        self.id = id
+        self.price = to_minor(price)
+        if (discount_type or "").lower() in PERCENT_DISCOUNTS:
+            discount = percent_of(self.price, discount_value or 0)
+        else:
+            discount = to_minor(discount_value)
+        # per unit, a discount never makes a product free of charge plus change
+        self.discount = max(0, min(discount, self.price))
+        self.stock_type = stock_type
+        self.category_id = category_id
+        self.addons: Dict[int, int] = {addon_id: to_minor(price) + to_minor(tax) for addon_id, price, tax in addons}
+        self.taxes: Dict[int, int] = {addon_id: to_minor(tax) for addon_id, _, tax in addons}
+        self.variations: Dict[int, VariationPrice] = {
+            variation_id: VariationPrice(variation_id, title, min_selections, max_selections, required,
+                                         {option_id: to_minor(price) for option_id, price in sorted(options or ())})
+            for variation_id, title, min_selections, max_selections, required, options in variations
+        }
+
+    @property
+    def unit_price(self) -> int:
+        return self.price - self.discount
+
+
+class PriceTable:
+    """
+    Everything needed to price a cart of a branch, compiled from the catalog into integers by one query.
+    """
+    __slots__ = ("branch_id", "products")
+
+    def __init__(self, branch_id: int, products: Dict[int, ProductPrice]):
+        self.branch_id = branch_id
+        self.products = products
+
+
+class PricedLine:
+    """
+    A priced cart line. Addons and options are charged once per line, the product once per unit.
+    """
+    __slots__ = ("product_id", "quantity", "unit_price", "discount", "addons_price", "tax", "options_price",
+                 "coupon_code", "coupon_discount", "total_price", "addon_ids", "variations")
+
+    def __init__(self, product_id: int, quantity: int):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.unit_price = 0
+        self.discount = 0
+        self.addons_price = 0
+        self.tax = 0
+        self.options_price = 0
+        self.coupon_code: Optional[str] = None
+        self.coupon_discount = 0
+        self.total_price = 0
+        self.addon_ids: List[int] = []
+        # (variation, ids of the options picked)
+        self.variations: List[Tuple[VariationPrice, List[int]]] = []
+
+
+class PricedCart:
+    __slots__ = ("branch_id", "lines", "coupons")
+
+    def __init__(self, branch_id: int, lines: List[PricedLine]):
+        self.branch_id = branch_id
+        self.lines = lines
+        # the coupons applied, redeemed when the cart becomes an order
+        self.coupons: List[CouponRule] = []
+
+    @property
+    def discount(self) -> int:
+        return sum(line.discount for line in self.lines)
+
+    @property
+    def coupon_discount(self) -> int:
+        return sum(line.coupon_discount for line in self.lines)
+
+    @property
+    def total_price(self) -> int:
+        return sum(line.total_price for line in self.lines)
+
+
+def price_table_query(branch_id: int, product_ids: Optional[Iterable[int]] = None, coupons=None):
+    """
+    One row for the branch, none when it doesn't exist: its products (only `product_ids` when given) with
+    their addons and variations aggregated into one JSON array, and `coupons`, a JSON scalar subquery read in
+    the same statement, when given.
+    """
+    association = product_variation_option_association
+    options = (
+        select(func.json_agg(func.json_build_array(VariationOption.id, VariationOption.price), type_=JSON))
+        .select_from(association.join(VariationOption, VariationOption.id == association.c.variation_option_id))
+        .where(association.c.product_variation_id == ProductVariation.id)
+        .scalar_subquery()
+    )
+    variations = (
+        select(func.json_agg(func.json_build_array(
+            ProductVariation.id, ProductVariation.title, ProductVariation.min_selections,
+            ProductVariation.max_selections, ProductVariation.required, options), type_=JSON))
+        .where(ProductVariation.product_id == Product.id)
+        .scalar_subquery()
+    )
+    addons = (
+        select(func.json_agg(func.json_build_array(Addon.id, Addon.price, Addon.tax), type_=JSON))
+        .select_from(product_addons_association.join(Addon, Addon.id == product_addons_association.c.addon_id))
+        .where(product_addons_association.c.product_id == Product.id)
+        .scalar_subquery()
+    )
+    products = (
+        select(func.json_agg(func.json_build_array(
+            Product.id, Product.price, Product.discount_type, Product.discount_value, Product.stock_type,
+            Product.category_id, addons, variations), type_=JSON))
+        .where(Product.branch_id == Branch.id)
+    )
+    if product_ids is not None:
+        products = products.where(Product.id.in_(list(product_ids)))
+    return (
+        select(products.scalar_subquery().label("products"),
+               (coupons if coupons is not None else null()).label("coupons"))
+        .where(Branch.id == branch_id)
+    )
+
+
+def compile_price_table(branch_id: int, row) -> PriceTable:
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Branch not found")
+    return PriceTable(branch_id, {
+        product_id: ProductPrice(product_id, price, discount_type, discount_value, stock_type, category_id,
+                                 addons or [], variations or [])
+        for product_id, price, discount_type, discount_value, stock_type, category_id, addons, variations
+        in row.products or ()
+    })
+
+
+async def get_cached_prices(db: AsyncSession, branch_id: int,
+                            with_coupons: bool = False) -> Tuple[PriceTable, Optional[CouponIndex]]:
+    """
+    The branch's cached price table and, when asked for, the cached coupon index. Whatever is missing is
+    loaded with one query: the coupons come with the table when both are.
+    """
+    table = price_cache.get(branch_id)
+    coupons = coupon_index_cache.get(COUPON_INDEX_KEY) if with_coupons else None
+    # no stampede guard, waiting on a thread lock would block the event loop and a load is one query
+    if table is None:
+        load_coupons = with_coupons and coupons is None
+        table_generation, coupons_generation = price_cache.generation, coupon_index_cache.generation
+        row = (await db.execute(price_table_query(
+            branch_id, coupons=active_coupons_json() if load_coupons else None))).first()
+        table = compile_price_table(branch_id, row)
+        price_cache.set(branch_id, table, table_generation)
+        if load_coupons:
+            coupons = coupon_index_from_json(row.coupons)
+            coupon_index_cache.set(COUPON_INDEX_KEY, coupons, coupons_generation)
+    elif with_coupons and coupons is None:
+        coupons = await get_coupon_index(db)
+    return table, coupons
+
+
+async def get_price_table(db: AsyncSession, branch_id: int) -> PriceTable:
+    return (await get_cached_prices(db, branch_id))[0]
+
+
+async def load_cart_prices(db: AsyncSession, branch_id: int, items: List[OrderItemSchema],
+                           codes: Set[str]) -> Tuple[PriceTable, Optional[CouponIndex]]:
+    """
+    The prices of the cart's products and its coupons read from the rows, in one query whatever the size of the
+    branch's catalog. Not cached, the table only covers this cart.
+    """
+    row = (await db.execute(price_table_query(
+        branch_id, {item.product_id for item in items}, active_coupons_json(codes) if codes else None))).first()
+    table = compile_price_table(branch_id, row)
+    return table, coupon_index_from_json(row.coupons) if codes else None
+
+
+def price_line(table: PriceTable, item: OrderItemSchema) -> PricedLine:
+    product = table.products.get(item.product_id)
+    if product is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product {item.product_id} not found")
+    line = PricedLine(product.id, item.quantity)
+    line.unit_price = product.unit_price
+    line.discount = product.discount * item.quantity
+
+    for addon in item.addons or ():
+        price = product.addons.get(addon.id)
+        if price is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Addon {addon.id} is not available for product {product.id}")
+        line.addons_price += price
+        line.tax += product.taxes[addon.id]
+        line.addon_ids.append(addon.id)
+
+    picked = set()
+    for selection in item.variations or ():
+        variation = product.variations.get(selection.id)
+        if variation is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Variation {selection.id} is not available for product {product.id}")
+        options = selection.options or []
+        if not variation.min_selections <= len(options) <= variation.max_selections:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid variation options number")
+        for option in options:
+            price = variation.options.get(option.id)
+            if price is None:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"Variation option {option.id} not found")
+            line.options_price += price
+        picked.add(variation.id)
+        line.variations.append((variation, [option.id for option in options]))
+
+    for variation in product.variations.values():
+        if variation.required and variation.id not in picked:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Variation {variation.title} is required")
+
+    line.total_price = line.unit_price * line.quantity + line.addons_price + line.options_price
+    line.coupon_code = normalize_code(item.coupon_code) if item.coupon_code else None
+    return line
+
+
+def apply_coupons(table: PriceTable, cart: PricedCart, coupons: CouponIndex, now: datetime):
+    """
+    Take the coupon discounts off the lines carrying a code. A code is checked once per cart, against the
+    subtotal before any coupon for its minimum spend, and discounts the lines of the products it covers.
+    """
+    subtotal = cart.total_price
+    by_code: Dict[str, List[PricedLine]] = {}
+    for line in cart.lines:
+        if line.coupon_code:
+            by_code.setdefault(line.coupon_code, []).append(line)
+
+    for code, lines in by_code.items():
+        rule = coupons.get(code)
+        if rule is None or not rule.valid_at(now) or not rule.valid_in(table.branch_id):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Coupon {code} is not valid")
+        if subtotal < rule.min_spend:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Coupon {code} needs a minimum spend of {from_minor(rule.min_spend)}")
+        covered = [line for line in lines if rule.covers(table.products[line.product_id].category_id)]
+        if not covered:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Coupon {code} doesn't apply to these products")
+        for line, discount in zip(covered, rule.discounts([line.total_price for line in covered])):
+            line.coupon_discount = discount
+            line.total_price -= discount
+        cart.coupons.append(rule)
+
+
+def price_cart(table: PriceTable, items: List[OrderItemSchema], coupons: Optional[CouponIndex] = None) -> PricedCart:
+    """
+    Price every line of a cart from the compiled table, no query and no rounding until the amounts are
+    turned back into Decimals. Raises the same HTTP errors an order with that cart gets.
+    """
+    if not items:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No products in order")
+    cart = PricedCart(table.branch_id, [price_line(table, item) for item in items])
+    if coupons is not None:
+        apply_coupons(table, cart, coupons, datetime.now())
+    return cart
+
+
+async def price_order(db: AsyncSession, branch_id: int, items: List[OrderItemSchema],
+                      cached: bool = True) -> Tuple[PriceTable, PricedCart]:
+    """
+    Price a cart from the branch's prices and, only for carts carrying a code, the coupons, with at most one
+    query. Quotes use the cached ones; orders pass `cached=False` and are priced from what the rows hold in
+    their own transaction, as another worker's catalog or coupon change only reaches this one's caches with
+    the TTL.
+    """
+    codes = {normalize_code(item.coupon_code) for item in items if item.coupon_code}
+    if cached:
+        table, coupons = await get_cached_prices(db, branch_id, bool(codes))
+    else:
+        table, coupons = await load_cart_prices(db, branch_id, items, codes)
+    return table, price_cart(table, items, coupons)
+
+
+async def quote_cart(db: AsyncSession, quote: QuoteRequest) -> QuoteResponse:
+    """
+    What the cart would cost as an order, without writing anything nor redeeming its coupons. No query while
+    the branch's prices (and the coupons) are cached, one to compile them otherwise.
+    """
+    _, cart = await price_order(db, quote.branch_id, quote.products)
+    return QuoteResponse(
+        branch_id=cart.branch_id,
+        items=[
+            QuoteLineResponse(
+                product_id=line.product_id,
+                quantity=line.quantity,
+                unit_price=from_minor(line.unit_price),
+                discount=from_minor(line.discount),
+                addons_price=from_minor(line.addons_price),
+                tax=from_minor(line.tax),
+                options_price=from_minor(line.options_price),
+                coupon_code=line.coupon_code,
+                coupon_discount=from_minor(line.coupon_discount),
+                total_price=from_minor(line.total_price),
+            )
+            for line in cart.lines
+        ],
+        discount=from_minor(cart.discount),
+        coupon_discount=from_minor(cart.coupon_discount),
+        total_price=from_minor(cart.total_price),
+    )
@@ -0,0 +1,134 @@
+import os
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, func, or_
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.crud.products import PRODUCT_LIST_COLUMNS, LISTED
+from app.models import Product
+from app.schemas.product import ProductsListResponse
+
+# length of every ranking
+POPULAR_TOP_K = int(os.getenv("POPULAR_TOP_K", 50))
+# the flushing worker merges the flushed sales into its rankings right away, the others reload theirs once they
+# expire, as does every worker after other product writes
+POPULAR_TTL = float(os.getenv("POPULAR_TTL", 60))
+POPULARITY_KEY = "rankings"
+popularity_cache = TTLCache("popular_products", 1, POPULAR_TTL)
+
+
+class PopularityRanking:
+    """
+    Top POPULAR_TOP_K listed products by total_sales, overall, per branch and per category.
+    """
+
+    def __init__(self):
+        self.overall: List[ProductsListResponse] = []
+        self.by_branch: Dict[int, List[ProductsListResponse]] = {}
+        self.by_category: Dict[int, List[ProductsListResponse]] = {}
+
+    def top(self, branch_id: Optional[int] = None, category_id: Optional[int] = None) -> List[ProductsListResponse]:
+        if branch_id is not None:
+            return self.by_branch.get(branch_id, [])
+        if category_id is not None:
+            return self.by_category.get(category_id, [])
+        return self.overall
+
+    def merged(self, products: List[ProductsListResponse], product_ids: Iterable[int],
+               top_k: int = POPULAR_TOP_K) -> Optional["PopularityRanking"]:
+        """
+        A copy of the rankings where the products of `product_ids` are ranked by `products`, their current listed
+        rows with sales (the missing ones no longer rank). None when a ranking lost ground to products past its
+        end, only a reload can tell which of them rank now.
+        """
+        changed = set(product_ids)
+        ranking = PopularityRanking()
+        overall = _merged(self.overall, products, changed, top_k)
+        if overall is None:
+            return None
+        ranking.overall = overall
+        for current, partitions, partition_of in ((self.by_branch, ranking.by_branch, lambda p: p.branch_id),
+                                                   (self.by_category, ranking.by_category, lambda p: p.category_id)):
+            partitions.update(current)
+            affected = {partition_of(product) for product in products}
+            affected.update(key for key, ranked in current.items() if any(p.id in changed for p in ranked))
+            for key in affected:
+                ranked = _merged(current.get(key, []), [p for p in products if partition_of(p) == key], changed,
+                                 top_k)
+                if ranked is None:
+                    return None
+                if ranked:
+                    partitions[key] = ranked
+                else:
+                    partitions.pop(key, None)
+        return ranking
+
+
+def _rank(product: ProductsListResponse) -> tuple:
+    return -product.total_sales, product.id
+
+
+def _merged(ranked: List[ProductsListResponse], products: List[ProductsListResponse], changed: set,
+            top_k: int) -> Optional[List[ProductsListResponse]]:
+    merged = sorted([product for product in ranked if product.id not in changed] + products, key=_rank)[:top_k]
+    # the products past a full ranking rank below its last one, they may now belong in it if the ranking shrank
+    # or its end moved down (cancelled sales)
+    if len(ranked) == top_k and (len(merged) < top_k or _rank(merged[-1]) > _rank(ranked[-1])):
+        return None
+    return merged
+
+
+def load_popularity_ranking(db: Session, top_k: int = POPULAR_TOP_K) -> PopularityRanking:
+    # the three rankings come out of one scan, each product row is fetched once even when it ranks in several
+    best_first = (Product.total_sales.desc(), Product.id)
+    ranked = select(
+        *PRODUCT_LIST_COLUMNS,
+        func.row_number().over(order_by=best_first).label("overall_rank"),
+        func.row_number().over(partition_by=Product.branch_id, order_by=best_first).label("branch_rank"),
+        func.row_number().over(partition_by=Product.category_id, order_by=best_first).label("category_rank"),
+    ).where(LISTED, Product.total_sales > 0).subquery()
+    rows = db.execute(
+        select(ranked)
+        .where(or_(ranked.c.overall_rank <= top_k, ranked.c.branch_rank <= top_k, ranked.c.category_rank <= top_k))
+        .order_by(ranked.c.total_sales.desc(), ranked.c.id)
+    ).all()
+
+    ranking = PopularityRanking()
+    for row in rows:
+        product = ProductsListResponse.model_validate(row._mapping)
+        if row.overall_rank <= top_k:
+            ranking.overall.append(product)
+        if row.branch_rank <= top_k:
+            ranking.by_branch.setdefault(row.branch_id, []).append(product)
+        if row.category_rank <= top_k:
+            ranking.by_category.setdefault(row.category_id, []).append(product)
+    return ranking
+
+
+def get_popular_products(db: Session, limit: int, branch_id: Optional[int] = None,
+                         category_id: Optional[int] = None) -> List[ProductsListResponse]:
+    if branch_id is not None and category_id is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Filter by branch or by category")
+    ranking = popularity_cache.get_or_load(POPULARITY_KEY, lambda: load_popularity_ranking(db))
+    return ranking.top(branch_id, category_id)[:limit]
+
+
+def merge_popular_sales(db: Session, product_ids: List[int]):
+    """
+    Rank the products whose total_sales a flush just changed in the cached rankings, loading only their rows,
+    instead of reloading every ranking. Falls back to dropping the rankings when the merge cannot be exact.
+    """
+    generation = popularity_cache.generation
+    ranking = popularity_cache.get(POPULARITY_KEY)
+    if ranking is None:
+        return
+    rows = db.execute(
+        select(*PRODUCT_LIST_COLUMNS).where(Product.id.in_(product_ids), LISTED, Product.total_sales > 0)
+    ).all()
+    merged = ranking.merged([ProductsListResponse.model_validate(row._mapping) for row in rows], product_ids)
+    if merged is None:
+        popularity_cache.invalidate(POPULARITY_KEY)
+    else:
+        popularity_cache.replace(POPULARITY_KEY, merged, generation)
@@ -1,61 +1,357 @@
-from datetime import datetime, timezone
-from typing import List, Type
+import csv
+import io
+import os
+from datetime import datetime, timezone, date
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from fastapi import HTTPException, status
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, not_, event, func, literal_column, text, select, cast, tuple_, update, case, \
+    Numeric, Float, Text, JSON
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session, selectinload, load_only, object_session
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+import orjson
+from dotenv import load_dotenv
 
-from app.models import Product
-from app.models.product import ProductReview
+from app.models import Product, ProductVariation, VariationOption, Addon, Branch, Category, SubCategory
+from app.models.product import ProductReview, product_addons_association, product_variation_option_association
+from app.schemas.product import ProductResponse, ProductFilter
+from app.schemas.catalog_import import CatalogFormat
 from app.schemas.review import ReviewUpdate
+from app.schemas.pagination import PageParams
 from app.core import logger
+from app.core.utils import paginate, keyset, in_stock, make_etag, to_json, type_adapter, json_object, json_array, \
+    json_timestamp
+from app.core.utils import db_utils
+from app.core.cache import TTLCache, CachedDocument
+from app.db import read_from_primary
 
+load_dotenv()
 
-def list_all_products(db: Session) -> list[Type[Product]]:
-    products = db.query(Product).filter(Product.is_active == True)
-    return products
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", 1024))
+# Seconds a cached product detail is served, also bounds how stale a replica fed entry can be
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 60))
+# Products fetched from the server side cursor, and sent, at a time by the export
+PRODUCT_EXPORT_BATCH_SIZE = int(os.getenv("PRODUCT_EXPORT_BATCH_SIZE", 500))
+
+# product id -> CachedDocument
+product_cache = TTLCache("product_detail", PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL)
+
+CHANGED_PRODUCTS_KEY = "changed_product_ids"
+
+
+# Columns rendered by ProductsListResponse, listings never touch the relationships
+PRODUCT_LIST_COLUMNS = (
+    Product.id, Product.name, Product.price, Product.description, Product.image, Product.stock, Product.created_at,
+    Product.updated_at, Product.tags, Product.discount_type, Product.discount_value, Product.total_sales,
+    Product.category_id, Product.subcategory_id, Product.branch_id, Product.rating_count, Product.rating_sum,
+)
+
+
+# Products shown to customers, the predicate matches the partial listing indexes
+LISTED = and_(Product.is_active, Product.is_visible)
+
+
+def query_product_list(db: Session):
+    return db.query(Product).options(load_only(*PRODUCT_LIST_COLUMNS))
+
+
+def listed_products(db: Session):
+    return query_product_list(db).filter(LISTED)
+
+
+def list_all_products(db: Session, page: PageParams) -> dict:
+    return paginate(listed_products(db), Product.id, page)
+
+
+# the row version of a product, rows written before updated_at was maintained only have created_at
+PRODUCT_VERSION = func.coalesce(Product.updated_at, Product.created_at)
+
+
+def product_list_etag(db: Session, page: PageParams) -> str:
+    """
+    ETag of a /products/list page from the ids and versions of its rows only, read with the same keyset query as
+    the page itself without loading or serializing any product.
+
+    There is no Last-Modified: the newest version of the rows misses the products deleted, unlisted or inserted
+    since, the ids in the ETag do not.
+    """
+    rows = keyset(db.query(Product.id, PRODUCT_VERSION).filter(LISTED), Product.id, page).all()
+    return make_etag("products", page.limit, [(product_id, version.isoformat()) for product_id, version in rows])
+
+
+def product_etag(product_id: int, version: datetime) -> str:
+    return make_etag("product", product_id, version.isoformat())
+
+
+def product_detail_validators(db: Session, product_id: int) -> Optional[Tuple[str, datetime]]:
+    version = db.query(PRODUCT_VERSION).filter(and_(Product.id == product_id)).scalar()
+    return None if version is None else (product_etag(product_id, version), version)
 
 
 def get_product_by_id(db: Session, product_id: int) -> Product:
-    product = db.query(Product).get(product_id)
+    # one SELECT per relationship of ProductResponse instead of an addons x variations x options JOIN
+    product = db.get(Product, product_id, options=[
+        selectinload(Product.addons),
+        selectinload(Product.variations).selectinload(ProductVariation.options),
+    ])
     if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     return product
 
 
-def filter_products_by_branch(db: Session, branch_id: int = None, branch_name: str = None) -> List[Product] | []:
-    products = db.query(Product)
+def product_document_query(product_id: int):
+    """
+    The ProductResponse JSON of a product built by Postgres, with the version of the row.
+    """
+    options = (
+        select(json_array(json_object(id=VariationOption.id, name=VariationOption.name, price=VariationOption.price),
+                          VariationOption.id))
+        .select_from(product_variation_option_association.join(
+            VariationOption, VariationOption.id == product_variation_option_association.c.variation_option_id))
+        .where(product_variation_option_association.c.product_variation_id == ProductVariation.id)
+        .scalar_subquery()
+    )
+    variations = (
+        select(json_array(json_object(
+            id=ProductVariation.id, title=ProductVariation.title, type=ProductVariation.type,
+            min_selections=ProductVariation.min_selections, max_selections=ProductVariation.max_selections,
+            required=ProductVariation.required, options=options), ProductVariation.id))
+        .where(ProductVariation.product_id == Product.id)
+        .scalar_subquery()
+    )
+    addons = (
+        select(json_array(json_object(id=Addon.id, title=Addon.title, price=Addon.price, tax=Addon.tax), Addon.id))
+        .select_from(product_addons_association.join(Addon, Addon.id == product_addons_association.c.addon_id))
+        .where(product_addons_association.c.product_id == Product.id)
+        .scalar_subquery()
+    )
+    # rows saved before the JSON column was decoded by the driver hold the tags as an encoded string
+    tags = case((func.json_typeof(Product.tags) == "string", cast(Product.tags.op("#>>")(literal_column("'{}'")),
+                                                                   JSON)),
+                else_=Product.tags)
+    rating_average = case((Product.rating_count > 0, cast(func.round(cast(Product.rating_sum, Numeric)
+                                                                     / Product.rating_count, 2), Float)))
+    document = json_object(
+        name=Product.name, price=Product.price, description=Product.description, image=Product.image,
+        stock=Product.stock, created_at=json_timestamp(Product.created_at), updated_at=json_timestamp(Product.updated_at),
+        tags=tags, discount_type=Product.discount_type, discount_value=Product.discount_value,
+        total_sales=Product.total_sales,
+        category_id=Product.category_id, subcategory_id=Product.subcategory_id, branch_id=Product.branch_id,
+        rating_count=Product.rating_count, rating_sum=Product.rating_sum, id=Product.id, addons=addons,
+        variations=variations, rating_histogram=Product.rating_histogram, rating_average=rating_average,
+    )
+    # sent as text, the driver would otherwise decode the JSON only for it to be encoded again
+    return select(cast(document, Text), PRODUCT_VERSION).where(Product.id == product_id)
+
+
+def render_product_document(db: Session, product_id: int) -> Tuple[bytes, datetime]:
+    row = db.execute(product_document_query(product_id)).first()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    return row[0].encode(), row[1]
+
+
+def get_product_detail(db: Session, product_id: int) -> CachedDocument:
+    """
+    Detail document of a product, served from the product cache and loaded from the primary on a miss,
+    rendered by Postgres with DB_JSON_RENDERING.
+    """
+    def load() -> CachedDocument:
+        with read_from_primary(db):
+            if db_utils.DB_JSON_RENDERING:
+                body, version = render_product_document(db, product_id)
+            else:
+                product = get_product_by_id(db, product_id)
+                version = product.updated_at or product.created_at
+                body = to_json(ProductResponse, product)
+        return CachedDocument(body, product_etag(product_id, version), version)
+
+    return product_cache.get_or_load(product_id, load)
+
+
+def mark_products_changed(db: Session, product_ids: Iterable[int]):
+    """
+    Drop the cached details of `product_ids` once the session commits. Writes done through the ORM
+    (product edits, reviews) are tracked automatically, bulk UPDATE statements have to call this.
+    """
+    db.info.setdefault(CHANGED_PRODUCTS_KEY, set()).update(product_ids)
+
+
+@event.listens_for(Product, "after_insert")
+@event.listens_for(Product, "after_update")
+@event.listens_for(Product, "after_delete")
+def _product_written(mapper, connection, target):
+    mark_products_changed(object_session(target), [target.id])
+
+
+@event.listens_for(ProductReview, "after_insert")
+@event.listens_for(ProductReview, "after_update")
+@event.listens_for(ProductReview, "after_delete")
+def _review_written(mapper, connection, target):
+    mark_products_changed(object_session(target), [target.product_id])
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_products(session: Session):
+    # invalidating only after the commit keeps concurrent misses from caching the pre-commit state
+    product_ids = session.info.pop(CHANGED_PRODUCTS_KEY, None)
+    if product_ids:
+        product_cache.invalidate(*product_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_products(session: Session):
+    session.info.pop(CHANGED_PRODUCTS_KEY, None)
+
+
+def filter_products_by_branch(db: Session, page: PageParams, branch_id: int = None, branch_name: str = None) -> dict:
+    products = listed_products(db)
     if branch_id:
-        return products.filter(and_(Product.branch_id == branch_id))
+        return paginate(products.filter(and_(Product.branch_id == branch_id)), Product.id, page)
     if branch_name:
-        return products.filter(Product.branch.has(name=branch_name.lower()))
+        branch_ids = select(Branch.id).where(Branch.name == branch_name.lower())
+        return paginate(products.filter(Product.branch_id.in_(branch_ids)), Product.id, page)
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid request")
 
 
-def filter_products_by_category(db: Session, category_id: int = None, category_name: str = None) -> List[Product] | []:
-    products = db.query(Product)
+def filter_products_by_category(db: Session, page: PageParams, category_id: int = None,
+                                category_name: str = None) -> dict:
+    products = listed_products(db)
     if category_id:
-        return products.filter(and_(Product.category_id == category_id))
+        return paginate(products.filter(and_(Product.category_id == category_id)), Product.id, page)
     if category_name:
-        return products.filter(Product.category.has(name=category_name.lower()))
+        category_ids = select(Category.id).where(Category.name == category_name.lower())
+        return paginate(products.filter(Product.category_id.in_(category_ids)), Product.id, page)
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid request")
 
 
-def filter_product_by_subcategory(db: Session, subcategory_id: int = None, subcategory_name: str = None) -> List[
-                                                                                                                Product] | []:
-    products = db.query(Product)
+def filter_product_by_subcategory(db: Session, page: PageParams, subcategory_id: int = None,
+                                  subcategory_name: str = None) -> dict:
+    products = listed_products(db)
     if subcategory_id:
-        return products.filter(and_(Product.subcategory_id == subcategory_id))
+        return paginate(products.filter(and_(Product.subcategory_id == subcategory_id)), Product.id, page)
     if subcategory_name:
-        return products.filter(Product.subcategory.has(name=subcategory_name.lower()))
+        subcategory_ids = select(SubCategory.id).where(SubCategory.name == subcategory_name.lower())
+        return paginate(products.filter(Product.subcategory_id.in_(subcategory_ids)), Product.id, page)
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid request")
 
 
+def product_filter_conditions(filters: ProductFilter) -> list:
+    conditions = [LISTED]
+    for column, value in ((Product.branch_id, filters.branch_id), (Product.category_id, filters.category_id),
+                          (Product.subcategory_id, filters.subcategory_id)):
+        if value is not None:
+            conditions.append(column == value)
+    if filters.min_price is not None:
+        conditions.append(Product.price >= filters.min_price)
+    if filters.max_price is not None:
+        conditions.append(Product.price <= filters.max_price)
+    if filters.tag:
+        conditions.append(cast(Product.tags, JSONB).contains([filters.tag]))
+    if filters.in_stock is not None:
+        available = in_stock(date.today())
+        conditions.append(available if filters.in_stock else not_(available))
+    return conditions
+
+
+def product_facets(db: Session, conditions: list) -> dict:
+    """
+    Number of matching products per branch, category and subcategory, all counted by one GROUPING SETS query.
+    """
+    groups = (Product.branch_id, Product.category_id, Product.subcategory_id)
+    stmt = (
+        select(*groups, func.grouping(*groups).label("grouping"), func.count().label("count"),
+               func.count().filter(in_stock(date.today())).label("in_stock"))
+        .where(*conditions)
+        .group_by(func.grouping_sets(*(tuple_(group) for group in groups)))
+        .order_by(text("count DESC"))
+    )
+    facets = {"total": 0, "branches": [], "categories": [], "subcategories": [], "in_stock": 0}
+    for branch_id, category_id, subcategory_id, grouping, count, available in db.execute(stmt):
+        # GROUPING() sets the bits of the columns a row is *not* grouped by
+        if grouping == 0b011:
+            facets["branches"].append({"value": branch_id, "count": count})
+            facets["total"] += count
+            facets["in_stock"] += available
+        elif grouping == 0b101:
+            facets["categories"].append({"value": category_id, "count": count})
+        else:
+            facets["subcategories"].append({"value": subcategory_id, "count": count})
+    return facets
+
+
+def filter_products(db: Session, filters: ProductFilter, page: PageParams) -> dict:
+    if filters.min_price is not None and filters.max_price is not None and filters.min_price > filters.max_price:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="min_price is greater than max_price")
+    conditions = product_filter_conditions(filters)
+    result = paginate(query_product_list(db).filter(*conditions), Product.id, page)
+    result["facets"] = product_facets(db, conditions)
+    return result
+
+
+# database url -> whether pg_trgm is installed there
+_trigram_support: Dict[str, bool] = {}
+
+
+def trigram_enabled(db: Session) -> bool:
+    url = str(db.get_bind().url)
+    if url not in _trigram_support:
+        _trigram_support[url] = db.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+    return _trigram_support[url]
+
+
+def search_products(db: Session, query: str, limit: int, branch_id: Optional[int] = None,
+                    category_id: Optional[int] = None, subcategory_id: Optional[int] = None) -> List[Product]:
+    """
+    Listed products matching `query`, best matches first.
+
+    Full text matches over name, description and tags use the GIN indexed search_vector and are ranked by
+    ts_rank (name hits weigh the most). With pg_trgm installed, names that are merely similar to the query
+    match as well through the trigram index so typos still find the product.
+    """
+    ts_query = func.websearch_to_tsquery(literal_column("'english'"), query)
+    matches = Product.search_vector.op("@@")(ts_query)
+    rank = func.ts_rank(Product.search_vector, ts_query)
+    if trigram_enabled(db):
+        matches = or_(matches, Product.name.op("%")(query))
+        rank = rank + func.similarity(Product.name, query)
+
+    products = listed_products(db).filter(matches)
+    for column, value in ((Product.branch_id, branch_id), (Product.category_id, category_id),
+                          (Product.subcategory_id, subcategory_id)):
+        if value is not None:
+            products = products.filter(column == value)
+    return products.order_by(rank.desc(), Product.id).limit(limit).all()
+
+
+def update_rating_aggregates(db: Session, product_id: int, added: Optional[int] = None,
+                             removed: Optional[int] = None):
+    """
+    Apply one review change to the product rating aggregates: `added` is the rating of a new review (or the new
+    rating of an edited one), `removed` the rating it replaces. The increments run in the database so concurrent
+    reviews of the same product never overwrite each other, and in the caller's transaction so the aggregates
+    commit or roll back together with the review.
+    """
+    changes = {}
+    if added is not None and removed is None:
+        changes[Product.rating_count] = Product.rating_count + 1
+    changes[Product.rating_sum] = Product.rating_sum + (added or 0) - (removed or 0)
+    if added is not None:
+        changes[Product.rating_histogram[added]] = Product.rating_histogram[added] + 1
+    if removed is not None:
+        changes[Product.rating_histogram[removed]] = Product.rating_histogram[removed] - 1
+    db.execute(update(Product).where(Product.id == product_id).values(changes)
+               .execution_options(synchronize_session=False))
+
+
 def create_product_review(db: Session, user_id: int, product_id: int, rating: int, comment: str) -> ProductReview:
-    product = get_product_by_id(db, product_id)
+    product = db.query(Product.id).filter(and_(Product.id == product_id)).scalar()
     if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     review = ProductReview(product_id=product_id, user_id=user_id, rating=rating, comment=comment)
     db.add(review)
+    update_rating_aggregates(db, product_id, added=rating)
     db.commit()
     db.refresh(review)
     return review
@@ -64,7 +360,8 @@ def create_product_review(db: Session, user_id: int, product_id: int, rating: in
 def update_product_review(db: Session, fields: ReviewUpdate) -> dict:
     try:
         update_data = fields.model_dump(exclude_unset=True)
-        review = db.query(ProductReview).get(fields.review_id)
+        # locked so two edits of the same review can't both subtract the same old rating
+        review = db.get(ProductReview, fields.review_id, with_for_update=True)
         if not review:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Review not found")
         if not update_data:
@@ -72,7 +369,8 @@ def update_product_review(db: Session, fields: ReviewUpdate) -> dict:
                                 detail="No valid fields to update")
         if fields.comment:
             review.comment = fields.comment
-        if fields.rating:
+        if fields.rating and fields.rating != review.rating:
+            update_rating_aggregates(db, review.product_id, added=fields.rating, removed=review.rating)
             review.rating = fields.rating
         review.updated_at = datetime.now(timezone.utc)
         db.add(review)
@@ -82,6 +380,54 @@ def update_product_review(db: Session, fields: ReviewUpdate) -> dict:
 
     except HTTPException as e:
         raise e
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error("Error updating user: %s", str(e))
         raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+def list_product_reviews(db: Session, product_id: int, page: PageParams) -> dict:
+    # newest first
+    reviews = db.query(ProductReview).filter(and_(ProductReview.product_id == product_id))
+    return paginate(reviews, ProductReview.id, page, descending=True)
+
+
+def _csv_rows(rows: Iterable[Iterable]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def export_products(db: Session, format: CatalogFormat,
+                    batch_size: int = PRODUCT_EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Every listed product as a ProductResponse document, one per NDJSON line or CSV row (nested values as JSON
+    cells, which the catalog import reads back), in chunks of `batch_size` products.
+
+    Rows come from a server side cursor `batch_size` at a time, with their addons and variations loaded per
+    batch. The session only holds weak references to the rows, so a batch is freed once sent and memory stays
+    flat whatever the size of the catalog. The generator owns `db` and closes it.
+    """
+    adapter, document_adapter = type_adapter(List[ProductResponse]), type_adapter(ProductResponse)
+    query = (
+        select(Product)
+        .where(LISTED)
+        .order_by(Product.id)
+        .options(selectinload(Product.addons),
+                 selectinload(Product.variations).selectinload(ProductVariation.options))
+        .execution_options(yield_per=batch_size)
+    )
+    try:
+        if format == CatalogFormat.CSV:
+            yield _csv_rows([[*ProductResponse.model_fields, *ProductResponse.model_computed_fields]])
+        for batch in db.execute(query).scalars().partitions():
+            documents = adapter.validate_python(batch, from_attributes=True)
+            if format == CatalogFormat.NDJSON:
+                yield b"".join(document_adapter.dump_json(document) + b"\n" for document in documents)
+            else:
+                yield _csv_rows([orjson.dumps(value).decode() if isinstance(value, (list, dict)) else value
+                                 for value in document.model_dump(mode="json").values()]
+                                for document in documents)
+    finally:
+        db.close()
@@ -1,14 +1,17 @@
 from fastapi.exceptions import HTTPException
 from fastapi import BackgroundTasks, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import and_
 import uuid
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from app.core.cache.tokens import store_access_token
 from app.core.security.tokens import get_or_create_default_tokens, verify_token, create_access_token
 from app.models import User, EmailVerificationToken, ResetPasswordToken
 from app.schemas.user import UserCreate, UserLogin, UserUpdate
 from app.core import logger
-from app.helpers.users import get_user_by_email
+from app.helpers.users import get_user_by_email, get_user_by_email_async
 from app.core.background_tasks import update_last_login, update_user_refresh_token
 from app.core.cache import add_refresh_token_to_blacklist, check_refresh_token
 from typing import Dict
@@ -16,21 +19,22 @@ from app.core.security import validate_password
 from datetime import timedelta, datetime, timezone
 
 
-async def create_user(db: Session, user: UserCreate, background_task: BackgroundTasks) -> dict:
-    if get_user_by_email(db, user.email):
+async def create_user(db: AsyncSession, user: UserCreate, background_task: BackgroundTasks) -> dict:
+    if await get_user_by_email_async(db, user.email):
         raise HTTPException(status_code=409, detail="Email is already registered")
 
     try:
         validate_password(user.password)
         db_user = User(email=user.email, first_name=user.first_name, last_name=user.last_name)
-        db_user.set_password(user.password)
+        # bcrypt is CPU bound, keep it off the event loop
+        await run_in_threadpool(db_user.set_password, user.password)
         db.add(db_user)
-        db.flush()  # Ensure db_user.id is available before creating the token
+        await db.flush()  # Ensure db_user.id is available before creating the token
 
         verification_token = EmailVerificationToken(user_id=db_user.id, token=uuid.uuid4())
         db.add(verification_token)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
 
         # TODO : add email sending func to send the uuid
         print(verification_token)
@@ -44,15 +48,17 @@ async def create_user(db: Session, user: UserCreate, background_task: Background
     except ValueError as e:
         logger.error("Invalid password: %s", str(e))
         raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error("Error registering user: %s", str(e))
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
-async def login_user(db: Session, credentials: UserLogin, background_task: BackgroundTasks) -> dict:
+async def login_user(db: AsyncSession, credentials: UserLogin, background_task: BackgroundTasks) -> dict:
     logger.info("Logging in user: %s", credentials.email)
     # get user from email
-    user = get_user_by_email(db, credentials.email)
+    user = await get_user_by_email_async(db, credentials.email)
 
     # check if user exists
     if not user:
@@ -60,7 +66,7 @@ async def login_user(db: Session, credentials: UserLogin, background_task: Backg
         raise HTTPException(status_code=404, detail="Email or password are incorrect")
 
     # check user password
-    if not user.check_password(credentials.password):
+    if not await run_in_threadpool(user.check_password, credentials.password):
         logger.info("Incorrect password for user: %s", credentials.email)
         raise HTTPException(status_code=404, detail="Email or password are incorrect")
 
@@ -133,6 +139,8 @@ def verify_user(db: Session, token: uuid.UUID) -> Dict[str, str]:
         return {"message": "User verified successfully"}
     except HTTPException as e:
         raise e
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error("Error verifying user: %s", str(e))
         raise HTTPException(status_code=500, detail=f"Internal Server Error : {e}")
@@ -160,6 +168,8 @@ def send_user_verification_email(db: Session, user: User) -> Dict[str, str]:
         # TODO :  add send_email() func later
         logger.info(f"Verification email sent to {user.email}")
         return {"message": "Verification email sent successfully"}
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error("Error sending verification email: %s", str(e))
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -181,6 +191,8 @@ def change_user_password(db: Session, user: User, new_password: str, old_passwor
         raise HTTPException(status_code=400, detail=str(e))
     except HTTPException as e:
         raise e
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error("Error changing password: %s", str(e))
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -203,6 +215,8 @@ def reset_user_password_request(db: Session, user: User):
         return {"message": "Reset password email sent successfully"}
     except HTTPException as e:
         raise e
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error("Error resetting password: %s", str(e))
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -228,6 +242,8 @@ def reset_user_password_confirm(db: Session, token: uuid.UUID, new_password: str
     except ValueError as e:
         logger.error("Invalid password: %s", str(e))
         raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error("Error resetting password: %s", str(e))
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -258,6 +274,8 @@ def user_update(db: Session, user: User, fields: UserUpdate):
         return {"message": "User updated successfully"}
     except HTTPException as e:
         raise e
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error("Error updating user: %s", str(e))
         raise HTTPException(status_code=500, detail="Internal Server Error")
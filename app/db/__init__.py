@@ -1,2 +1,3 @@
 from .base import Base
-from .session import get_db, get_background_task_db
+from .session import get_db, get_async_db, get_background_task_db
+from .routing import get_read_db, open_read_session, read_from_primary
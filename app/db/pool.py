@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+from typing import Any, Dict
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, NullPool, Pool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+# Pool configuration, sized per worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Seconds to wait for a free connection before failing with a 503 (SQLAlchemy default is 30)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 3))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+
+# Server side timeouts in milliseconds, 0 disables them
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 0))
+DB_IDLE_IN_TRANSACTION_SESSION_TIMEOUT = int(os.getenv("DB_IDLE_IN_TRANSACTION_SESSION_TIMEOUT", 0))
+
+# Behind PgBouncer (transaction pooling) the application must not pool connections itself,
+# must not rely on prepared statements and can't send startup parameters.
+DB_PGBOUNCER = _env_bool("DB_PGBOUNCER", False)
+
+
+class PoolStats:
+    """
+    Live counters for a connection pool: how often connections were checked out,
+    how long callers waited for one and how many gave up because the pool was exhausted.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_time_total += seconds
+            self.wait_time_max = max(self.wait_time_max, seconds)
+
+    def snapshot(self, pool: Pool) -> Dict[str, Any]:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            data = {
+                "pool": pool.__class__.__name__,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_time_avg_ms": round(self.wait_time_total / attempts * 1000, 3) if attempts else 0.0,
+                "wait_time_max_ms": round(self.wait_time_max * 1000, 3),
+            }
+        # NullPool keeps no connections around so it has no size / overflow to report
+        if isinstance(pool, QueuePool):
+            data.update({
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+            })
+        return data
+
+
+def instrumented_pool_class(base: type, stats: PoolStats) -> type:
+    """
+    Build a subclass of `base` that records checkout wait times into `stats`.
+    `stats` is stored on the class so it survives `Pool.recreate()` (engine.dispose()).
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = base._do_get(self)
+        except exc.TimeoutError:
+            self.stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record_wait(time.perf_counter() - start)
+        return connection
+
+    return type(f"Instrumented{base.__name__}", (base,), {"stats": stats, "_do_get": _do_get})
+
+
+def engine_options(stats: PoolStats, is_async: bool = False) -> Dict[str, Any]:
+    """
+    Keyword arguments for create_engine / create_async_engine built from the environment.
+    """
+    connect_args: Dict[str, Any] = {}
+
+    if DB_PGBOUNCER:
+        options: Dict[str, Any] = {"poolclass": instrumented_pool_class(NullPool, stats)}
+        if is_async:
+            # asyncpg prepares every statement, PgBouncer can't route them between server connections
+            connect_args.update({"statement_cache_size": 0, "prepared_statement_cache_size": 0})
+    else:
+        base = AsyncAdaptedQueuePool if is_async else QueuePool
+        options = {
+            "poolclass": instrumented_pool_class(base, stats),
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+        }
+        server_settings = {}
+        if DB_STATEMENT_TIMEOUT:
+            server_settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT)
+        if DB_IDLE_IN_TRANSACTION_SESSION_TIMEOUT:
+            server_settings["idle_in_transaction_session_timeout"] = str(DB_IDLE_IN_TRANSACTION_SESSION_TIMEOUT)
+        if server_settings:
+            if is_async:
+                connect_args["server_settings"] = server_settings
+            else:
+                connect_args["options"] = " ".join(f"-c {key}={value}" for key, value in server_settings.items())
+
+    options["pool_pre_ping"] = DB_POOL_PRE_PING
+    options["connect_args"] = connect_args
+    return options
@@ -0,0 +1,133 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from jose import jwt, JWTError
+from sqlalchemy import create_engine, Insert, Update, Delete
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from dotenv import load_dotenv
+
+from .pool import PoolStats, engine_options
+from .session import engine
+
+load_dotenv()
+
+# Comma separated SQLAlchemy URLs of the read replicas, reads fall back to the primary when empty
+DB_REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+# Seconds a client stays on the primary after a write so it never reads its own stale data
+DB_READ_YOUR_WRITES_WINDOW = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", 5))
+
+replica_stats: List[PoolStats] = [PoolStats(f"replica_{index}") for index in range(len(DB_REPLICA_URLS))]
+replica_engines: List[Engine] = [create_engine(url, **engine_options(stats))
+                                 for url, stats in zip(DB_REPLICA_URLS, replica_stats)]
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to a replica when it is marked read only (`session.info["read_only"]`)
+    and everything else - flushes, DML and unmarked sessions - to the primary.
+    """
+
+    def __init__(self, *args, primary: Engine = None, replicas: List[Engine] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.primary = primary if primary is not None else engine
+        self.replicas = replicas if replicas is not None else replica_engines
+        self._replica: Optional[Engine] = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (not self.info.get("read_only") or not self.replicas or self._flushing
+                or isinstance(clause, (Insert, Update, Delete))):
+            return self.primary
+        # stick to one replica for the whole session so a request sees a single snapshot
+        if self._replica is None:
+            self._replica = random.choice(self.replicas)
+        return self._replica
+
+
+@contextmanager
+def read_from_primary(db: Session):
+    """
+    Send the reads of `db` to the primary for the block. For loads whose result is cached and served to every
+    client, the writers pinned to the primary included: a lagging replica would put back what a write just
+    invalidated, for as long as the entry lives.
+    """
+    read_only = db.info.pop("read_only", None)
+    try:
+        yield db
+    finally:
+        if read_only is not None:
+            db.info["read_only"] = read_only
+
+
+RoutingSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+
+
+class PrimaryPins:
+    """
+    Remembers which clients wrote recently, reads for them are pinned to the primary
+    until the replicas had time to catch up.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pins: Dict[str, float] = {}
+
+    def pin(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            self._pins[key] = now + self.window
+            # drop expired pins so the map stays bounded by the writes of the last window
+            if len(self._pins) > 1024:
+                self._pins = {k: expires for k, expires in self._pins.items() if expires > now}
+
+    def is_pinned(self, key: str) -> bool:
+        expires = self._pins.get(key)
+        return expires is not None and expires > time.monotonic()
+
+
+primary_pins = PrimaryPins(DB_READ_YOUR_WRITES_WINDOW)
+
+
+def request_pin_key(request: Request) -> str:
+    """
+    Identify the client: the user id from the bearer token when there is one, the client address otherwise.
+    The token is only used as a routing hint here, authentication still happens in get_current_user.
+    """
+    authorization = request.headers.get("Authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            user_id = jwt.get_unverified_claims(authorization[7:]).get("sub")
+            if user_id:
+                return f"user:{user_id}"
+        except JWTError:
+            pass
+    return f"ip:{request.client.host if request.client else ''}"
+
+
+def open_read_session(request: Request) -> RoutingSession:
+    """
+    Session of get_read_db for code that outlives the request dependencies (streamed responses), the caller
+    closes it.
+    """
+    db = RoutingSessionLocal()
+    if request.method in ("GET", "HEAD") and not primary_pins.is_pinned(request_pin_key(request)):
+        db.info["read_only"] = True
+    return db
+
+
+def get_read_db(request: Request):
+    db = open_read_session(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_replica_pool_stats() -> dict:
+    return {stats.name: stats.snapshot(replica.pool) for stats, replica in zip(replica_stats, replica_engines)}
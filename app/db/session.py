@@ -1,8 +1,11 @@
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from dotenv import load_dotenv
 
+from .pool import PoolStats, engine_options
+
 load_dotenv()  # Load environment variables from .env file
 
 # Construct database URL
@@ -13,10 +16,18 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine_stats = PoolStats("primary")
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(engine_stats))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine used by the `async def` endpoints so queries never block the event loop.
+# expire_on_commit is disabled because expired attributes can't be lazy loaded in async code.
+async_engine_stats = PoolStats("primary_async")
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **engine_options(async_engine_stats, is_async=True))
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 
 def get_db():
     db = SessionLocal()
@@ -26,9 +37,24 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    db: AsyncSession = AsyncSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
 def get_background_task_db():
     db = SessionLocal()
     try:
         return db
     finally:
         db.close()
+
+
+def get_pool_stats() -> dict:
+    return {
+        engine_stats.name: engine_stats.snapshot(engine.pool),
+        async_engine_stats.name: async_engine_stats.snapshot(async_engine.pool),
+    }
@@ -1,6 +1,7 @@
 from app.models.user import User
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, select
 
 
 def get_user_by_email(db: Session, email: str):
@@ -9,3 +10,13 @@ def get_user_by_email(db: Session, email: str):
 
 def get_user_by_id(db: Session, user_id: int):
     return db.query(User).filter(and_(User.id == user_id)).first()
+
+
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    result = await db.execute(select(User).filter(User.email.like(email)))
+    return result.scalars().first()
+
+
+async def get_user_by_id_async(db: AsyncSession, user_id: int):
+    result = await db.execute(select(User).filter(and_(User.id == user_id)))
+    return result.scalars().first()
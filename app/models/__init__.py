@@ -1,8 +1,9 @@
 from .user import User, EmailVerificationToken, ResetPasswordToken
 from .product import Product, Addon, VariationOption, ProductVariation
 from .category import Category, SubCategory
-from .order import Order, OrderItem
+from .order import Order, OrderItem, IdempotencyKey
 from .shipping import ShippingAddress, ShippingOrder
 from .branch import Branch
 from .notification import Notification
 from .payment import Payment
+from .coupon import Coupon, CouponRedemptionShard
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime
 from app.db import Base
 
 from sqlalchemy.orm import relationship
@@ -13,8 +15,9 @@ class Category(Base):
     is_active = Column(Boolean, default=True)
     banner_image = Column(String)
     image = Column(String)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     products = relationship("Product", back_populates="category")
-    subcategories = relationship("SubCategory", back_populates="category", lazy="joined")
+    subcategories = relationship("SubCategory", back_populates="category")
 
 
 class SubCategory(Base):
@@ -23,6 +26,7 @@ class SubCategory(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     is_active = Column(Boolean, default=True)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     category_id = Column(Integer, ForeignKey("categories.id"))
     category = relationship("Category", back_populates="subcategories")
     products = relationship("Product", back_populates="subcategory")
@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, CheckConstraint
+from sqlalchemy.orm import relationship
+
+from app.db import Base
+
+
+class Coupon(Base):
+    __tablename__ = "coupons"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # matched case insensitively, stored upper case
+    code = Column(String, unique=True, nullable=False)
+    type = Column(String, nullable=False)  # percent, fixed
+    value = Column(Float, nullable=False)
+    # restrictions, NULL means any
+    branch_id = Column(Integer, ForeignKey("branches.id"))
+    category_id = Column(Integer, ForeignKey("categories.id"))
+    min_spend = Column(Float)
+    max_redemptions = Column(Integer)
+    starts_at = Column(DateTime)
+    ends_at = Column(DateTime)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    shards = relationship("CouponRedemptionShard", back_populates="coupon")
+
+
+class CouponRedemptionShard(Base):
+    """
+    A slice of a capped coupon's redemptions. The cap is split over several rows so concurrent orders
+    redeeming a hot coupon lock different rows instead of queueing on one counter.
+    """
+    __tablename__ = "coupon_redemption_shards"
+    __table_args__ = (CheckConstraint("redeemed <= capacity", name="ck_coupon_redemption_shards_capacity"),)
+
+    coupon_id = Column(Integer, ForeignKey("coupons.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    capacity = Column(Integer, nullable=False)
+    redeemed = Column(Integer, default=0, nullable=False)
+
+    coupon = relationship("Coupon", back_populates="shards")
@@ -1,10 +1,12 @@
 from app.db import Base
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 
 
 class Notification(Base):
     __tablename__ = "notifications"
+    # keyset pagination of a user's notifications
+    __table_args__ = (Index("ix_notifications_user_id_id", "user_id", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     icon = Column(String)
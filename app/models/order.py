@@ -1,7 +1,8 @@
 from app.db import Base
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Float, Numeric, Table
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Float, Numeric, Table, Index, \
+    LargeBinary, UniqueConstraint
+from sqlalchemy.orm import relationship, synonym
 from datetime import datetime
 
 # Association table for OrderItem and Addon
@@ -24,6 +25,8 @@ order_item_variation_association = Table(
 # TODO : create subtotal field and modify the funcs
 class Order(Base):
     __tablename__ = "orders"
+    # keyset pagination of a user's orders
+    __table_args__ = (Index("ix_orders_user_id_id", "user_id", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
 
@@ -37,6 +40,7 @@ class Order(Base):
 
     is_scheduled = Column(Boolean, default=False)
     schedule_time = Column(DateTime)
+    scheduled_at = synonym("schedule_time")
 
     shipping_order = relationship("ShippingOrder", back_populates="order")
 
@@ -70,3 +74,24 @@ class OrderItem(Base):
     # Use secondary tables for many-to-many relationships
     addons = relationship("Addon", secondary="order_item_addon_association")
     variations = relationship("ProductVariation", secondary="order_item_variation_association")
+
+
+class IdempotencyKey(Base):
+    """
+    An Idempotency-Key sent with an order creation and the response the order got. Inserted first in the order
+    transaction and committed with it, so a retry finds the stored response, a concurrent duplicate waits on the
+    unique index until the first attempt commits or rolls back, and a failed attempt leaves no key behind.
+    """
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_id_key"),)
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String(255), nullable=False)
+    # sha256 of the request body, a key reused for another request is rejected
+    fingerprint = Column(String(64), nullable=False)
+    # the serialized OrderResponse
+    response = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id"))
@@ -1,5 +1,7 @@
-from sqlalchemy import Column, Integer, Table, String, Float, DateTime, ForeignKey, Boolean, JSON, Date
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, Table, String, Float, DateTime, ForeignKey, Boolean, JSON, Date, Index, text, \
+    Computed, DDL, event, cast, UniqueConstraint
+from sqlalchemy.dialects.postgresql import TSVECTOR, JSONB, ARRAY
+from sqlalchemy.orm import relationship, deferred
 from app.db import Base
 
 from datetime import datetime, timedelta
@@ -7,30 +9,48 @@ from datetime import datetime, timedelta
 product_variation_option_association = Table(
     'product_variation_option_association',
     Base.metadata,
-    Column('product_variation_id', Integer, ForeignKey('product_variations.id')),
+    Column('product_variation_id', Integer, ForeignKey('product_variations.id'), index=True),
     Column('variation_option_id', Integer, ForeignKey('variation_options.id'))
 )
 
 product_addons_association = Table(
     'product_addons_association',
     Base.metadata,
-    Column('product_id', Integer, ForeignKey('products.id')),
+    Column('product_id', Integer, ForeignKey('products.id'), index=True),
     Column('addon_id', Integer, ForeignKey('addons.id'))
 )
 
 
 class Product(Base):
     __tablename__ = "products"
+    # Listings only ever show listed (active and visible) products, so their indexes are partial. Each one filters
+    # on its first column and pages on the id, Postgres ANDs them together when several filters are combined.
+    __table_args__ = (
+        Index("ix_products_listed_id", "id", postgresql_where=text("is_active AND is_visible")),
+        Index("ix_products_listed_branch_id_id", "branch_id", "id", postgresql_where=text("is_active AND is_visible")),
+        Index("ix_products_listed_category_id_id", "category_id", "id",
+              postgresql_where=text("is_active AND is_visible")),
+        Index("ix_products_listed_subcategory_id_id", "subcategory_id", "id",
+              postgresql_where=text("is_active AND is_visible")),
+        Index("ix_products_listed_branch_id_category_id_id", "branch_id", "category_id", "id",
+              postgresql_where=text("is_active AND is_visible")),
+        Index("ix_products_listed_price", "price", postgresql_where=text("is_active AND is_visible")),
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+        # names are unique within a branch, the catalog import matches products on them
+        UniqueConstraint("branch_id", "name", name="uq_products_branch_id_name"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
 
-    name = Column(String, index=True, unique=True)
+    name = Column(String, index=True)
     price = Column(Float)
     image = Column(String)
     description = Column(String)
 
     created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime)
+    # version of the whole product document (ETags, Last-Modified), bumped by every UPDATE of the row including the
+    # bulk stock and rating ones. Code editing addons or variations has to touch it as well.
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     tags = Column(JSON)
 
@@ -46,8 +66,22 @@ class Product(Base):
     discount_value = Column(Float, default=0.0)
 
     total_sales = Column(Integer, default=0)
+
+    # review aggregates kept in step with product_reviews by the review crud, rating_histogram[n] (1-based like
+    # Postgres arrays) counts the n star reviews
+    rating_count = Column(Integer, default=0, server_default="0", nullable=False)
+    rating_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    rating_histogram = Column(ARRAY(Integer), default=lambda: [0] * 5, server_default="{0,0,0,0,0}", nullable=False)
     is_visible = Column(Boolean, default=True)
 
+    # full text document kept up to date by Postgres itself, only the search query reads it
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(tags::text, '')), 'C')",
+        persisted=True
+    )))
+
     category_id = Column(Integer, ForeignKey("categories.id"))
     category = relationship("Category", back_populates="products")
 
@@ -60,10 +94,9 @@ class Product(Base):
     addons = relationship(
         "Addon",
         secondary=product_addons_association,
-        backref="products",
-        lazy="joined"
+        backref="products"
     )
-    variations = relationship("ProductVariation", back_populates="product", lazy="joined")
+    variations = relationship("ProductVariation", back_populates="product")
     reviews = relationship("ProductReview", backref="product")
 
 
@@ -77,13 +110,12 @@ class ProductVariation(Base):
     max_selections = Column(Integer, default=1)
     required = Column(Boolean, default=False)
 
-    product_id = Column(Integer, ForeignKey("products.id"))
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
     product = relationship("Product", back_populates="variations")
     options = relationship(
         "VariationOption",
         secondary=product_variation_option_association,
-        back_populates="variations",
-        lazy="joined"
+        back_populates="variations"
     )
 
 
@@ -112,8 +144,23 @@ class Addon(Base):
     product_id = Column(Integer, ForeignKey("products.id"))
 
 
+class ProductSalesDelta(Base):
+    """
+    Units sold (negative when an order is cancelled) not yet added to Product.total_sales. Orders only insert
+    here, flush_product_sales folds the rows into the products in batches so best sellers aren't updated, and
+    locked, once per order.
+    """
+    __tablename__ = "product_sales_deltas"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+
+
 class ProductReview(Base):
     __tablename__ = "product_reviews"
+    # keyset pagination of a product's reviews
+    __table_args__ = (Index("ix_product_reviews_product_id_id", "product_id", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     rating = Column(Integer)
@@ -124,3 +171,19 @@ class ProductReview(Base):
 
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime)
+
+
+# tag filters test `tags::jsonb @> '["tag"]'`
+Index("ix_products_tags", cast(Product.tags, JSONB), postgresql_using="gin")
+
+
+def _trigram_available(ddl, target, bind, **kwargs) -> bool:
+    return bind.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is not None
+
+
+# Typo tolerant name matching needs pg_trgm, the search falls back to full text only where it isn't installed
+event.listen(Product.__table__, "after_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(callable_=_trigram_available))
+event.listen(Product.__table__, "after_create",
+             DDL("CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)")
+             .execute_if(callable_=_trigram_available))
@@ -1,11 +1,18 @@
 from app.db import Base
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, JSON, DateTime, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 
+SHIPPING_ADDRESS_UNIQUE_CONSTRAINT = "uq_shipping_addresses_location"
+
+
 class ShippingAddress(Base):
     __tablename__ = "shipping_addresses"
+    # target of the ON CONFLICT upsert done while creating orders
+    __table_args__ = (
+        UniqueConstraint("address", "longitude", "latitude", name=SHIPPING_ADDRESS_UNIQUE_CONSTRAINT),
+    )
     id = Column(Integer, primary_key=True, index=True)
 
     orders = relationship("Order", back_populates="shipping_address", uselist=False)
@@ -18,12 +25,14 @@ class ShippingAddress(Base):
 
 class ShippingOrder(Base):
     __tablename__ = "shipping_orders"
+    # keyset pagination of a user's shipping orders
+    __table_args__ = (Index("ix_shipping_orders_user_id_id", "user_id", "id"),)
     id = Column(Integer, primary_key=True, index=True)
 
     fee = Column(Float)
     status = Column(String)
 
-    created_at = Column(String, default=datetime.now)
+    created_at = Column(DateTime, default=datetime.now)
 
     shipping_client = Column(String)
     shipping_client_data = Column(JSON)
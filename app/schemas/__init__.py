@@ -1,3 +1,3 @@
 from .product import AddonSchema, ProductVariationsSchema
 from .shipping import ShippingAddressSchema
-from .category import CategoryResponse, SubCategoryResponse
+from .category import CategoryResponse, SubCategoryResponse, CategoryTreeResponse, SubCategoryTreeResponse
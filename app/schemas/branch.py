@@ -0,0 +1,59 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from .product import AddonResponseSchema, ProductVariationsResponseSchema
+
+
+class NearestBranchResponse(BaseModel):
+    id: int
+    name: str
+    address: Optional[str] = None
+    latitude: float
+    longitude: float
+    coverage_radius: Optional[int] = None
+    distance: float
+    covers: bool
+
+    class Config:
+        from_attributes = True
+
+
+class MenuProductResponse(BaseModel):
+    id: int
+    name: str
+    price: float
+    description: Optional[str] = None
+    image: Optional[str] = None
+    tags: List[str] = []
+    discount_type: Optional[str] = None
+    discount_value: Optional[float] = None
+    variations: List[ProductVariationsResponseSchema] = []
+    addons: List[AddonResponseSchema] = []
+
+
+class MenuSubCategoryResponse(BaseModel):
+    id: int
+    name: str
+    products: List[MenuProductResponse] = []
+
+
+class MenuCategoryResponse(BaseModel):
+    id: int
+    name: str
+    priority: Optional[int] = None
+    banner_image: Optional[str] = None
+    image: Optional[str] = None
+    subcategories: List[MenuSubCategoryResponse] = []
+    # products without a subcategory
+    products: List[MenuProductResponse] = []
+
+
+class BranchMenuResponse(BaseModel):
+    branch_id: int
+    # when the snapshot was built, the stock overlay is always current
+    built_at: datetime
+    categories: List[MenuCategoryResponse] = []
+    # products of the menu that are out of stock right now
+    sold_out: List[int] = []
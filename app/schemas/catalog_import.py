@@ -0,0 +1,91 @@
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+import orjson
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+
+class CatalogFormat(Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+def _unique(values: List[str], what: str) -> None:
+    seen = set()
+    for value in values:
+        if value in seen:
+            raise ValueError(f"duplicate {what} {value!r}")
+        seen.add(value)
+
+
+class ImportOption(BaseModel):
+    name: str
+    price: float = 0.0
+
+
+class ImportVariation(BaseModel):
+    title: str
+    type: str = "single"
+    min_selections: int = Field(1, ge=0)
+    max_selections: int = Field(1, ge=0)
+    required: bool = False
+    options: Optional[List[ImportOption]] = None
+
+    @model_validator(mode="after")
+    def check_options(self):
+        if self.min_selections > self.max_selections:
+            raise ValueError("min_selections is greater than max_selections")
+        _unique([option.name for option in self.options or []], "option")
+        return self
+
+
+class ImportAddon(BaseModel):
+    title: str
+    price: float = 0.0
+    tax: float = 0.0
+
+
+class ImportProduct(BaseModel):
+    """
+    One product of a catalog import, matched to the existing products of its branch by name.
+
+    Addons and variations are matched by title within the product and options by name within the variation.
+    Leaving `addons`, `variations` or a variation's `options` out keeps the current ones, an empty list removes
+    them, and leaving `stock` out keeps the stock of an existing product.
+    """
+    name: str = Field(min_length=1)
+    price: float = Field(ge=0)
+    description: str = ""
+    image: str = ""
+    tags: List[str] = []
+    stock: Optional[int] = None
+    stock_type: str = "fixed"
+    stock_daily: int = 0
+    discount_type: Optional[str] = "fixed"
+    discount_value: Optional[float] = 0.0
+    is_active: bool = True
+    is_visible: bool = True
+    branch_id: int
+    category_id: int
+    subcategory_id: int
+    addons: Optional[List[ImportAddon]] = None
+    variations: Optional[List[ImportVariation]] = None
+
+    @field_validator("tags", "addons", "variations", mode="before")
+    @classmethod
+    def decode_json_cell(cls, value: Any) -> Any:
+        # CSV cells carry the nested values as JSON
+        return orjson.loads(value) if isinstance(value, str) else value
+
+    @model_validator(mode="after")
+    def check_children(self):
+        _unique([addon.title for addon in self.addons or []], "addon")
+        _unique([variation.title for variation in self.variations or []], "variation")
+        return self
+
+
+class CatalogImportReport(BaseModel):
+    # rows inserted / updated / unlinked per table
+    rows: Dict[str, int]
+    # seconds spent per phase
+    timings: Dict[str, float]
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
 class SubCategoryResponse(BaseModel):
@@ -14,3 +14,17 @@ class CategoryResponse(BaseModel):
     banner_image: str
     image: str
     subcategories: List[SubCategoryResponse] = []
+
+
+class SubCategoryTreeResponse(SubCategoryResponse):
+    product_count: int = 0
+
+
+class CategoryTreeResponse(BaseModel):
+    id: int
+    name: str
+    priority: Optional[int] = None
+    banner_image: Optional[str] = None
+    image: Optional[str] = None
+    product_count: int = 0
+    subcategories: List[SubCategoryTreeResponse] = []
@@ -0,0 +1,39 @@
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+
+class CouponType(Enum):
+    PERCENT = "percent"
+    FIXED = "fixed"
+
+
+class CouponCreate(BaseModel):
+    code: str = Field(min_length=1, max_length=64)
+    type: CouponType
+    value: float = Field(gt=0)
+    branch_id: Optional[int] = None
+    category_id: Optional[int] = None
+    min_spend: Optional[float] = Field(None, ge=0)
+    max_redemptions: Optional[int] = Field(None, gt=0)
+    starts_at: Optional[datetime] = None
+    ends_at: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def check_rule(self):
+        if self.type == CouponType.PERCENT and self.value > 100:
+            raise ValueError("A percent coupon can't take more than 100%")
+        if self.starts_at and self.ends_at and self.starts_at >= self.ends_at:
+            raise ValueError("starts_at must be before ends_at")
+        return self
+
+
+class CouponResponse(CouponCreate):
+    id: int
+    is_active: bool
+    redeemed: int = 0
+
+    class Config:
+        from_attributes = True
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
@@ -28,7 +28,7 @@ class OrderType(Enum):
 
 class OrderItemSchema(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(gt=0)
     addons: Optional[List[AddonSchema]] = []
     variations: Optional[List[ProductVariationsSchema]] = []
     coupon_code: Optional[str] = None
@@ -44,6 +44,35 @@ class OrderCreate(BaseModel):
     products: List[OrderItemSchema] = []
 
 
+class QuoteRequest(BaseModel):
+    branch_id: int
+    products: List[OrderItemSchema] = []
+
+
+class QuoteLineResponse(BaseModel):
+    product_id: int
+    quantity: int
+    # after the product discount
+    unit_price: Decimal
+    discount: Decimal
+    # tax included
+    addons_price: Decimal
+    tax: Decimal
+    options_price: Decimal
+    coupon_code: Optional[str] = None
+    coupon_discount: Decimal = Decimal("0.00")
+    total_price: Decimal
+
+
+class QuoteResponse(BaseModel):
+    branch_id: int
+    items: List[QuoteLineResponse]
+    # product discounts, the coupons' come on top
+    discount: Decimal
+    coupon_discount: Decimal = Decimal("0.00")
+    total_price: Decimal
+
+
 class OrderItemResponse(BaseModel):
     id: int
     product_id: int
@@ -0,0 +1,19 @@
+from typing import Generic, List, Optional, TypeVar
+
+from fastapi import Query
+from pydantic import BaseModel
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+T = TypeVar("T")
+
+
+class PageParams(BaseModel):
+    cursor: Optional[str] = Query(None, description="Opaque cursor returned as `next_cursor` by the previous page")
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items per page")
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
@@ -1,7 +1,9 @@
-from pydantic import BaseModel, Json
+from fastapi import Query
+import orjson
+from pydantic import BaseModel, computed_field, field_validator
 from typing import Optional, List, Any
 from datetime import datetime
-from .review import ReviewResponse
+from .pagination import Page
 
 
 class AddonSchema(BaseModel):
@@ -54,13 +56,26 @@ class ProductBase(BaseModel):
     stock: int
     created_at: datetime
     updated_at: datetime | None = None
-    tags: Json[Any]
+    tags: Optional[List[str]] = None
     discount_type: str | None = None
-    discount_value: str | None = None
+    discount_value: float | None = None
     total_sales: int
     category_id: int
     subcategory_id: int
     branch_id: int
+    rating_count: int = 0
+    rating_sum: int = 0
+
+    @field_validator("tags", mode="before")
+    @classmethod
+    def decode_legacy_tags(cls, value: Any) -> Any:
+        # the JSON column is decoded by the driver, only rows saved as an encoded string need parsing
+        return orjson.loads(value) if isinstance(value, (str, bytes)) else value
+
+    @computed_field
+    @property
+    def rating_average(self) -> float | None:
+        return round(self.rating_sum / self.rating_count, 2) if self.rating_count else None
 
 
 class ProductsListResponse(ProductBase):
@@ -74,7 +89,34 @@ class ProductResponse(ProductBase):
     id: int
     addons: Optional[List[AddonResponseSchema]] = []
     variations: Optional[List[ProductVariationsResponseSchema]] = []
-    reviews: Optional[List[ReviewResponse]] = []
+    rating_histogram: List[int] = [0] * 5
 
     class Config:
         from_attributes = True
+
+
+class ProductFilter(BaseModel):
+    branch_id: Optional[int] = Query(None)
+    category_id: Optional[int] = Query(None)
+    subcategory_id: Optional[int] = Query(None)
+    min_price: Optional[float] = Query(None, ge=0)
+    max_price: Optional[float] = Query(None, ge=0)
+    tag: Optional[str] = Query(None, description="Only products carrying this tag")
+    in_stock: Optional[bool] = Query(None, description="Only products that can (true) or can't (false) be ordered")
+
+
+class FacetCount(BaseModel):
+    value: Optional[int] = None
+    count: int
+
+
+class ProductFacets(BaseModel):
+    total: int
+    branches: List[FacetCount] = []
+    categories: List[FacetCount] = []
+    subcategories: List[FacetCount] = []
+    in_stock: int = 0
+
+
+class ProductFilterResponse(Page[ProductsListResponse]):
+    facets: ProductFacets
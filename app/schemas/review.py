@@ -1,10 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 
 class ReviewBase(BaseModel):
     product_id: int
-    rating: int
+    rating: int = Field(ge=1, le=5)
     comment: str
 
 
@@ -21,5 +21,5 @@ class ReviewResponse(ReviewBase):
 
 class ReviewUpdate(BaseModel):
     review_id: int
-    rating: Optional[int] = None
+    rating: Optional[int] = Field(None, ge=1, le=5)
     comment: Optional[str] = None
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from pydantic import BaseModel, Json
+from pydantic import BaseModel
 
 
 class ShippingAddressSchema(BaseModel):
@@ -15,5 +15,5 @@ class ShippingOrderResponse(BaseModel):
     fee: float
     created_at: datetime
     shipping_client: str
-    shipping_client_data: Json
+    shipping_client_data: dict
     order_id: int
@@ -0,0 +1,48 @@
+"""
+Latency of nearest branch lookups: the GeoIndex k-d tree against a haversine scan of every branch.
+
+Places `--branches` random branches over a country sized area and times `--repeat` lookups of the 5
+nearest to random points.
+
+    python -m benchmarks.branch_lookup --branches 10000 --repeat 2000
+
+Needs no database.
+"""
+import argparse
+import random
+import statistics
+import time
+
+import main  # noqa: F401 - loads every model in the right order
+from app.core.utils.geo import GeoIndex, nearest_by_scan
+
+
+def timed(lookup, queries):
+    timings = []
+    for latitude, longitude in queries:
+        start = time.perf_counter()
+        lookup(latitude, longitude)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def run(branches: int, repeat: int):
+    generator = random.Random(0)
+    points = [(index, generator.uniform(22.0, 31.5), generator.uniform(25.0, 35.0)) for index in range(branches)]
+    queries = [(generator.uniform(22.0, 31.5), generator.uniform(25.0, 35.0)) for _ in range(repeat)]
+
+    start = time.perf_counter()
+    index = GeoIndex(points)
+    print(f"{branches} branches, index built in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for name, lookup in (("k-d tree", lambda latitude, longitude: index.nearest(latitude, longitude, 5)),
+                         ("scan", lambda latitude, longitude: nearest_by_scan(points, latitude, longitude, 5))):
+        median, worst = timed(lookup, queries)
+        print(f"{name:>9}: median {median:8.4f} ms  max {worst:8.4f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--branches", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.branches, args.repeat)
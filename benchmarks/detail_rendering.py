@@ -0,0 +1,107 @@
+"""
+Rendering cost of an order detail and a product detail.
+
+Seeds a product with `--addons` addons and `--variations` variations of `--options` options each, and an order
+of `--items` lines of that product each carrying every addon and variation, then times, `--repeat` times:
+
+  * orm: the ORM objects loaded with selectinload and serialized by pydantic, the default
+  * database: the document built by Postgres with json_build_object/json_agg in one query and sent as the bytes
+    it returns, DB_JSON_RENDERING
+
+    python -m benchmarks.detail_rendering --items 12 --addons 8 --variations 4 --options 5 --repeat 200
+
+Uses the database configured through the DB_* environment variables, everything is seeded in a transaction that
+is rolled back afterwards.
+"""
+import argparse
+import statistics
+import time
+import uuid
+
+import main  # noqa: F401 - loads every model in the right order
+from app.core.utils import to_json
+from app.crud.order import get_order_by_id
+from app.crud.order.get_orders import render_order_document
+from app.crud.products import get_product_by_id, render_product_document
+from app.db.base import Base
+from app.db.session import engine, SessionLocal
+from app.models import Branch, Category, SubCategory, Product, Addon, ProductVariation, VariationOption, Order, \
+    OrderItem, ShippingAddress, User
+from app.schemas.order import OrderResponse
+from app.schemas.product import ProductResponse
+
+
+def seed(db, items: int, addons: int, variations: int, options: int):
+    prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+    branch = Branch(name=prefix, latitude=30.0, longitude=31.0, coverage_radius=5000)
+    category = Category(name=prefix, priority=1, banner_image="", image="")
+    subcategory = SubCategory(name=prefix, category=category)
+    product = Product(name=prefix, price=10.0, description="a product " * 10, image="/images/product.png",
+                      tags=["spicy", "new", "family"], stock_type="unlimited", stock=100, branch=branch,
+                      category=category, subcategory=subcategory,
+                      addons=[Addon(title=f"addon {index}", price=1.5, tax=0.5) for index in range(addons)],
+                      variations=[ProductVariation(title=f"variation {index}", type="multiple", max_selections=options,
+                                                   options=[VariationOption(name=f"option {option}", price=2.0)
+                                                            for option in range(options)])
+                                  for index in range(variations)])
+    user = User(email=f"{prefix}@example.com", first_name="bench", last_name="mark")
+    order = Order(total_price=24.5 * items, status="pending", type="shipping", branch=branch, user=user,
+                  shipping_address=ShippingAddress(address=prefix, longitude=31.0, latitude=30.0),
+                  items=[OrderItem(quantity=2, total_price=24.5, product=product, addons=product.addons,
+                                   variations=product.variations) for _ in range(items)])
+    db.add_all([product, order])
+    db.flush()
+    return product.id, order.id, user
+
+
+def render_orm_product(db, product_id: int, user: User) -> bytes:
+    return to_json(ProductResponse, get_product_by_id(db, product_id))
+
+
+def render_database_product(db, product_id: int, user: User) -> bytes:
+    return render_product_document(db, product_id)[0]
+
+
+def render_orm_order(db, order_id: int, user: User) -> bytes:
+    return to_json(OrderResponse, get_order_by_id(db, order_id, user))
+
+
+def render_database_order(db, order_id: int, user: User) -> bytes:
+    return render_order_document(db, order_id, user)
+
+
+def run(items: int, addons: int, variations: int, options: int, repeat: int):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        try:
+            product_id, order_id, user = seed(db, items, addons, variations, options)
+            print(f"order of {items} items, products with {addons} addons and {variations} variations "
+                  f"of {options} options, {repeat} renders")
+            cases = [("product orm", render_orm_product, product_id),
+                     ("product database", render_database_product, product_id),
+                     ("order orm", render_orm_order, order_id),
+                     ("order database", render_database_order, order_id)]
+            for name, render, document_id in cases:
+                size = len(render(db, document_id, user))
+                timings = []
+                for _ in range(repeat):
+                    # nothing served from the identity map, every render loads its objects again
+                    db.expunge_all()
+                    start = time.perf_counter()
+                    render(db, document_id, user)
+                    timings.append((time.perf_counter() - start) * 1000)
+                print(f"{name:>16}: median {statistics.median(timings):7.2f} ms  "
+                      f"max {max(timings):7.2f} ms  {size} bytes")
+        finally:
+            db.rollback()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=12)
+    parser.add_argument("--addons", type=int, default=8)
+    parser.add_argument("--variations", type=int, default=4)
+    parser.add_argument("--options", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    run(args.items, args.addons, args.variations, args.options, args.repeat)
@@ -0,0 +1,69 @@
+"""
+Latency benchmark for search_products.
+
+Seeds `--products` products with generated names and descriptions, runs every query of QUERIES `--repeat`
+times and prints the median and worst latency per query together with the number of results.
+
+    python -m benchmarks.product_search --products 100000 --repeat 50
+
+Uses the database configured through the DB_* environment variables and removes its products afterwards.
+"""
+import argparse
+import statistics
+import time
+import uuid
+
+from sqlalchemy import text
+
+import main  # noqa: F401 - loads every model in the right order
+from app.crud.products import search_products, trigram_enabled
+from app.db.base import Base
+from app.db.session import engine, SessionLocal
+
+QUERIES = ["chicken burger", "spicy", "cheesburger", "grilled -beef", "\"family meal\""]
+
+WORDS = ["chicken", "beef", "burger", "wrap", "spicy", "grilled", "crispy", "cheese", "family", "meal", "salad",
+         "fries", "double", "classic", "smoky", "vegan", "sauce", "combo", "kids", "large"]
+
+SEED = text("""
+    WITH words AS (SELECT CAST(:words AS text[]) AS w)
+    INSERT INTO products (name, description, tags, price, stock, stock_type, is_active)
+    SELECT
+        :prefix || ' ' || w[1 + i % 20] || ' ' || w[1 + (i / 20) % 20] || ' ' || i,
+        w[1 + (i * 7) % 20] || ' ' || w[1 + (i * 13) % 20] || ' with ' || w[1 + (i * 17) % 20],
+        to_json(ARRAY[w[1 + (i * 3) % 20]]),
+        10, 100, 'fixed', true
+    FROM words, generate_series(1, :count) AS i
+""")
+
+
+def run(products: int, repeat: int):
+    Base.metadata.create_all(bind=engine)
+    prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+    with SessionLocal() as db:
+        db.execute(SEED, {"prefix": prefix, "words": WORDS, "count": products})
+        db.commit()
+        db.execute(text("ANALYZE products"))
+        print(f"{products} products, trigram matching {'on' if trigram_enabled(db) else 'off'}")
+
+        try:
+            for query in QUERIES:
+                timings, results = [], 0
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    results = len(search_products(db, query, limit=20))
+                    timings.append((time.perf_counter() - start) * 1000)
+                print(f"{query!r:>20}: median {statistics.median(timings):7.2f} ms  "
+                      f"max {max(timings):7.2f} ms  results {results}")
+        finally:
+            db.rollback()
+            db.execute(text("DELETE FROM products WHERE name LIKE :pattern"), {"pattern": f"{prefix} %"})
+            db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    run(args.products, args.repeat)
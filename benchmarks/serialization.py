@@ -0,0 +1,85 @@
+"""
+Serialization cost of a product listing.
+
+Builds `--products` Product objects in memory and times, `--repeat` times, rendering them as a listing:
+
+  * before: validation into the former schema (tags as a JSON string parsed on every product), then
+    jsonable_encoder and the stdlib json encoder, what a response_model route with JSONResponse did
+  * orjson: the same validation and jsonable_encoder, rendered by ORJSONResponse, the app default now
+  * to_json: one validation and pydantic-core serialization straight to bytes, the listing endpoints now
+
+    python -m benchmarks.serialization --products 1000 --repeat 200
+
+Needs no database.
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime
+from typing import Any, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import Json
+
+import main  # noqa: F401 - loads every model in the right order
+from app.core.utils import to_json, type_adapter
+from app.models import Product
+from app.schemas.product import ProductsListResponse
+
+
+class FormerProductsListResponse(ProductsListResponse):
+    tags: Json[Any]
+
+    @classmethod
+    def decode_legacy_tags(cls, value: Any) -> Any:
+        # Json[Any] did the parsing
+        return value
+
+
+def build_products(count: int, encoded_tags: bool) -> List[Product]:
+    now = datetime.now()
+    tags = ["spicy", "new", "family"]
+    return [Product(id=index, name=f"product {index}", price=10.5, description="a product " * 10,
+                    image=f"/images/{index}.png", stock=100, created_at=now, updated_at=now,
+                    tags=json.dumps(tags) if encoded_tags else tags, discount_type=None, discount_value=None,
+                    total_sales=index, category_id=1, subcategory_id=1, branch_id=1, rating_count=3, rating_sum=12)
+            for index in range(count)]
+
+
+def render_before(products) -> bytes:
+    adapter = type_adapter(List[FormerProductsListResponse])
+    return JSONResponse(jsonable_encoder(adapter.validate_python(products, from_attributes=True))).body
+
+
+def render_orjson(products) -> bytes:
+    adapter = type_adapter(List[ProductsListResponse])
+    return ORJSONResponse(jsonable_encoder(adapter.validate_python(products, from_attributes=True))).body
+
+
+def render_to_json(products) -> bytes:
+    return to_json(List[ProductsListResponse], products)
+
+
+def run(count: int, repeat: int):
+    cases = [("before", render_before, build_products(count, encoded_tags=True)),
+             ("orjson", render_orjson, build_products(count, encoded_tags=False)),
+             ("to_json", render_to_json, build_products(count, encoded_tags=False))]
+    print(f"{count} products, {repeat} renders")
+    for name, render, products in cases:
+        size = len(render(products))
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            render(products)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{name:>8}: median {statistics.median(timings):7.2f} ms  max {max(timings):7.2f} ms  {size} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    run(args.products, args.repeat)
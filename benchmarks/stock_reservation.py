@@ -0,0 +1,80 @@
+"""
+Concurrency benchmark for reserve_product_stocks.
+
+Fires `--requests` single unit reservations at one product holding `--stock` units from `--concurrency`
+parallel connections and checks that exactly `--stock` of them succeed (zero oversell).
+
+    python -m benchmarks.stock_reservation --stock 500 --requests 2000 --concurrency 80
+
+Uses the database configured through the DB_* environment variables and removes its product afterwards.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+import main  # noqa: F401 - loads every model in the right order
+from app.core.utils.products import reserve_product_stocks, InsufficientStockError
+from app.db.base import Base
+from app.db.session import ASYNC_SQLALCHEMY_DATABASE_URL
+from app.models import Product
+
+
+async def worker(engine, product_id: int, jobs: asyncio.Queue, results: list):
+    while not jobs.empty():
+        jobs.get_nowait()
+        async with AsyncSession(engine) as db:
+            try:
+                await reserve_product_stocks(db, {product_id: 1})
+                await db.commit()
+                results.append(True)
+            except InsufficientStockError:
+                await db.rollback()
+                results.append(False)
+
+
+async def run(stock: int, requests: int, concurrency: int):
+    engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, pool_size=concurrency, max_overflow=0)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    async with AsyncSession(engine, expire_on_commit=False) as db:
+        product = Product(name=f"benchmark-{uuid.uuid4()}", price=1.0, stock=stock, stock_type="fixed")
+        db.add(product)
+        await db.commit()
+        product_id = product.id
+
+    jobs: asyncio.Queue = asyncio.Queue()
+    for _ in range(requests):
+        jobs.put_nowait(None)
+    results: list = []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(engine, product_id, jobs, results) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    async with AsyncSession(engine) as db:
+        remaining = (await db.get(Product, product_id)).stock
+        await db.execute(delete(Product).where(Product.id == product_id))
+        await db.commit()
+    await engine.dispose()
+
+    reserved = sum(results)
+    print(f"requests:     {requests} from {concurrency} concurrent connections")
+    print(f"elapsed:      {elapsed:.2f}s ({requests / elapsed:.0f} reservations/s)")
+    print(f"reserved:     {reserved} / initial stock {stock}")
+    print(f"rejected:     {len(results) - reserved}")
+    print(f"final stock:  {remaining}")
+    print(f"oversold:     {max(reserved - stock, 0) + max(-remaining, 0)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=80)
+    args = parser.parse_args()
+    asyncio.run(run(args.stock, args.requests, args.concurrency))
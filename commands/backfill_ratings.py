@@ -0,0 +1,18 @@
+"""
+Recompute the rating aggregates of every product from product_reviews.
+
+    python -m commands.backfill_ratings --batch-size 10000
+
+Run it once after adding the rating columns to an existing database, or whenever the aggregates are suspected
+to have drifted. It can run while reviews keep coming in, see backfill_product_ratings.
+"""
+import argparse
+
+import main  # noqa: F401 - loads every model in the right order
+from app.core.background_tasks import backfill_product_ratings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args()
+    print(f"{backfill_product_ratings(args.batch_size)} products updated")
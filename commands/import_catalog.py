@@ -0,0 +1,31 @@
+"""
+Insert or update products with their addons, variations and options from an NDJSON or CSV catalog.
+
+    python -m commands.import_catalog catalog.ndjson
+    python -m commands.import_catalog catalog.csv --format csv
+
+One product per line (NDJSON) or row (CSV, nested fields as JSON cells), see ImportProduct for the fields.
+The whole file is imported in one transaction, nothing is written if a record is invalid.
+"""
+import argparse
+import sys
+
+import main  # noqa: F401 - loads every model in the right order
+from app.crud.catalog_import import import_catalog, format_for, CatalogImportError
+from app.db.session import SessionLocal
+from app.schemas.catalog_import import CatalogFormat
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=[format.value for format in CatalogFormat], default=None)
+    args = parser.parse_args()
+    with SessionLocal() as db, open(args.path, "rb") as stream:
+        try:
+            report = import_catalog(db, stream, CatalogFormat(args.format) if args.format else format_for(args.path))
+        except CatalogImportError as e:
+            sys.exit(f"Import failed, {e}")
+    for name, count in report.rows.items():
+        print(f"{name:>20}: {count}")
+    for phase, seconds in report.timings.items():
+        print(f"{phase:>20}: {seconds:.3f}s")
@@ -1,19 +1,41 @@
+import asyncio
 import time
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Response, Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from slowapi.errors import RateLimitExceeded
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from starlette.responses import HTMLResponse
 
 from app.api.v1.endpoints import *
 from app.db.base import Base
-from app.db.session import engine
+from app.db.session import engine, async_engine
+from app.db.routing import primary_pins, request_pin_key
 from aiocache import caches
 from fastapi.applications import State
 from app.core import limiter  # Import the limiter
-
-app = FastAPI()
+from app.core.background_tasks import flush_product_sales_periodically, SALES_FLUSH_INTERVAL, \
+    purge_idempotency_keys_periodically, IDEMPOTENCY_PURGE_INTERVAL
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tasks = []
+    if SALES_FLUSH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(flush_product_sales_periodically()))
+    if IDEMPOTENCY_PURGE_INTERVAL > 0:
+        tasks.append(asyncio.create_task(purge_idempotency_keys_periodically()))
+    yield
+    for task in tasks:
+        task.cancel()
+    # asyncpg connections are bound to the running loop, release them before it closes
+    await async_engine.dispose()
+
+
+# routes without a pre-serialized body still skip the stdlib encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.state = State()  # Explicitly create the state
 app.state.limiter = limiter
 
@@ -37,6 +59,16 @@ async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded)
     return JSONResponse(status_code=429, content=detail)
 
 
+@app.exception_handler(PoolTimeoutError)
+async def pool_exhausted_handler(request: Request, exc: PoolTimeoutError) -> Response:
+    # fail fast when every connection is busy instead of letting requests pile up behind the pool
+    detail = {
+        "error": "Service unavailable",
+        "message": "Database connection pool exhausted, please retry"
+    }
+    return JSONResponse(status_code=503, content=detail, headers={"Retry-After": "1"})
+
+
 @app.middleware("http")
 async def global_limiter(request: Request, call_next):
     try:
@@ -48,12 +80,24 @@ async def global_limiter(request: Request, call_next):
 
 app.add_middleware(BaseHTTPMiddleware, dispatch=global_limiter)
 
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    # a successful write pins the client to the primary so its next reads don't hit a lagging replica
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        primary_pins.pin(request_pin_key(request))
+    return response
+
 app.include_router(auth_router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(orders_router, prefix="/api/v1/orders", tags=["orders"])
 app.include_router(notifications_router, prefix="/api/v1/notifications", tags=["notifications"])
 app.include_router(products_router, prefix="/api/v1/products", tags=["products"])
 app.include_router(categories_router, prefix="/api/v1/categories", tags=["category"])
 app.include_router(shipping_router, prefix="/api/v1/shipping-orders", tags=["shipping"])
+app.include_router(branches_router, prefix="/api/v1/branches", tags=["branches"])
+app.include_router(admin_router, prefix="/api/v1/admin", tags=["admin"])
+app.include_router(metrics_router, prefix="/api/v1/metrics", tags=["metrics"])
 
 
 @app.get("/")
@@ -0,0 +1,110 @@
+import orjson
+
+from tests.conftest import client, test_db
+from tests.api.v1.test_orders import auth_headers, REGISTER_DATA
+from app.models import User, Branch, Category, SubCategory, Product
+
+
+def admin_headers(client, db):
+    headers = auth_headers(client)
+    db.query(User).filter(User.email == REGISTER_DATA["email"]).update({"is_superuser": True})
+    db.commit()
+    return headers
+
+
+def catalog_ids(db):
+    branch = Branch(name="main", latitude=30.0, longitude=31.0, coverage_radius=5000)
+    category = Category(name="burgers", priority=1, banner_image="", image="")
+    db.add_all([branch, category])
+    db.flush()
+    subcategory = SubCategory(name="beef", category_id=category.id)
+    db.add(subcategory)
+    db.commit()
+    return {"branch_id": branch.id, "category_id": category.id, "subcategory_id": subcategory.id}
+
+
+def upload(client, headers, content: bytes, filename: str = "catalog.ndjson"):
+    return client.post("/api/v1/admin/catalog/import", files={"file": (filename, content)}, headers=headers)
+
+
+def test_catalog_import_upserts_products_and_children(client, test_db):
+    headers = auth_headers(client)
+    ids = catalog_ids(test_db)
+    records = [
+        {"name": "classic", "price": 10, "stock": 5, "tags": ["beef"], **ids,
+         "addons": [{"title": "cheese", "price": 1.5, "tax": 0.5}],
+         "variations": [{"title": "size", "required": True,
+                         "options": [{"name": "large", "price": 2}, {"name": "small", "price": 0}]}]},
+        {"name": "double", "price": 15, **ids},
+    ]
+    ndjson = b"\n".join(orjson.dumps(record) for record in records)
+    assert upload(client, headers, ndjson).status_code == 403
+
+    headers = admin_headers(client, test_db)
+    response = upload(client, headers, ndjson)
+    assert response.status_code == 200
+    report = response.json()
+    assert report["rows"]["products_inserted"] == 2
+    assert report["rows"]["options_inserted"] == 2
+    assert "total" in report["timings"]
+
+    # same catalog: nothing is written
+    assert upload(client, headers, ndjson).json()["rows"]["products_unchanged"] == 2
+
+    # orders consumed some stock, a catalog without stock leaves it alone
+    classic = test_db.query(Product).filter(Product.name == "classic").one()
+    classic.stock = 3
+    test_db.commit()
+
+    records[0].update(price=11, stock=None, addons=[], variations=[{"title": "size", "options": [{"name": "large",
+                                                                                                "price": 3}]}])
+    records.append({"name": "fries", "price": 4, **ids})
+    rows = upload(client, headers, b"\n".join(orjson.dumps(record) for record in records)).json()["rows"]
+    assert (rows["products_updated"], rows["products_inserted"], rows["products_unchanged"]) == (1, 1, 1)
+    assert (rows["addons_removed"], rows["options_updated"], rows["options_removed"]) == (1, 1, 1)
+
+    body = client.get(f"/api/v1/products/get/{classic.id}").json()
+    assert (body["price"], body["stock"], body["addons"]) == (11.0, 3, [])
+    assert [(option["name"], option["price"]) for option in body["variations"][0]["options"]] == [("large", 3.0)]
+
+
+def test_catalog_import_reads_csv_and_rejects_invalid_records(client, test_db):
+    headers = admin_headers(client, test_db)
+    ids = catalog_ids(test_db)
+    csv = ("name,price,branch_id,category_id,subcategory_id,tags,addons\n"
+           f'wrap,7.5,{ids["branch_id"]},{ids["category_id"]},{ids["subcategory_id"]},"[""chicken""]",'
+           '"[{""title"": ""sauce"", ""price"": 0.5}]"\n')
+    response = upload(client, headers, csv.encode(), filename="catalog.csv")
+    assert response.status_code == 200
+    assert response.json()["rows"]["addons_inserted"] == 1
+    assert test_db.query(Product).filter(Product.name == "wrap").one().tags == ["chicken"]
+
+    invalid = orjson.dumps({"name": "burger", "price": 1, **ids}) + b"\n" + orjson.dumps({"name": "x", "price": -1})
+    response = upload(client, headers, invalid)
+    assert response.status_code == 422
+    assert response.json()["detail"]["line"] == 2
+    # nothing from the failed import is kept
+    assert test_db.query(Product).filter(Product.name == "burger").count() == 0
+
+    unknown_branch = orjson.dumps({"name": "burger", "price": 1, **ids, "branch_id": ids["branch_id"] + 100})
+    assert upload(client, headers, unknown_branch).status_code == 422
+
+
+def test_catalog_import_matches_products_within_their_branch(client, test_db):
+    headers = admin_headers(client, test_db)
+    ids = catalog_ids(test_db)
+    other = Branch(name="second", latitude=30.0, longitude=31.0, coverage_radius=5000)
+    test_db.add(other)
+    test_db.commit()
+    records = [{"name": "classic", "price": 10, **ids}, {"name": "classic", "price": 12, **ids, "branch_id": other.id}]
+    rows = upload(client, headers, b"\n".join(orjson.dumps(record) for record in records)).json()["rows"]
+    assert rows["products_inserted"] == 2
+
+    # each row updates the product of its own branch, none moves to the other one
+    records[1]["price"] = 13
+    rows = upload(client, headers, b"\n".join(orjson.dumps(record) for record in records)).json()["rows"]
+    assert (rows["products_updated"], rows["products_unchanged"]) == (1, 1)
+    prices = {product.branch_id: product.price for product in test_db.query(Product).filter(Product.name == "classic")}
+    assert prices == {ids["branch_id"]: 10.0, other.id: 13.0}
+
+    assert upload(client, headers, orjson.dumps(records[0]) + b"\n" + orjson.dumps(records[0])).status_code == 422
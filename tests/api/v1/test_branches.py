@@ -0,0 +1,112 @@
+import random
+
+from tests.conftest import client, test_db, count_queries
+from tests.api.v1.test_orders import auth_headers, create_catalog, create_product, order_payload
+from app.models import Branch, Category, Product
+from app.core.utils.geo import GeoIndex, nearest_by_scan
+
+
+def test_geo_index_matches_a_full_scan():
+    generator = random.Random(7)
+    points = [(index, generator.uniform(-90, 90), generator.uniform(-180, 180)) for index in range(500)]
+    index = GeoIndex(points)
+    for _ in range(50):
+        latitude, longitude = generator.uniform(-90, 90), generator.uniform(-180, 180)
+        assert [item for item, _ in index.nearest(latitude, longitude, 5)] == \
+            [item for item, _ in nearest_by_scan(points, latitude, longitude, 5)]
+        within = [item for item, distance in nearest_by_scan(points, latitude, longitude, len(points))
+                  if distance <= 1_000_000]
+        assert [item for item, _ in index.within(latitude, longitude, 1_000_000)] == within
+
+
+def test_nearest_branches(client, test_db, count_queries):
+    test_db.add_all([
+        Branch(name="downtown", latitude=30.05, longitude=31.24, coverage_radius=3000),
+        Branch(name="airport", latitude=30.11, longitude=31.41, coverage_radius=20000),
+        Branch(name="coast", latitude=31.20, longitude=29.92, coverage_radius=5000),
+        Branch(name="unlocated"),
+    ])
+    test_db.commit()
+    point = {"latitude": 30.06, "longitude": 31.25}
+
+    response = client.get("/api/v1/branches/nearest", params={**point, "limit": 2})
+    assert response.status_code == 200
+    body = response.json()
+    assert [branch["name"] for branch in body] == ["downtown", "airport"]
+    assert body[0]["distance"] < body[1]["distance"]
+    assert [branch["covers"] for branch in body] == [True, True]
+
+    with count_queries() as counter:
+        covering = client.get("/api/v1/branches/nearest", params={**point, "covering": True}).json()
+    assert counter.queries == 0
+    assert [branch["name"] for branch in covering] == ["downtown", "airport"]
+
+    # writes rebuild the index
+    test_db.query(Branch).filter(Branch.name == "airport").one().coverage_radius = 1000
+    test_db.commit()
+    covering = client.get("/api/v1/branches/nearest", params={**point, "covering": True}).json()
+    assert [branch["name"] for branch in covering] == ["downtown"]
+
+    assert client.get("/api/v1/branches/nearest", params={"latitude": 91, "longitude": 0}).status_code == 422
+
+
+def test_shipping_orders_must_be_within_branch_coverage(client, test_db):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db)
+
+    payload = order_payload(branch, product, addon, variation, option)
+    payload["shipping_address"] = {"longitude": 31.5, "latitude": 30.0, "address": "far away"}
+    response = client.post("/api/v1/orders/create", json=payload, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Shipping address is outside the branch coverage"
+
+    # pickups don't care where the customer lives
+    payload["type"] = "pickup"
+    assert client.post("/api/v1/orders/create", json=payload, headers=headers).status_code == 200
+
+    payload["branch_id"] = branch.id + 100
+    assert client.post("/api/v1/orders/create", json=payload, headers=headers).status_code == 404
+
+
+def test_branch_menu(client, test_db, count_queries):
+    branch, product, addon, variation, option = create_catalog(test_db)
+    category = test_db.get(Category, product.category_id)
+    subcategory = category.subcategories[0]
+    sold_out, *_ = create_product(test_db, branch, category, subcategory, name="sold out", stock=0)
+    other = Branch(name="other")
+    test_db.add(other)
+    test_db.commit()
+    create_product(test_db, other, category, subcategory, name="elsewhere")
+
+    response = client.get(f"/api/v1/branches/{branch.id}/menu")
+    assert response.status_code == 200
+    menu = response.json()
+    assert [category["name"] for category in menu["categories"]] == ["burgers"]
+    products = menu["categories"][0]["subcategories"][0]["products"]
+    assert [item["name"] for item in products] == ["classic", "sold out"]
+    assert products[0]["addons"] == [{"id": addon.id, "title": "cheese", "price": 1.5, "tax": 0.5}]
+    assert products[0]["variations"][0]["options"] == [{"id": option.id, "name": "large", "price": 2.0}]
+    assert menu["sold_out"] == [sold_out.id]
+
+    # the snapshot is reused, only the stock overlay is read
+    with count_queries() as counter:
+        assert client.get(f"/api/v1/branches/{branch.id}/menu").json() == menu
+    assert counter.queries == 1
+    etag = response.headers["etag"]
+    assert client.get(f"/api/v1/branches/{branch.id}/menu", headers={"If-None-Match": etag}).status_code == 304
+
+    # stock changes don't rebuild the snapshot but show up in the overlay and the ETag
+    test_db.query(Product).filter(Product.id == sold_out.id).update({"stock": 5})
+    test_db.commit()
+    response = client.get(f"/api/v1/branches/{branch.id}/menu", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["sold_out"] == []
+    assert response.json()["built_at"] == menu["built_at"]
+
+    # catalog edits swap it
+    product.is_visible = False
+    test_db.commit()
+    products = client.get(f"/api/v1/branches/{branch.id}/menu").json()["categories"][0]["subcategories"][0]["products"]
+    assert [item["name"] for item in products] == ["sold out"]
+
+    assert client.get(f"/api/v1/branches/{branch.id + 100}/menu").status_code == 404
@@ -0,0 +1,47 @@
+from tests.conftest import client, test_db, count_queries
+from app.models import Branch, Category, SubCategory, Product
+
+
+def test_category_tree(client, test_db, count_queries):
+    branch = Branch(name="main", latitude=30.0, longitude=31.0, coverage_radius=5000)
+    burgers = Category(name="burgers", priority=2, banner_image="", image="")
+    drinks = Category(name="drinks", priority=1, banner_image="", image="")
+    sides = Category(name="sides", banner_image="", image="")
+    hidden = Category(name="hidden", priority=0, is_active=False, banner_image="", image="")
+    test_db.add_all([branch, burgers, drinks, sides, hidden])
+    test_db.flush()
+    beef = SubCategory(name="beef", category_id=burgers.id)
+    chicken = SubCategory(name="chicken", category_id=burgers.id)
+    retired = SubCategory(name="retired", category_id=burgers.id, is_active=False)
+    test_db.add_all([beef, chicken, retired])
+    test_db.flush()
+    test_db.add_all([
+        Product(name="classic", price=10.0, description="", image="", tags=[], stock=10, branch_id=branch.id,
+                category_id=burgers.id, subcategory_id=beef.id),
+        Product(name="double", price=12.0, description="", image="", tags=[], stock=10, branch_id=branch.id,
+                category_id=burgers.id, subcategory_id=beef.id),
+        Product(name="crispy", price=11.0, description="", image="", tags=[], stock=10, branch_id=branch.id,
+                category_id=burgers.id, subcategory_id=chicken.id, is_visible=False),
+        Product(name="cola", price=2.0, description="", image="", tags=[], stock=10, branch_id=branch.id,
+                category_id=drinks.id),
+    ])
+    test_db.commit()
+
+    response = client.get("/api/v1/categories/list")
+    assert response.status_code == 200
+    tree = response.json()
+    # active categories by priority, unprioritized ones last
+    assert [category["name"] for category in tree] == ["drinks", "burgers", "sides"]
+    assert [category["product_count"] for category in tree] == [1, 2, 0]
+    assert tree[1]["subcategories"] == [{"id": beef.id, "name": "beef", "product_count": 2},
+                                        {"id": chicken.id, "name": "chicken", "product_count": 0}]
+
+    with count_queries() as counter:
+        assert client.get("/api/v1/categories/list").content == response.content
+    assert counter.queries == 0
+
+    # a category edit rebuilds the tree
+    hidden.is_active = True
+    test_db.commit()
+    assert [category["name"] for category in client.get("/api/v1/categories/list").json()] == \
+        ["hidden", "drinks", "burgers", "sides"]
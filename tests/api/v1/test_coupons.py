@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event, update
+
+from tests.conftest import client, test_db
+from tests.api.v1.test_admin import admin_headers
+from tests.api.v1.test_orders import create_catalog, create_product, order_payload
+from app.crud.coupons import shard_capacities
+from app.db.session import async_engine
+from app.models import Category, Coupon, Order
+
+
+def test_shard_capacities_split_the_cap():
+    assert shard_capacities(10, 4) == [3, 3, 2, 2]
+    assert shard_capacities(2, 16) == [1, 1]
+
+
+def test_coupons_discount_eligible_lines(client, test_db):
+    headers = admin_headers(client, test_db)
+    branch, product, addon, variation, option = create_catalog(test_db)
+    drinks = Category(name="drinks", priority=2, banner_image="", image="")
+    test_db.add(drinks)
+    test_db.commit()
+    cola, *cola_extras = create_product(test_db, branch, drinks, product.subcategory, name="cola")
+
+    coupon = {"code": "burger10", "type": "percent", "value": 10, "category_id": product.category_id,
+              "min_spend": 20}
+    response = client.post("/api/v1/admin/coupons", json=coupon, headers=headers)
+    assert response.status_code == 201
+    assert response.json()["code"] == "BURGER10"
+    assert client.post("/api/v1/admin/coupons", json=coupon, headers=headers).status_code == 409
+
+    burger_line = order_payload(branch, product, addon, variation, option)["products"][0]
+    cola_line = order_payload(branch, cola, *cola_extras, quantity=1)["products"][0]
+    quote = {"branch_id": branch.id, "products": [{**burger_line, "coupon_code": "Burger10"},
+                                                   {**cola_line, "coupon_code": "burger10"}]}
+    body = client.post("/api/v1/orders/quote", json=quote).json()
+    # 10% of 24.00 on the burger line only, the cola isn't a burger
+    assert [float(item["coupon_discount"]) for item in body["items"]] == [2.4, 0.0]
+    assert float(body["coupon_discount"]) == 2.4
+    assert float(body["total_price"]) == 21.6 + 14.0
+
+    # the minimum spend is checked on the subtotal
+    quote["products"] = [{**cola_line, "coupon_code": "burger10"}]
+    assert client.post("/api/v1/orders/quote", json=quote).status_code == 400
+    quote["products"] = [{**burger_line, "coupon_code": "unknown"}]
+    assert client.post("/api/v1/orders/quote", json=quote).json()["detail"] == "Coupon UNKNOWN is not valid"
+
+    # a disabled coupon stops applying as soon as the change commits
+    response = client.post("/api/v1/admin/coupons", json={"code": "off", "type": "fixed", "value": 5},
+                           headers=headers)
+    quote["products"] = [{**burger_line, "coupon_code": "off"}]
+    assert float(client.post("/api/v1/orders/quote", json=quote).json()["total_price"]) == 19.0
+    test_db.get(Coupon, response.json()["id"]).is_active = False
+    test_db.commit()
+    assert client.post("/api/v1/orders/quote", json=quote).status_code == 400
+
+
+def test_capped_coupon_is_redeemed_at_most_its_cap(client, test_db):
+    headers = admin_headers(client, test_db)
+    branch, product, addon, variation, option = create_catalog(test_db, stock_type="unlimited")
+    coupon = client.post("/api/v1/admin/coupons", json={"code": "first3", "type": "fixed", "value": 5,
+                                                        "max_redemptions": 3}, headers=headers).json()
+
+    payload = order_payload(branch, product, addon, variation, option, quantity=1)
+    payload["products"][0]["coupon_code"] = "first3"
+    with ThreadPoolExecutor(5) as pool:
+        responses = list(pool.map(lambda _: client.post("/api/v1/orders/create", json=payload, headers=headers),
+                                  range(5)))
+    assert sorted(response.status_code for response in responses) == [200, 200, 200, 400, 400]
+    assert {float(response.json()["total_price"]) for response in responses if response.status_code == 200} == {9.0}
+    assert test_db.query(Order).count() == 3
+
+    response = client.get(f"/api/v1/admin/coupons/{coupon['id']}", headers=headers)
+    assert response.json()["redeemed"] == 3
+
+
+def test_orders_only_apply_coupons_still_active(client, test_db):
+    headers = admin_headers(client, test_db)
+    branch, product, addon, variation, option = create_catalog(test_db, stock_type="unlimited")
+    client.post("/api/v1/admin/coupons", json={"code": "off", "type": "fixed", "value": 5}, headers=headers)
+    payload = order_payload(branch, product, addon, variation, option, quantity=1)
+    payload["products"][0]["coupon_code"] = "off"
+    quote = {"branch_id": branch.id, "products": payload["products"]}
+    assert float(client.post("/api/v1/orders/quote", json=quote).json()["total_price"]) == 9.0
+
+    # disabled by a bulk update, which leaves the cached index as is like a change made through another worker
+    test_db.execute(update(Coupon).where(Coupon.code == "OFF").values(is_active=False))
+    test_db.commit()
+    assert client.post("/api/v1/orders/quote", json=quote).status_code == 200
+    assert client.post("/api/v1/orders/create", json=payload, headers=headers).status_code == 400
+    assert test_db.query(Order).count() == 0
+
+
+def test_cold_quote_with_a_coupon_is_one_query(client, test_db):
+    headers = admin_headers(client, test_db)
+    branch, product, addon, variation, option = create_catalog(test_db)
+    client.post("/api/v1/admin/coupons", json={"code": "off", "type": "fixed", "value": 5}, headers=headers)
+    payload = order_payload(branch, product, addon, variation, option, quantity=1)
+    payload["products"][0]["coupon_code"] = "off"
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statements)
+    try:
+        # neither the price table nor the coupon index is cached yet
+        response = client.post("/api/v1/orders/quote", json={"branch_id": branch.id, "products": payload["products"]})
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statements)
+    assert float(response.json()["total_price"]) == 9.0
+    assert len(statements) == 1
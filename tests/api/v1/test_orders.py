@@ -0,0 +1,350 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import event, update
+
+from tests.conftest import client, test_db, count_queries
+from app.db.session import async_engine
+from app.core.utils import db_utils
+from app.models import Branch, Category, SubCategory, Product, Addon, ProductVariation, VariationOption, Order
+
+REGISTER_DATA = {
+    "email": "orders@gmail.com",
+    "password": "@Test6627",
+    "first_name": "omar",
+    "last_name": "al-desi"
+}
+
+
+def auth_headers(client):
+    response = client.post("/api/v1/auth/register", json=REGISTER_DATA)
+    if response.status_code != 201:
+        response = client.post("/api/v1/auth/login", json={
+            "email": REGISTER_DATA.get("email"),
+            "password": REGISTER_DATA.get("password")
+        })
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def create_product(db, branch, category, subcategory, name: str = "classic", stock: int = 10,
+                   stock_type: str = "fixed"):
+    product = Product(name=name, price=10.0, description="", image="", tags=[], stock_type=stock_type,
+                      stock=stock, branch_id=branch.id, category_id=category.id, subcategory_id=subcategory.id)
+    addon = Addon(title="cheese", price=1.5, tax=0.5)
+    option = VariationOption(name="large", price=2.0)
+    variation = ProductVariation(title="size", type="single", required=True, options=[option])
+    product.addons.append(addon)
+    product.variations.append(variation)
+    db.add(product)
+    db.commit()
+    return product, addon, variation, option
+
+
+def create_catalog(db, stock: int = 10, stock_type: str = "fixed"):
+    branch = Branch(name="main", latitude=30.0, longitude=31.0, coverage_radius=5000)
+    category = Category(name="burgers", priority=1, banner_image="", image="")
+    db.add_all([branch, category])
+    db.flush()
+    subcategory = SubCategory(name="beef", category_id=category.id)
+    db.add(subcategory)
+    db.flush()
+    return (branch, *create_product(db, branch, category, subcategory, stock=stock, stock_type=stock_type))
+
+
+def order_payload(branch, product, addon, variation, option, quantity: int = 2):
+    return {
+        "branch_id": branch.id,
+        "type": "shipping",
+        "payment": {
+            "gateway": "stripe",
+            "payment_intent_id": "pi_test",
+            "receipt_email": "orders@gmail.com",
+            "payment_client_secret": "secret"
+        },
+        "shipping_address": {"longitude": 31.0, "latitude": 30.0, "address": "street 1"},
+        "products": [{
+            "product_id": product.id,
+            "quantity": quantity,
+            "addons": [{"id": addon.id}],
+            "variations": [{"id": variation.id, "options": [{"id": option.id}]}]
+        }]
+    }
+
+
+def test_create_order(client, test_db):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db)
+
+    response = client.post("/api/v1/orders/create", json=order_payload(branch, product, addon, variation, option),
+                           headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    # 2 * 10.0 + (1.5 + 0.5) + 2.0
+    assert float(body['total_price']) == 24.0
+    assert body['shipping_address']['address'] == "street 1"
+    assert len(body['items']) == 1
+
+    test_db.expire_all()
+    assert test_db.get(Product, product.id).stock == 8
+
+
+def test_create_order_insufficient_stock(client, test_db):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db, stock=1)
+
+    response = client.post("/api/v1/orders/create", json=order_payload(branch, product, addon, variation, option),
+                           headers=headers)
+    assert response.status_code == 400
+
+    test_db.expire_all()
+    assert test_db.get(Product, product.id).stock == 1
+
+
+def test_create_order_query_count_is_flat(client, test_db):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db, stock=100)
+    payload = order_payload(branch, product, addon, variation, option, quantity=1)
+    for index in range(5):
+        extra = create_product(test_db, branch, product.category, product.subcategory, name=f"extra {index}")
+        payload["products"] += order_payload(branch, *extra, quantity=1)["products"]
+
+    statements = []
+
+    def count_selects(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_selects)
+    try:
+        single = client.post("/api/v1/orders/create", json=order_payload(branch, product, addon, variation, option,
+                                                                         quantity=1), headers=headers)
+        single_count = len(statements)
+        statements.clear()
+        many = client.post("/api/v1/orders/create", json=payload, headers=headers)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_selects)
+
+    assert single.status_code == 200
+    assert many.status_code == 200
+    assert len(many.json()['items']) == 6
+    assert len(statements) <= single_count
+
+
+def test_created_order_is_persisted(client, test_db):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db)
+    payload = order_payload(branch, product, addon, variation, option, quantity=1)
+
+    first = client.post("/api/v1/orders/create", json=payload, headers=headers)
+    second = client.post("/api/v1/orders/create", json=payload, headers=headers)
+    assert first.status_code == second.status_code == 200
+
+    response = client.get(f"/api/v1/orders/get/{first.json()['id']}", headers=headers)
+    assert response.status_code == 200
+    stored, created = response.json()['items'], first.json()['items']
+    assert [float(item.pop('total_price')) for item in stored] == [float(item.pop('total_price')) for item in created]
+    assert stored == created
+    assert response.json()['shipping_address'] == payload['shipping_address']
+
+    # both orders share the upserted shipping address
+    orders = test_db.query(Order).filter(Order.id.in_([first.json()['id'], second.json()['id']])).all()
+    assert len({order.shipping_address_id for order in orders}) == 1
+    assert all(order.payment and order.shipping_order for order in orders)
+
+
+def test_list_orders_is_paginated_newest_first(client, test_db):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db, stock_type="unlimited")
+    payload = order_payload(branch, product, addon, variation, option, quantity=1)
+    created = [client.post("/api/v1/orders/create", json=payload, headers=headers).json()['id'] for _ in range(3)]
+
+    first = client.get("/api/v1/orders/list", params={"limit": 2}, headers=headers).json()
+    assert [order['id'] for order in first['items']] == created[::-1][:2]
+    second = client.get("/api/v1/orders/list", params={"limit": 2, "cursor": first['next_cursor']},
+                        headers=headers).json()
+    assert [order['id'] for order in second['items']] == created[:1]
+    assert second['next_cursor'] is None
+
+
+def test_order_history_query_count_does_not_grow_with_the_page(client, test_db, count_queries):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db, stock_type="unlimited")
+    payload = order_payload(branch, product, addon, variation, option, quantity=1)
+    payload["products"] *= 2
+    for _ in range(6):
+        client.post("/api/v1/orders/create", json=payload, headers=headers)
+
+    counts = []
+    for limit in (1, 6):
+        with count_queries() as counter:
+            response = client.get("/api/v1/orders/list", params={"limit": limit}, headers=headers)
+        assert len(response.json()['items']) == limit
+        counts.append(counter.queries)
+    assert counts[0] == counts[1]
+
+    order = response.json()['items'][0]
+    assert order['shipping_address']['address'] == "street 1"
+    assert order['items'][0]['variations'] == [{"id": variation.id, "options": [{"id": option.id}]}]
+    assert client.get("/api/v1/orders/get/0", headers=headers).status_code == 404
+
+
+def test_order_detail_rendered_by_the_database_matches_the_orm(client, test_db, count_queries, monkeypatch):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db, stock_type="unlimited")
+    payload = order_payload(branch, product, addon, variation, option)
+    payload["products"].append({**payload["products"][0], "quantity": 1, "addons": []})
+    order_id = client.post("/api/v1/orders/create", json=payload, headers=headers).json()['id']
+    test_db.get(Order, order_id).schedule_time = datetime(2026, 1, 2, 3, 4, 5, 100)
+    test_db.commit()
+    orm = client.get(f"/api/v1/orders/get/{order_id}", headers=headers).json()
+    assert orm['scheduled_at'] == "2026-01-02T03:04:05.000100"
+
+    monkeypatch.setattr(db_utils, "DB_JSON_RENDERING", True)
+    with count_queries() as counter:
+        response = client.get(f"/api/v1/orders/get/{order_id}", headers=headers)
+    assert response.json() == orm
+    # the user of the token, then the whole document
+    assert counter.queries == 2
+    assert client.get("/api/v1/orders/get/0", headers=headers).status_code == 404
+
+
+def test_create_order_with_idempotency_key(client, test_db):
+    headers = {**auth_headers(client), "Idempotency-Key": "checkout-1"}
+    branch, product, addon, variation, option = create_catalog(test_db)
+    payload = order_payload(branch, product, addon, variation, option, quantity=1)
+
+    first = client.post("/api/v1/orders/create", json=payload, headers=headers)
+    assert first.status_code == 200
+    assert "idempotent-replayed" not in first.headers
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statements)
+    try:
+        replay = client.post("/api/v1/orders/create", json=payload, headers=headers)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statements)
+    assert replay.status_code == 200
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert replay.content == first.content
+    assert not any("products" in statement for statement in statements)
+
+    # concurrent duplicates wait for the first attempt and get its response
+    concurrent_headers = {**headers, "Idempotency-Key": "checkout-2"}
+    with ThreadPoolExecutor(4) as pool:
+        responses = list(pool.map(lambda _: client.post("/api/v1/orders/create", json=payload,
+                                                        headers=concurrent_headers), range(4)))
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.json()["id"] for response in responses}) == 1
+
+    test_db.expire_all()
+    assert test_db.query(Order).count() == 2
+    assert test_db.get(Product, product.id).stock == 8
+
+    # a key can't be reused for another order
+    payload["products"][0]["quantity"] = 2
+    assert client.post("/api/v1/orders/create", json=payload, headers=headers).status_code == 422
+
+
+def test_failed_order_releases_its_idempotency_key(client, test_db):
+    headers = {**auth_headers(client), "Idempotency-Key": "checkout"}
+    branch, product, addon, variation, option = create_catalog(test_db, stock=1)
+    payload = order_payload(branch, product, addon, variation, option, quantity=2)
+
+    assert client.post("/api/v1/orders/create", json=payload, headers=headers).status_code == 400
+    test_db.query(Product).filter(Product.id == product.id).update({"stock": 5})
+    test_db.commit()
+    response = client.post("/api/v1/orders/create", json=payload, headers=headers)
+    assert response.status_code == 200
+    assert "idempotent-replayed" not in response.headers
+
+
+def test_quote_prices_the_cart_like_an_order(client, test_db):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db)
+    discounted, *extras = create_product(test_db, branch, product.category, product.subcategory, name="discounted")
+    discounted.discount_type, discounted.discount_value = "percentage", 15
+    product.discount_value = 0.5
+    test_db.commit()
+    payload = order_payload(branch, product, addon, variation, option)
+    payload["products"] += order_payload(branch, discounted, *extras, quantity=3)["products"]
+    quote = {"branch_id": branch.id, "products": payload["products"]}
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statements)
+    try:
+        cold = client.post("/api/v1/orders/quote", json=quote)
+        cold_count = len(statements)
+        statements.clear()
+        warm = client.post("/api/v1/orders/quote", json=quote)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statements)
+    assert cold.status_code == warm.status_code == 200
+    assert cold_count == 1
+    assert statements == []
+    assert warm.json() == cold.json()
+
+    body = cold.json()
+    # 2 * (10.0 - 0.5) + (1.5 + 0.5) + 2.0 and 3 * (10.0 - 1.5) + (1.5 + 0.5) + 2.0
+    assert [float(item["total_price"]) for item in body["items"]] == [23.0, 29.5]
+    assert [float(item["discount"]) for item in body["items"]] == [1.0, 4.5]
+    assert float(body["items"][0]["tax"]) == 0.5
+    assert float(body["total_price"]) == 52.5
+
+    test_db.expire_all()
+    assert test_db.query(Order).count() == 0
+    assert test_db.get(Product, product.id).stock == 10
+
+    # the order is priced by the same engine
+    order = client.post("/api/v1/orders/create", json=payload, headers=headers)
+    assert order.status_code == 200
+    assert float(order.json()["total_price"]) == 52.5
+
+    payload["products"][0]["addons"] = [{"id": addon.id + 100}]
+    assert client.post("/api/v1/orders/quote", json={"branch_id": branch.id, "products": payload["products"]}) \
+        .status_code == 400
+    assert client.post("/api/v1/orders/quote", json={"branch_id": branch.id + 100, "products": payload["products"]}) \
+        .status_code == 404
+
+
+def test_orders_are_charged_current_prices(client, test_db):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db)
+    payload = order_payload(branch, product, addon, variation, option, quantity=1)
+    quote = {"branch_id": branch.id, "products": payload["products"]}
+    assert float(client.post("/api/v1/orders/quote", json=quote).json()["total_price"]) == 14.0
+
+    # a bulk update fires no event, like a change made through another worker it leaves this one's cache as is
+    test_db.execute(update(Product).where(Product.id == product.id).values(price=20.0))
+    test_db.commit()
+    assert float(client.post("/api/v1/orders/quote", json=quote).json()["total_price"]) == 14.0
+    order = client.post("/api/v1/orders/create", json=payload, headers=headers)
+    assert float(order.json()["total_price"]) == 24.0
+
+
+def test_orders_only_read_the_prices_of_their_products(client, test_db):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db, stock_type="unlimited")
+    other, *_ = create_product(test_db, branch, product.category, product.subcategory, name="other")
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, *args):
+        if "json_agg" in statement:
+            statements.append(parameters)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record_statement)
+    try:
+        payload = order_payload(branch, product, addon, variation, option, quantity=1)
+        assert client.post("/api/v1/orders/create", json=payload, headers=headers).status_code == 200
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record_statement)
+    # one statement, filtered on the cart's product, the rest of the branch's catalog isn't read
+    assert len(statements) == 1
+    assert product.id in statements[0] and other.id not in statements[0]
@@ -0,0 +1,405 @@
+import csv
+import io
+from datetime import datetime
+
+import orjson
+import pytest
+
+from tests.conftest import client, test_db, count_queries
+from tests.api.v1.test_admin import admin_headers
+from tests.api.v1.test_orders import auth_headers, create_catalog, create_product, order_payload
+from app.models import Branch, Category, SubCategory, Product
+from app.models.product import ProductReview, ProductSalesDelta
+from app.core.background_tasks import backfill_product_ratings, flush_product_sales
+from app.core.utils import db_utils, encode_cursor
+from app.crud.popularity import PopularityRanking
+from app.crud.products import trigram_enabled, filter_products, product_cache, export_products
+from app.schemas.product import ProductFilter, ProductsListResponse
+from app.schemas.pagination import PageParams
+from app.schemas.catalog_import import CatalogFormat
+from app.db.session import SessionLocal
+
+
+def create_products(db, count: int):
+    branch = Branch(name="main", latitude=30.0, longitude=31.0, coverage_radius=5000)
+    category = Category(name="burgers", priority=1, banner_image="", image="")
+    db.add_all([branch, category])
+    db.flush()
+    subcategory = SubCategory(name="beef", category_id=category.id)
+    db.add(subcategory)
+    db.flush()
+    products = [Product(name=f"product {index}", price=10.0, description="", image="", tags=[], stock=10,
+                        branch_id=branch.id, category_id=category.id, subcategory_id=subcategory.id)
+                for index in range(count)]
+    db.add_all(products)
+    db.commit()
+    return branch, category, products
+
+
+def collect_pages(client, url: str, limit: int):
+    ids, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        body = response.json()
+        assert len(body["items"]) <= limit
+        ids += [item["id"] for item in body["items"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+def test_list_products_is_paginated(client, test_db):
+    _, _, products = create_products(test_db, 7)
+
+    ids, pages = collect_pages(client, "/api/v1/products/list", limit=3)
+    assert ids == sorted(product.id for product in products)
+    assert pages == 3
+
+
+def test_products_by_branch_and_category_are_paginated(client, test_db):
+    branch, category, products = create_products(test_db, 5)
+
+    ids, _ = collect_pages(client, f"/api/v1/products/branch/?branch_id={branch.id}", limit=2)
+    assert ids == sorted(product.id for product in products)
+    ids, _ = collect_pages(client, f"/api/v1/products/category/?category_id={category.id}", limit=5)
+    assert ids == sorted(product.id for product in products)
+
+
+def test_list_products_page_size_is_bounded(client, test_db):
+    assert client.get("/api/v1/products/list", params={"limit": 1000}).status_code == 422
+    assert client.get("/api/v1/products/list", params={"cursor": "not a cursor"}).status_code == 400
+
+
+def test_forged_cursors_are_rejected(client, test_db):
+    branch, _, _ = create_products(test_db, 2)
+    for value in ["x", {}, [1], True, 1.5]:
+        cursor = encode_cursor(value)
+        assert client.get("/api/v1/products/list", params={"cursor": cursor}).status_code == 400
+        response = client.get("/api/v1/products/branch/", params={"branch_id": branch.id, "cursor": cursor})
+        assert (response.status_code, response.json()["detail"]) == (400, "Invalid cursor")
+
+
+def test_product_detail_is_cached_until_written(client, test_db, count_queries):
+    # an admin, who can also read the cache metrics
+    headers = admin_headers(client, test_db)
+    branch, product, addon, variation, option = create_catalog(test_db)
+    url = f"/api/v1/products/get/{product.id}"
+
+    assert client.get(url).json()["rating_count"] == 0
+    with count_queries() as counter:
+        cached = client.get(url)
+    assert cached.status_code == 200
+    assert counter.queries == 0
+
+    review = {"product_id": product.id, "rating": 4, "comment": "nice"}
+    assert client.post("/api/v1/products/create-review", json=review, headers=headers).status_code == 201
+    assert client.get(url).json()["rating_histogram"] == [0, 0, 0, 1, 0]
+
+    payload = order_payload(branch, product, addon, variation, option, quantity=3)
+    assert client.post("/api/v1/orders/create", json=payload, headers=headers).status_code == 200
+    assert client.get(url).json()["stock"] == 7
+
+    stats = client.get("/api/v1/metrics/cache", headers=headers).json()["product_detail"]
+    assert stats["hits"] >= 1 and stats["misses"] >= 3
+
+
+def test_product_detail_rendered_by_the_database_matches_the_orm(client, test_db, count_queries, monkeypatch):
+    headers = auth_headers(client)
+    branch, product, addon, variation, option = create_catalog(test_db)
+    product.tags = orjson.dumps(["spicy"]).decode()
+    test_db.commit()
+    review = {"product_id": product.id, "rating": 4, "comment": "nice"}
+    client.post("/api/v1/products/create-review", json=review, headers=headers)
+    # isoformat() keeps the trailing zeros of the microseconds and leaves out a zero fraction
+    test_db.refresh(product)
+    product.created_at, product.updated_at = datetime(2026, 1, 2, 3, 4, 5, 542520), datetime(2026, 1, 2, 3, 4, 6)
+    test_db.commit()
+    url = f"/api/v1/products/get/{product.id}"
+    orm = client.get(url)
+    assert (orm.json()["created_at"], orm.json()["updated_at"]) == ("2026-01-02T03:04:05.542520",
+                                                                    "2026-01-02T03:04:06")
+
+    monkeypatch.setattr(db_utils, "DB_JSON_RENDERING", True)
+    product_cache.clear()
+    with count_queries() as counter:
+        response = client.get(url)
+    assert counter.queries == 1
+    assert response.json() == orm.json()
+    assert response.json()["tags"] == ["spicy"] and response.json()["rating_average"] == 4.0
+    assert response.headers["etag"] == orm.headers["etag"]
+    assert client.get("/api/v1/products/get/0").status_code == 404
+
+
+def test_search_ranks_and_filters_products(client, test_db):
+    branch, category, products = create_products(test_db, 3)
+    other_branch = Branch(name="second", latitude=30.0, longitude=31.0, coverage_radius=5000)
+    test_db.add(other_branch)
+    test_db.flush()
+    products[0].name, products[0].description = "Chicken burger", "crispy"
+    products[1].name, products[1].description = "Fries", "goes well with a chicken burger"
+    products[2].name, products[2].description = "Chicken wrap", "grilled"
+    products[2].branch_id = other_branch.id
+    test_db.commit()
+
+    response = client.get("/api/v1/products/search", params={"q": "chicken burger"})
+    assert response.status_code == 200
+    # the name match outranks the description match
+    assert [item["name"] for item in response.json()] == ["Chicken burger", "Fries"]
+
+    response = client.get("/api/v1/products/search", params={"q": "chicken", "branch_id": other_branch.id})
+    assert [item["name"] for item in response.json()] == ["Chicken wrap"]
+
+    assert client.get("/api/v1/products/search", params={"q": ""}).status_code == 422
+
+
+def test_search_tolerates_typos_with_trigrams(client, test_db):
+    _, _, products = create_products(test_db, 2)
+    products[0].name = "Cheeseburger"
+    test_db.commit()
+    if not trigram_enabled(test_db):
+        pytest.skip("pg_trgm is not installed")
+
+    response = client.get("/api/v1/products/search", params={"q": "cheesburger"})
+    assert [item["name"] for item in response.json()] == ["Cheeseburger"]
+
+
+def test_filter_combines_dimensions_and_counts_facets(client, test_db):
+    branch, category, products = create_products(test_db, 4)
+    other_category = Category(name="drinks", priority=2, banner_image="", image="")
+    test_db.add(other_category)
+    test_db.flush()
+    products[0].price, products[1].price, products[2].price, products[3].price = 5.0, 15.0, 25.0, 35.0
+    products[1].stock = 0
+    products[2].category_id = other_category.id
+    products[3].is_visible = False
+    test_db.commit()
+
+    response = client.get("/api/v1/products/filter", params={"branch_id": branch.id, "min_price": 10})
+    assert response.status_code == 200
+    body = response.json()
+    # the hidden product never shows up
+    assert [item["id"] for item in body["items"]] == [products[1].id, products[2].id]
+    assert body["facets"]["total"] == 2
+    assert body["facets"]["in_stock"] == 1
+    assert body["facets"]["branches"] == [{"value": branch.id, "count": 2}]
+    assert sorted((facet["value"], facet["count"]) for facet in body["facets"]["categories"]) == \
+        sorted([(category.id, 1), (other_category.id, 1)])
+
+    response = client.get("/api/v1/products/filter", params={"category_id": category.id, "in_stock": True})
+    assert [item["id"] for item in response.json()["items"]] == [products[0].id]
+
+    assert client.get("/api/v1/products/filter", params={"min_price": 20, "max_price": 10}).status_code == 400
+
+
+def test_filter_by_tag(test_db):
+    _, _, products = create_products(test_db, 2)
+    products[0].tags = ["spicy", "new"]
+    products[1].tags = ["mild"]
+    test_db.commit()
+
+    result = filter_products(test_db, ProductFilter(tag="spicy"), PageParams())
+    assert [product.id for product in result["items"]] == [products[0].id]
+    assert result["facets"]["total"] == 1
+
+
+def test_reviews_maintain_rating_aggregates(client, test_db):
+    headers = auth_headers(client)
+    _, product, *_ = create_catalog(test_db)
+
+    reviews = []
+    for rating in (5, 3, 4):
+        response = client.post("/api/v1/products/create-review", headers=headers,
+                               json={"product_id": product.id, "rating": rating, "comment": "ok"})
+        assert response.status_code == 201
+        reviews.append(response.json()["id"])
+    assert client.put("/api/v1/products/update-review", json={"review_id": reviews[1], "rating": 1}).status_code == 200
+    assert client.post("/api/v1/products/create-review", headers=headers,
+                       json={"product_id": product.id, "rating": 6, "comment": "ok"}).status_code == 422
+
+    body = client.get(f"/api/v1/products/get/{product.id}").json()
+    assert body["rating_count"] == 3
+    assert body["rating_average"] == round(10 / 3, 2)
+    assert body["rating_histogram"] == [1, 0, 0, 1, 1]
+
+    page = client.get(f"/api/v1/products/{product.id}/reviews", params={"limit": 2}).json()
+    assert [review["id"] for review in page["items"]] == reviews[::-1][:2]
+    assert page["next_cursor"] is not None
+
+
+def test_backfill_recomputes_rating_aggregates(test_db):
+    _, products = create_products(test_db, 2)[1:]
+    for rating in (2, 2, 5):
+        test_db.add(ProductReview(product_id=products[0].id, rating=rating, comment=""))
+    products[1].rating_count, products[1].rating_sum = 7, 30
+    test_db.commit()
+
+    assert backfill_product_ratings(batch_size=1) == 2
+
+    test_db.expire_all()
+    assert (products[0].rating_count, products[0].rating_sum, products[0].rating_histogram) == (3, 9, [0, 2, 0, 0, 1])
+    assert (products[1].rating_count, products[1].rating_sum, products[1].rating_histogram) == (0, 0, [0] * 5)
+
+
+def test_catalog_endpoints_answer_revalidations_with_304(client, test_db, count_queries):
+    _, category, products = create_products(test_db, 3)
+    product = products[0]
+
+    for url in ("/api/v1/products/list", f"/api/v1/products/get/{product.id}", "/api/v1/categories/list"):
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+
+        with count_queries() as counter:
+            revalidated = client.get(url, headers={"If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+        assert counter.queries <= 1
+        if "last-modified" in response.headers:
+            assert client.get(url, headers={"If-Modified-Since": response.headers["last-modified"]}).status_code == 304
+
+    # a cold cache still answers from the row version
+    product_cache.clear()
+    detail_etag = client.get(f"/api/v1/products/get/{product.id}").headers["etag"]
+    product_cache.clear()
+    with count_queries() as counter:
+        assert client.get(f"/api/v1/products/get/{product.id}",
+                          headers={"If-None-Match": detail_etag}).status_code == 304
+    assert counter.queries == 1
+
+    list_etag = client.get("/api/v1/products/list").headers["etag"]
+    categories_etag = client.get("/api/v1/categories/list").headers["etag"]
+    product.price = 12.0
+    category.name = "grill"
+    test_db.commit()
+
+    changed = client.get(f"/api/v1/products/get/{product.id}", headers={"If-None-Match": detail_etag})
+    assert changed.status_code == 200 and changed.json()["price"] == 12.0
+    assert client.get("/api/v1/products/list", headers={"If-None-Match": list_etag}).status_code == 200
+    assert client.get("/api/v1/categories/list", headers={"If-None-Match": categories_etag}).status_code == 200
+
+    # a page's newest row says nothing of the rows removed from it, list pages only revalidate on their ETag
+    listed = client.get("/api/v1/products/list")
+    assert "last-modified" not in listed.headers
+    test_db.delete(products[-1])
+    test_db.commit()
+    since = client.get(f"/api/v1/products/get/{product.id}").headers["last-modified"]
+    removed = client.get("/api/v1/products/list", headers={"If-Modified-Since": since})
+    assert removed.status_code == 200 and len(removed.json()["items"]) == 2
+    assert client.get("/api/v1/products/list", headers={"If-None-Match": listed.headers["etag"]}).status_code == 200
+
+
+def test_listings_render_tags_as_lists(client, test_db):
+    _, _, products = create_products(test_db, 2)
+    products[0].tags = ["spicy"]
+    # rows saved with the tags already encoded as a JSON string still render as a list
+    products[1].tags = '["mild"]'
+    test_db.commit()
+
+    response = client.get("/api/v1/products/list")
+    assert response.headers["content-type"] == "application/json"
+    assert [item["tags"] for item in response.json()["items"]] == [["spicy"], ["mild"]]
+    assert client.get(f"/api/v1/products/get/{products[1].id}").json()["tags"] == ["mild"]
+
+
+def test_sales_feed_total_sales_and_popular_rankings(client, test_db, count_queries):
+    headers = auth_headers(client)
+    branch, *classic = create_catalog(test_db, stock=100)
+    product = classic[0]
+    category, subcategory = test_db.get(Category, product.category_id), test_db.get(SubCategory, product.subcategory_id)
+    double = create_product(test_db, branch, category, subcategory, name="double", stock=100)
+    drinks = Category(name="drinks", priority=2, banner_image="", image="")
+    test_db.add(drinks)
+    test_db.flush()
+    soda = create_product(test_db, branch, drinks, subcategory, name="cola", stock=100)
+    other, cola = double[0], soda[0]
+
+    orders = []
+    for line, quantity in ((classic, 2), (double, 3), (classic, 4), (soda, 1)):
+        response = client.post("/api/v1/orders/create", json=order_payload(branch, *line, quantity=quantity),
+                               headers=headers)
+        assert response.status_code == 200
+        orders.append(response.json()["id"])
+    # nothing touches the product rows until the flush
+    assert test_db.query(ProductSalesDelta).count() == 4
+    assert client.get("/api/v1/products/popular").json() == []
+
+    assert flush_product_sales(batch_size=3) == sorted([product.id, other.id, cola.id])
+    assert test_db.query(ProductSalesDelta).count() == 0
+    test_db.expire_all()
+    assert (product.total_sales, other.total_sales, cola.total_sales) == (6, 3, 1)
+
+    # the flush merged its sales into the cached rankings, nothing is reloaded
+    with count_queries() as counter:
+        popular = client.get("/api/v1/products/popular").json()
+    assert counter.queries == 0
+    assert [(item["id"], item["total_sales"]) for item in popular] == [(product.id, 6), (other.id, 3), (cola.id, 1)]
+    by_category = client.get("/api/v1/products/popular", params={"category_id": drinks.id, "limit": 5}).json()
+    assert [item["id"] for item in by_category] == [cola.id]
+    by_branch = client.get("/api/v1/products/popular", params={"branch_id": branch.id, "limit": 2}).json()
+    assert [item["id"] for item in by_branch] == [product.id, other.id]
+    assert client.get("/api/v1/products/popular", params={"branch_id": branch.id, "category_id": drinks.id}) \
+        .status_code == 400
+
+    # a cancelled order takes its sales back
+    assert client.put(f"/api/v1/orders/cancel/{orders[2]}", headers=headers).status_code == 200
+    flush_product_sales()
+    test_db.expire_all()
+    assert product.total_sales == 2
+    popular = client.get("/api/v1/products/popular").json()
+    assert [item["id"] for item in popular] == [other.id, product.id, cola.id]
+
+
+def ranked_product(product_id: int, total_sales: int, branch_id: int = 1, category_id: int = 1):
+    return ProductsListResponse(id=product_id, name=f"product {product_id}", price=1.0, description="", image="",
+                                stock=0, created_at=datetime(2024, 1, 1), total_sales=total_sales,
+                                category_id=category_id, subcategory_id=1, branch_id=branch_id)
+
+
+def test_popularity_merge_falls_back_when_a_full_ranking_loses_ground():
+    ranking = PopularityRanking()
+    ranking.overall = [ranked_product(1, 9), ranked_product(2, 5)]
+    ranking.by_branch = {1: list(ranking.overall)}
+    ranking.by_category = {1: list(ranking.overall)}
+
+    # 3 overtakes 2 in a full ranking of 2, and moves to another category
+    merged = ranking.merged([ranked_product(3, 7, category_id=2)], [3], top_k=2)
+    assert [product.id for product in merged.overall] == [1, 3]
+    assert [product.id for product in merged.by_category[1]] == [1, 2]
+    assert [product.id for product in merged.by_category[2]] == [3]
+    assert [product.id for product in ranking.overall] == [1, 2]
+
+    # a cancellation moves 2 down, products past the end may now rank above it
+    assert ranking.merged([ranked_product(2, 1)], [2], top_k=2) is None
+    # below a full ranking nothing is hidden
+    assert [product.id for product in ranking.merged([ranked_product(2, 1)], [2], top_k=3).overall] == [1, 2]
+    # unlisted products leave it
+    assert ranking.merged([], [1], top_k=3).overall == [ranking.overall[1]]
+
+
+def test_export_streams_listed_products(client, test_db):
+    _, _, products = create_products(test_db, 7)
+    products[0].is_visible = False
+    products[1].tags = ["spicy"]
+    test_db.commit()
+    listed = [product.id for product in products[1:]]
+
+    chunks = list(export_products(SessionLocal(), CatalogFormat.NDJSON, batch_size=4))
+    assert [chunk.count(b"\n") for chunk in chunks] == [4, 2]
+
+    response = client.get("/api/v1/products/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    documents = [orjson.loads(line) for line in response.content.splitlines()]
+    assert [document["id"] for document in documents] == listed
+    assert documents[0]["tags"] == ["spicy"] and documents[0]["addons"] == []
+
+    response = client.get("/api/v1/products/export", params={"format": "csv"})
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(row["id"]) for row in rows] == listed
+    assert orjson.loads(rows[0]["tags"]) == ["spicy"]
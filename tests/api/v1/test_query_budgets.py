@@ -0,0 +1,69 @@
+import pytest
+
+from tests.conftest import client, test_db, count_queries
+from app.models import Branch, Category, SubCategory, Product, Addon, ProductVariation, VariationOption
+from app.models.product import ProductReview
+
+PRODUCTS = 12
+ADDONS = VARIATIONS = OPTIONS = 3
+REVIEWS = 5
+CATEGORIES = 3
+SUBCATEGORIES = 4
+PAGE = 10
+
+
+@pytest.fixture
+def catalog(test_db):
+    branch = Branch(name="main", latitude=30.0, longitude=31.0, coverage_radius=5000)
+    categories = [Category(name=f"category {index}", priority=index, banner_image="", image="")
+                  for index in range(CATEGORIES)]
+    test_db.add(branch)
+    test_db.add_all(categories)
+    test_db.flush()
+    for category in categories:
+        category.subcategories = [SubCategory(name=f"{category.name} sub {index}") for index in range(SUBCATEGORIES)]
+    test_db.flush()
+
+    category, subcategory = categories[0], categories[0].subcategories[0]
+    for index in range(PRODUCTS):
+        product = Product(name=f"product {index}", price=10.0, description="", image="", tags=[], stock=10,
+                          branch_id=branch.id, category_id=category.id, subcategory_id=subcategory.id)
+        product.addons = [Addon(title=f"addon {i}", price=1.0, tax=0.0) for i in range(ADDONS)]
+        product.variations = [
+            ProductVariation(title=f"variation {i}", type="single",
+                             options=[VariationOption(name=f"option {j}", price=1.0) for j in range(OPTIONS)])
+            for i in range(VARIATIONS)
+        ]
+        product.reviews = [ProductReview(rating=5, comment="good") for _ in range(REVIEWS)]
+        test_db.add(product)
+    test_db.commit()
+    return {"branch": branch.id, "category": category.id, "subcategory": subcategory.id, "product": product.id}
+
+
+# endpoint -> (max queries, max rows fetched)
+BUDGETS = {
+    # validators (ids and versions of the page) + page
+    f"/api/v1/products/list?limit={PAGE}": (2, 2 * (PAGE + 1)),
+    f"/api/v1/products/branch/?branch_id={{branch}}&limit={PAGE}": (1, PAGE + 1),
+    f"/api/v1/products/category/?category_id={{category}}&limit={PAGE}": (1, PAGE + 1),
+    f"/api/v1/products/subcategory/?subcategory_id={{subcategory}}&limit={PAGE}": (1, PAGE + 1),
+    # product, addons, variations, options
+    "/api/v1/products/get/{product}": (4, 1 + ADDONS + VARIATIONS + VARIATIONS * OPTIONS),
+    "/api/v1/products/{product}/reviews?limit=3": (1, 3 + 1),
+    # product counts (a row per category and subcategory at most) + categories + subcategories, then cached
+    "/api/v1/categories/list": (3, 2 * (CATEGORIES + CATEGORIES * SUBCATEGORIES)),
+    "/api/v1/categories/get/{category}": (2, 1 + SUBCATEGORIES),
+    "/api/v1/categories/get/{category}/subcategories": (1, SUBCATEGORIES),
+}
+
+
+@pytest.mark.parametrize("url", list(BUDGETS))
+def test_endpoint_query_budget(client, catalog, count_queries, url):
+    max_queries, max_rows = BUDGETS[url]
+
+    with count_queries() as counter:
+        response = client.get(url.format(**catalog))
+
+    assert response.status_code == 200
+    assert counter.queries <= max_queries, counter.statements
+    assert counter.rows <= max_rows
@@ -1,10 +1,27 @@
+import os
+
 import pytest
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
 from fastapi.testclient import TestClient
 
+# the tests flush the sales themselves
+os.environ["SALES_FLUSH_INTERVAL"] = "0"
+os.environ["IDEMPOTENCY_PURGE_INTERVAL"] = "0"
+
 from main import app
 from app.db.base import Base
 from app.db.session import engine
+from app.crud.products import product_cache
+from app.crud.branches import branch_index_cache
+from app.crud.popularity import popularity_cache
+from app.crud.categories import category_tree_cache
+from app.crud.menus import menu_cache
+from app.crud.order.pricing import price_cache
+from app.crud.coupons import coupon_index_cache
+
+# The suite sends far more than 100 requests a minute from the same client
+app.state.limiter.enabled = False
 
 # Setup the test database session
 TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -18,9 +35,51 @@ def test_db():
     session.rollback()
     session.close()
     Base.metadata.drop_all(bind=engine)
+    # ids are reused once the tables are recreated
+    product_cache.clear()
+    branch_index_cache.clear()
+    popularity_cache.clear()
+    category_tree_cache.clear()
+    menu_cache.clear()
+    price_cache.clear()
+    coupon_index_cache.clear()
 
 
 @pytest.fixture(scope="module")
 def client():
     with TestClient(app) as client:
         yield client
+
+
+class QueryCounter:
+    """
+    Counts the statements sent to the database and the rows they returned while active.
+    """
+
+    def __init__(self, *engines):
+        self.engines = engines or (engine,)
+        self.statements = []
+        self.rows = 0
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        if cursor.description is not None:
+            self.rows += max(cursor.rowcount, 0)
+
+    @property
+    def queries(self) -> int:
+        return len(self.statements)
+
+    def __enter__(self):
+        for bind in self.engines:
+            event.listen(bind, "after_cursor_execute", self._after_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        for bind in self.engines:
+            event.remove(bind, "after_cursor_execute", self._after_cursor_execute)
+
+
+@pytest.fixture
+def count_queries():
+    return QueryCounter
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from app.core.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_and_least_recently_used_are_evicted():
+    clock = FakeClock()
+    cache = TTLCache("test", maxsize=2, ttl=10, timer=clock)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"
+    cache.set(3, "c")  # 2 is the least recently used
+    assert cache.get(2) is None
+    assert cache.stats()["evictions"] == 1
+
+    clock.now = 11
+    assert cache.get(1) is None
+    assert cache.stats()["size"] == 1  # 3 has expired too but is only dropped when looked up
+
+
+def test_concurrent_misses_load_once():
+    cache = TTLCache("test", maxsize=10, ttl=60)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("key", loader))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["value"] * 10
+    assert len(calls) == 1
+    assert cache.get("key") == "value"
+
+
+def test_value_loaded_during_invalidation_is_not_stored():
+    cache = TTLCache("test", maxsize=10, ttl=60)
+
+    def loader():
+        cache.invalidate("key")  # a write committed while the old row was being read
+        return "stale"
+
+    assert cache.get_or_load("key", loader) == "stale"
+    assert cache.get("key") is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_replaced_values_keep_their_expiry():
+    clock = FakeClock()
+    cache = TTLCache("test", maxsize=10, ttl=10, timer=clock)
+    cache.set("key", "old")
+    generation = cache.generation
+    clock.now = 5
+    cache.replace("key", "new", generation)
+    assert cache.get("key") == "new"
+    cache.replace("missing", "value")
+    assert "missing" not in cache
+
+    cache.invalidate("other")
+    cache.replace("key", "stale", generation)
+    assert cache.get("key") == "new"
+    clock.now = 10
+    assert cache.get("key") is None
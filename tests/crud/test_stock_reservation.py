@@ -0,0 +1,78 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import NullPool
+
+from tests.conftest import test_db
+from app.core.utils.products import reserve_product_stocks, check_stock_type, InsufficientStockError
+from app.db.session import ASYNC_SQLALCHEMY_DATABASE_URL
+from app.models import Product
+
+
+def create_product(db, name: str, stock: int, stock_type: str = "fixed", **kwargs) -> Product:
+    product = Product(name=name, price=1.0, stock=stock, stock_type=stock_type, **kwargs)
+    db.add(product)
+    db.commit()
+    return product
+
+
+async def reserve(engine, quantities: dict) -> bool:
+    async with AsyncSession(engine) as db:
+        try:
+            await reserve_product_stocks(db, quantities)
+            await db.commit()
+            return True
+        except InsufficientStockError:
+            await db.rollback()
+            return False
+
+
+def run_reservations(*batches: dict) -> list:
+    async def run():
+        engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+        try:
+            return await asyncio.gather(*(reserve(engine, quantities) for quantities in batches))
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_no_oversell_under_concurrency(test_db):
+    product = create_product(test_db, "limited", stock=20)
+
+    results = run_reservations(*({product.id: 1} for _ in range(50)))
+
+    test_db.expire_all()
+    assert sum(results) == 20
+    assert test_db.get(Product, product.id).stock == 0
+
+
+def test_reservation_is_all_or_nothing(test_db):
+    plenty = create_product(test_db, "plenty", stock=10)
+    short = create_product(test_db, "short", stock=1)
+
+    assert run_reservations({plenty.id: 2, short.id: 2}) == [False]
+
+    test_db.expire_all()
+    assert test_db.get(Product, plenty.id).stock == 10
+    assert test_db.get(Product, short.id).stock == 1
+
+
+def test_daily_stock_is_refilled(test_db):
+    product = create_product(test_db, "daily", stock=0, stock_type="DAILY", stock_daily=5,
+                             last_daily_stock_update=date.today() - timedelta(days=1))
+
+    assert run_reservations({product.id: 2}) == [True]
+
+    test_db.expire_all()
+    product = test_db.get(Product, product.id)
+    assert product.stock == 3
+    assert product.last_daily_stock_update == date.today()
+
+
+def test_unknown_stock_type_is_rejected():
+    with pytest.raises(ValueError):
+        check_stock_type(Product(stock_type="weekly"))
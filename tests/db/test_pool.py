@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.pool import QueuePool
+
+from tests.conftest import client, test_db
+from tests.api.v1.test_admin import admin_headers
+from tests.api.v1.test_orders import auth_headers
+from app.crud.order import get_orders
+from app.db.pool import PoolStats, instrumented_pool_class
+from app.db.session import SQLALCHEMY_DATABASE_URL
+
+
+def test_pool_exhaustion_is_recorded():
+    stats = PoolStats("test")
+    test_engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=instrumented_pool_class(QueuePool, stats),
+                                pool_size=1, max_overflow=0, pool_timeout=0.1)
+    try:
+        with test_engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            with pytest.raises(exc.TimeoutError):
+                test_engine.connect()
+
+        snapshot = stats.snapshot(test_engine.pool)
+        assert snapshot["checkouts"] == 1
+        assert snapshot["timeouts"] == 1
+        assert snapshot["checked_out"] == 0
+        assert snapshot["wait_time_max_ms"] >= 100
+    finally:
+        test_engine.dispose()
+
+
+def test_pool_metrics_endpoint(client, test_db):
+    assert client.get("/api/v1/metrics/db-pool").status_code == 401
+    response = client.get("/api/v1/metrics/db-pool", headers=admin_headers(client, test_db))
+    assert response.status_code == 200
+    assert {"primary", "primary_async"} <= response.json().keys()
+    assert "checked_out" in response.json()["primary"]
+
+
+def test_pool_timeout_in_order_history_is_a_503(client, test_db, monkeypatch):
+    headers = auth_headers(client)
+
+    def exhausted(*args, **kwargs):
+        raise exc.TimeoutError("QueuePool limit reached")
+
+    monkeypatch.setattr(get_orders, "paginate", exhausted)
+    response = client.get("/api/v1/orders/list", headers=headers)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.requests import Request
+
+from tests.conftest import test_db
+from tests.api.v1.test_orders import create_catalog
+from app.crud.products import get_product_detail
+from app.db.routing import RoutingSession, PrimaryPins, request_pin_key, read_from_primary
+from app.db.session import engine, SQLALCHEMY_DATABASE_URL, DB_NAME
+
+REPLICA_DB_NAME = f"{DB_NAME}_replica"
+
+
+@pytest.fixture(scope="module")
+def replica_engine():
+    # a second database on the same server stands in for the replica
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            exists = connection.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"),
+                                        {"name": REPLICA_DB_NAME}).first()
+            if not exists:
+                connection.execute(text(f'CREATE DATABASE "{REPLICA_DB_NAME}"'))
+    except SQLAlchemyError:
+        pytest.skip("Can't create the replica database")
+    replica = create_engine(SQLALCHEMY_DATABASE_URL.rsplit("/", 1)[0] + f"/{REPLICA_DB_NAME}")
+    yield replica
+    replica.dispose()
+
+
+def test_read_only_session_uses_replica(replica_engine):
+    with RoutingSession(primary=engine, replicas=[replica_engine]) as session:
+        session.info["read_only"] = True
+        assert session.execute(text("SELECT current_database()")).scalar() == REPLICA_DB_NAME
+
+
+def test_default_session_uses_primary(replica_engine):
+    with RoutingSession(primary=engine, replicas=[replica_engine]) as session:
+        assert session.execute(text("SELECT current_database()")).scalar() == DB_NAME
+
+
+def test_cache_loads_read_from_the_primary(replica_engine, test_db):
+    branch, product, *_ = create_catalog(test_db)
+    with RoutingSession(primary=engine, replicas=[replica_engine]) as session:
+        session.info["read_only"] = True
+        with read_from_primary(session):
+            assert session.execute(text("SELECT current_database()")).scalar() == DB_NAME
+        assert session.info["read_only"]
+        # the replica database has no tables, the miss is only loaded because it goes to the primary
+        assert b'"classic"' in get_product_detail(session, product.id).body
+
+
+def test_pinned_client():
+    pins = PrimaryPins(window=60)
+    request = Request({"type": "http", "method": "GET", "headers": [], "client": ("10.0.0.1", 1234)})
+    key = request_pin_key(request)
+    assert not pins.is_pinned(key)
+    pins.pin(key)
+    assert pins.is_pinned(key)
+    assert not PrimaryPins(window=0).is_pinned(key)